@@ -0,0 +1,92 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from build_fixtures import FIXTURES_PATH, load_fixtures
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from loinc_json import JsonDecoder, available_backends # noqa: E402
+
+# --- Benchmark Configuration ---
+DEFAULT_REPEAT = 5 # Timed passes over all recorded responses; the best one is reported
+
+# Search API fields the scripts never read. The fixtures only record the read ones, so every
+# hit is padded with these to match the size and shape of real responses.
+UNREAD_FIELDS = {
+    "VersionLastChanged": "2.77", "CHNG_TYPE": "MIN", "DefinitionDescription": "", "CONSUMER_NAME": "",
+    "FORMULA": "", "EXMPL_ANSWERS": "", "SURVEY_QUEST_TEXT": "", "SURVEY_QUEST_SRC": "", "UNITSREQUIRED": "Y",
+    "ORDER_OBS": "Both", "HL7_FIELD_SUBFIELD_ID": "", "EXTERNAL_COPYRIGHT_NOTICE": "", "EXAMPLE_UCUM_UNITS": "",
+    "STATUS_REASON": "", "STATUS_TEXT": "", "CHANGE_REASON_PUBLIC": "", "COMMON_TEST_RANK": 0,
+    "COMMON_ORDER_RANK": 0, "HL7_ATTACHMENT_STRUCTURE": "", "EXTERNAL_COPYRIGHT_LINK": "",
+    "AskAtOrderEntry": "", "AssociatedObservations": "", "VersionFirstReleased": "2.36",
+    "ValidHL7AttachmentRequest": "",
+}
+
+
+def recorded_bodies(fixtures_path=FIXTURES_PATH, pad=True):
+    """One encoded Search API response per recorded search, plus the total number of hits."""
+    bodies, hit_count = [], 0
+    for query, hits in load_fixtures(fixtures_path)["searches"].items():
+        if pad:
+            hits = [{**hit, **UNREAD_FIELDS, "RELATEDNAMES2": "; ".join(hit["LONG_COMMON_NAME"].split()),
+                     "DisplayName": hit["LONG_COMMON_NAME"]} for hit in hits]
+        response = {"ResponseSummary": {"Query": query, "RecordsFound": len(hits), "RowsReturned": len(hits)},
+                    "Results": hits}
+        bodies.append(json.dumps(response).encode("utf-8"))
+        hit_count += len(hits)
+    return bodies, hit_count
+
+
+def measure(decode, bodies, hit_count, repeat=DEFAULT_REPEAT):
+    """Best decode time per hit, plus live allocations (blocks, bytes) per hit while the results are held."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            decode(body)
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    held = [decode(body) for body in bodies]
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sys.getallocatedblocks() - blocks_before
+    del held
+    return {"us_per_hit": round(best / hit_count * 1e6, 3), "blocks_per_hit": round(blocks / hit_count, 1),
+            "bytes_per_hit": round(retained / hit_count), "peak_kb": round(peak / 1024)}
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare JSON decoding of recorded Search API responses.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed passes (best is reported)")
+    parser.add_argument("--read-fields-only", action="store_true",
+                        help="Decode the recorded hits as they are, without the unread Search API fields")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    bodies, hit_count = recorded_bodies(args.fixtures, pad=not args.read_fields_only)
+    print(f"{len(bodies)} recorded responses, {hit_count} hits, {sum(map(len, bodies)) / 1024:.0f} KB of JSON")
+    print(f"{'backend':<10}{'mode':<10}{'us/hit':>9}{'blocks/hit':>12}{'bytes/hit':>11}{'peak KB':>9}")
+    results = {}
+    for backend in available_backends():
+        decoder = JsonDecoder(backend)
+        for mode, decode in (("loads", decoder.loads), ("search", decoder.search_response)):
+            result = measure(decode, bodies, hit_count, args.repeat)
+            results[f"{backend}/{mode}"] = result
+            print(f"{backend:<10}{mode:<10}{result['us_per_hit']:>9.2f}{result['blocks_per_hit']:>12.1f}"
+                  f"{result['bytes_per_hit']:>11}{result['peak_kb']:>9}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"hits": hit_count, "padded": not args.read_fields_only, "results": results}, f, indent=2)
+        print(f"Saved results to {args.json}")
@@ -0,0 +1,119 @@
+import argparse
+import csv
+import gzip
+import json
+import os
+import re
+
+# --- Fixture Sources ---
+# Responses are rebuilt from result files the scripts wrote against the real APIs, so the
+# mock answers with recorded LOINC content (names, codes, panel members) instead of noise.
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH_RESULT_FILES = ["loinc_tests_detailed.csv", "loinc_parameters_detailed.csv"]
+MAPPING_WORKBOOK = "loinc_mapping_results_with_lcn.xlsx" # Panel members + their Long Common Names
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "loinc_fixtures.json.gz")
+
+# fetch_loinc.py result column -> Search API field
+SEARCH_FIELDS = {
+    "loinc": "LOINC_NUM", "long_common_name": "LONG_COMMON_NAME", "status": "STATUS", "class_type": "CLASSTYPE",
+    "component": "COMPONENT", "property": "PROPERTY", "time_aspect": "TIME_ASPCT", "system": "SYSTEM",
+    "scale_type": "SCALE_TYP", "method_type": "METHOD_TYP", "example_units": "EXAMPLE_UNITS", "class": "CLASS",
+    "short_name": "SHORTNAME",
+}
+# loinc_aggreg.py sheet column -> Search API field
+SHEET_FIELDS = {
+    "loinc_test_code": "LOINC_NUM", "loinc_test_long_name": "LONG_COMMON_NAME", "loinc_test_status": "STATUS",
+    "loinc_test_class_type": "CLASSTYPE", "loinc_test_component": "COMPONENT", "loinc_test_property": "PROPERTY",
+    "loinc_test_time": "TIME_ASPCT", "loinc_test_system": "SYSTEM", "loinc_test_scale": "SCALE_TYP",
+    "loinc_test_method": "METHOD_TYP", "loinc_test_class": "CLASS", "loinc_test_short_name": "SHORTNAME",
+}
+LOINC_CODE_PATTERN = re.compile(r"^\d{1,7}-\d$")
+
+
+def query_key(query):
+    """How the mock matches a search query to a recorded answer."""
+    return " ".join(query.strip().strip('"').lower().split())
+
+
+def _clean(value):
+    if value is None or value != value: # None / NaN
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _hit(row, fields):
+    hit = {api_field: _clean(row.get(column)) for column, api_field in fields.items()}
+    try:
+        hit["CLASSTYPE"] = int(hit["CLASSTYPE"])
+    except (TypeError, ValueError):
+        pass
+    return hit
+
+
+def build_fixtures(repo_dir=REPO_DIR):
+    """Returns {"searches", "codes", "questionnaires", "names"} built from the repo's result files."""
+    searches = {}   # query key -> list of hits, in recorded rank order
+    codes = {}      # LOINC code -> hit (answers exact-code searches)
+    for filename in SEARCH_RESULT_FILES:
+        with open(os.path.join(repo_dir, filename), newline="", encoding="utf-8") as csv_file:
+            for row in csv.DictReader(csv_file):
+                if not LOINC_CODE_PATTERN.match(row.get("loinc") or ""):
+                    continue # Error/placeholder rows were never API answers
+                hit = _hit(row, SEARCH_FIELDS)
+                searches.setdefault(query_key(row["search_term"]), []).append(hit)
+                codes.setdefault(hit["LOINC_NUM"], hit)
+
+    questionnaires = {} # panel code -> member codes
+    names = {}          # LOINC code -> Long Common Name (answers batch $lookup)
+    import openpyxl # Only needed to rebuild the fixtures
+    workbook = openpyxl.load_workbook(os.path.join(repo_dir, MAPPING_WORKBOOK), read_only=True)
+    for sheet in workbook.worksheets[1:]: # First sheet is the summary
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            continue
+        for values in rows:
+            row = dict(zip(header, values))
+            code = row.get("loinc_test_code")
+            if not code or not LOINC_CODE_PATTERN.match(str(code)):
+                continue
+            member_codes = str(row.get("loinc_parameter_codes") or "").split("\n")
+            member_names = str(row.get("loinc_parameter_names") or "").split("\n")
+            is_panel = all(LOINC_CODE_PATTERN.match(c) for c in member_codes)
+            hit = {**_hit(row, SHEET_FIELDS), "PanelType": "Panel" if is_panel else ""}
+            recorded = searches.setdefault(query_key(row["search_term"]), [])
+            if all(existing["LOINC_NUM"] != code for existing in recorded):
+                recorded.append(hit)
+            codes.setdefault(code, hit)
+            names.setdefault(code, hit["LONG_COMMON_NAME"])
+            if is_panel:
+                questionnaires[code] = member_codes
+                for member_code, member_name in zip(member_codes, member_names):
+                    names.setdefault(member_code, member_name)
+    workbook.close()
+    for code, hit in codes.items():
+        names.setdefault(code, hit["LONG_COMMON_NAME"])
+    return {"searches": searches, "codes": codes, "questionnaires": questionnaires, "names": names}
+
+
+def load_fixtures(path=FIXTURES_PATH):
+    with gzip.open(path, "rt", encoding="utf-8") as fixture_file:
+        return json.load(fixture_file)
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the mock server fixtures from the repo's result files.")
+    parser.add_argument("--output", default=FIXTURES_PATH, help="Fixture file (.json.gz)")
+    args = parser.parse_args()
+
+    fixtures = build_fixtures()
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    payload = json.dumps(fixtures, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    with gzip.GzipFile(args.output, "wb", mtime=0) as fixture_file: # mtime=0: rebuilds are byte-identical
+        fixture_file.write(payload)
+    print(f"Wrote {args.output}: {len(fixtures['searches'])} searches, {len(fixtures['codes'])} codes, "
+          f"{len(fixtures['questionnaires'])} panels, {len(fixtures['names'])} names "
+          f"({os.path.getsize(args.output) / 1024:.0f} KB)")
@@ -0,0 +1,221 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from build_fixtures import FIXTURES_PATH, load_fixtures, query_key
+
+# --- Mock Server Defaults ---
+DEFAULT_PORT = 8765
+DEFAULT_LATENCY_MS = 25.0    # Mean added response time
+DEFAULT_JITTER_MS = 10.0     # +/- uniform spread around the mean
+DEFAULT_RETRY_AFTER = 0.2    # Seconds, sent with injected 429s
+
+# Field-qualified clauses in a search query ("STATUS:ACTIVE", "NOT SCALE_TYP:Doc"), see loinc_filters.py
+FIELD_CLAUSE_PATTERN = re.compile(r"(?:^|\s)(NOT\s+)?([A-Z_]+):(\S+)")
+
+
+def split_field_clauses(query):
+    """Returns (query without field clauses, [(negated, field, value), ...])."""
+    clauses = [(bool(negated), field, value) for negated, field, value in FIELD_CLAUSE_PATTERN.findall(query)]
+    return FIELD_CLAUSE_PATTERN.sub(" ", query).strip(), clauses
+
+
+def filter_hits(hits, clauses):
+    for negated, field, value in clauses:
+        hits = [hit for hit in hits if (str(hit.get(field, "")).lower() == value.lower()) != negated]
+    return hits
+
+
+class FaultConfig:
+    """Latency and failures the mock adds to every request.
+
+    `error_rate` of requests get a 503 and `throttle_rate` a 429 with
+    Retry-After: `retry_after`, before any fixture is looked up."""
+
+    def __init__(self, latency_ms=DEFAULT_LATENCY_MS, jitter_ms=DEFAULT_JITTER_MS, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=DEFAULT_RETRY_AFTER, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+    def as_dict(self):
+        return {"latency_ms": self.latency_ms, "jitter_ms": self.jitter_ms, "error_rate": self.error_rate,
+                "throttle_rate": self.throttle_rate, "retry_after": self.retry_after}
+
+
+class MockLoincServer(ThreadingHTTPServer):
+    """Stand-in for the LOINC Search API and FHIR server, replaying recorded fixtures.
+
+    Routes:
+      GET  .../searchapi/loincs?query=...[&rows=&offset=] (field clauses such as
+           STATUS:ACTIVE are applied)
+      GET  .../Questionnaire/?url=http://loinc.org/q/<code>
+      POST a FHIR batch Bundle of CodeSystem/$lookup entries
+    Unknown queries get an empty result, like the real API."""
+
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, faults=None):
+        super().__init__(address, MockLoincHandler)
+        self.fixtures = fixtures
+        self.faults = faults or FaultConfig()
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key):
+        with self._stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {}
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="mock-loinc-server", daemon=True)
+        thread.start()
+        return self
+
+
+class MockLoincHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real servers
+    disable_nagle_algorithm = True # Headers and body go out in separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body, status=200):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _inject_faults(self):
+        """Sleeps for the configured latency; returns True if a failure was sent instead of an answer."""
+        faults = self.server.faults
+        delay_ms = faults.latency_ms + faults.random.uniform(-faults.jitter_ms, faults.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+        roll = faults.random.random()
+        if roll < faults.error_rate:
+            self.server.count("injected_503")
+            self._send_empty(503)
+            return True
+        if roll < faults.error_rate + faults.throttle_rate:
+            self.server.count("injected_429")
+            self._send_empty(429, {"Retry-After": str(faults.retry_after)})
+            return True
+        return False
+
+    def do_GET(self):
+        self.server.count("requests")
+        if self._inject_faults():
+            return
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        fixtures = self.server.fixtures
+        if url.path.rstrip("/").endswith("/searchapi/loincs"):
+            query = params.get("query", [""])[0]
+            plain_query, clauses = split_field_clauses(query)
+            if plain_query.strip('"') in fixtures["codes"]:
+                hits = [fixtures["codes"][plain_query.strip('"')]]
+            else:
+                hits = fixtures["searches"].get(query_key(plain_query))
+                if hits is None:
+                    self.server.count("search_misses")
+                    hits = []
+            hits = filter_hits(hits, clauses)
+            if params.get("rows"):
+                offset = int(params.get("offset", ["0"])[0])
+                hits = hits[offset:offset + int(params["rows"][0])]
+            self.server.count("searches")
+            self._send_json({"ResponseSummary": {"RecordsFound": len(hits)}, "Results": hits})
+        elif url.path.rstrip("/").endswith("/Questionnaire"):
+            code = params.get("url", [""])[0].rsplit("/", 1)[-1]
+            self.server.count("questionnaires")
+            members = fixtures["questionnaires"].get(code)
+            if members is None:
+                self._send_json({"resourceType": "Bundle", "type": "searchset", "total": 0})
+                return
+            questionnaire = {"resourceType": "Questionnaire", "id": code,
+                             "item": [{"linkId": str(i), "code": [{"system": "http://loinc.org", "code": member}]}
+                                      for i, member in enumerate(members, start=1)]}
+            self._send_json({"resourceType": "Bundle", "type": "searchset", "total": 1,
+                             "entry": [{"resource": questionnaire}]})
+        else:
+            self._send_empty(404)
+
+    def do_POST(self):
+        self.server.count("requests")
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) # Always drain the body so the connection stays usable
+        if self._inject_faults():
+            return
+        try:
+            bundle = json.loads(body)
+        except ValueError:
+            self._send_empty(400)
+            return
+        self.server.count("batches")
+        names = self.server.fixtures["names"]
+        entries = []
+        for entry in bundle.get("entry", []):
+            code = parse_qs(urlparse(entry.get("request", {}).get("url", "")).query).get("code", [""])[0]
+            if code in names:
+                resource = {"resourceType": "Parameters",
+                            "parameter": [{"name": "name", "valueString": "LOINC"},
+                                          {"name": "display", "valueString": names[code]}]}
+                entries.append({"resource": resource, "response": {"status": "200 OK"}})
+            else:
+                entries.append({"response": {"status": "404 Not Found"}})
+        self._send_json({"resourceType": "Bundle", "type": "batch-response", "entry": entries})
+
+
+def start_server(faults=None, port=0, fixtures_path=FIXTURES_PATH):
+    """Starts a MockLoincServer on 127.0.0.1 in a background thread (port 0 = any free port)."""
+    return MockLoincServer(("127.0.0.1", port), load_fixtures(fixtures_path), faults).start()
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recorded LOINC Search API / FHIR responses locally.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=DEFAULT_JITTER_MS)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=DEFAULT_RETRY_AFTER)
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    args = parser.parse_args()
+
+    server = MockLoincServer(("127.0.0.1", args.port), load_fixtures(args.fixtures),
+                             FaultConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate,
+                                         args.retry_after))
+    print(f"Mock LOINC server on {server.base_url}")
+    print(f"  export LOINC_SEARCH_API_URL={server.base_url}/searchapi/loincs")
+    print(f"  export LOINC_FHIR_BASE_URL={server.base_url}/fhir/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nStopped. {server.stats}")
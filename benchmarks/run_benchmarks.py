@@ -0,0 +1,199 @@
+import argparse
+import json
+import math
+import os
+import platform
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError: # Windows: peak RSS is not reported
+    resource = None
+
+from mock_server import FaultConfig, start_server
+
+# --- Benchmark Configuration ---
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_PATH = os.path.join(BENCH_DIR, "results", "results.json") # Committed baseline
+BENCH_REQUESTS_PER_SECOND = 50.0 # Well above the production 8 rps so client-side costs, not pacing, dominate
+REGRESSION_TOLERANCE = 0.15      # --check fails if a scenario's terms/sec drops by more than this
+
+FAULTS = {"error_rate": 0.05, "throttle_rate": 0.05} # "_faults" scenarios: 5% 503s + 5% 429s
+SCENARIOS = {
+    "fetch_loinc": {"script": "fetch_loinc.py", "args": [], "faults": {}},
+    "fetch_loinc_faults": {"script": "fetch_loinc.py", "args": [], "faults": FAULTS},
+    "aggreg": {"script": "loinc_aggreg.py", "faults": {},
+               "args": ["--input", os.path.join(REPO_DIR, "test_to_param_mapping.csv"),
+                        "--output-format", "csv", "--output", "mapping.csv"]},
+    "aggreg_faults": {"script": "loinc_aggreg.py", "faults": FAULTS,
+                      "args": ["--input", os.path.join(REPO_DIR, "test_to_param_mapping.csv"),
+                               "--output-format", "csv", "--output", "mapping.csv"]},
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of `values` (0 < fraction <= 1), or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered), max(1, math.ceil(fraction * len(ordered)))) - 1]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024 # bytes on macOS, KiB on Linux
+
+
+# --- Child Process: runs one script and measures it ---
+def _count_terms(script_globals):
+    if "unique_tests_df" in script_globals:
+        return len(script_globals["unique_tests_df"])
+    return len(script_globals.get("test_names", [])) + len(script_globals.get("parameter_names", []))
+
+
+def run_child(script, script_args, result_file):
+    """Runs `script` as __main__ in this process, timing every HTTP call it makes."""
+    import requests # Imported here so the parent never needs it
+
+    latencies = []
+    latencies_lock = threading.Lock()
+    send = requests.Session.request
+
+    def timed_request(session, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send(session, method, url, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with latencies_lock:
+                latencies.append(elapsed)
+    requests.Session.request = timed_request
+
+    sys.path.insert(0, REPO_DIR)
+    sys.argv = [script] + script_args
+    exit_code = 0
+    start = time.perf_counter()
+    try:
+        script_globals = runpy.run_path(os.path.join(REPO_DIR, script), run_name="__main__")
+    except SystemExit as e:
+        script_globals = {}
+        exit_code = e.code if isinstance(e.code, int) else 1
+    wall_seconds = time.perf_counter() - start
+
+    terms = _count_terms(script_globals)
+    with open(result_file, "w", encoding="utf-8") as f:
+        json.dump({
+            "exit_code": exit_code,
+            "wall_seconds": round(wall_seconds, 3),
+            "terms": terms,
+            "terms_per_second": round(terms / wall_seconds, 2) if wall_seconds > 0 else None,
+            "http_calls": len(latencies),
+            "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+            "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1) if resource is not None else None,
+        }, f)
+
+
+# --- Parent Process: one fresh working directory and child per scenario ---
+def run_scenario(name, spec, server, requests_per_second, keep_dirs=False):
+    server.faults = FaultConfig(**spec["faults"], seed=name)
+    server.reset_stats()
+    work_dir = tempfile.mkdtemp(prefix=f"loinc_bench_{name}_") # Fresh cache, checkpoint and outputs
+    result_file = os.path.join(work_dir, "bench_result.json")
+    env = {**os.environ,
+           "LOINC_USERNAME": "bench", "LOINC_PASSWORD": "bench",
+           "LOINC_SEARCH_API_URL": f"{server.base_url}/searchapi/loincs",
+           "LOINC_FHIR_BASE_URL": f"{server.base_url}/fhir/",
+           "LOINC_REQUESTS_PER_SECOND": str(requests_per_second),
+           "LOINC_OFFLINE": "", "LOINC_SEARCH_BACKEND": "api"}
+    command = [sys.executable, os.path.abspath(__file__), "--child", spec["script"], result_file, "--"] + spec["args"]
+    with open(os.path.join(work_dir, "output.log"), "w", encoding="utf-8") as log:
+        subprocess.run(command, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT, check=False)
+    try:
+        with open(result_file, encoding="utf-8") as f:
+            result = json.load(f)
+    except FileNotFoundError:
+        result = {"exit_code": "crashed"}
+    result["server"] = dict(sorted(server.stats.items()))
+    result["faults"] = server.faults.as_dict()
+    if result["exit_code"] != 0 or keep_dirs:
+        print(f"  ({name}: working directory kept at {work_dir})")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+def compare(name, result, baseline):
+    """One report line for a scenario, with the change against the committed baseline.
+       Returns (line, regressed)."""
+    line = (f"  {name:<20} {result.get('wall_seconds', 0):7.2f}s  {result.get('terms_per_second') or 0:7.2f} terms/s  "
+            f"p50={result.get('latency_p50_ms')}ms p99={result.get('latency_p99_ms')}ms  "
+            f"calls={result.get('http_calls')}  rss={result.get('peak_rss_mb')}MB")
+    if result.get("exit_code") != 0:
+        return line + f"  FAILED (exit {result.get('exit_code')})", True
+    if not baseline or not baseline.get("terms_per_second"):
+        return line + "  (no baseline)", False
+    change = result["terms_per_second"] / baseline["terms_per_second"] - 1
+    regressed = change < -REGRESSION_TOLERANCE
+    return line + f"  {change:+.0%} vs baseline" + ("  REGRESSION" if regressed else ""), regressed
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        # run_benchmarks.py --child <script> <result file> -- <script args>
+        run_child(sys.argv[2], sys.argv[5:], sys.argv[3])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark fetch_loinc.py and loinc_aggreg.py against a local mock server.")
+    parser.add_argument("scenarios", nargs="*",
+                        help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--rps", type=float, default=BENCH_REQUESTS_PER_SECOND,
+                        help="LOINC_REQUESTS_PER_SECOND for the scripts under test")
+    parser.add_argument("--save", action="store_true", help=f"Write the results to {os.path.relpath(RESULTS_PATH, REPO_DIR)}")
+    parser.add_argument("--check", action="store_true",
+                        help=f"Exit non-zero if a scenario is more than {REGRESSION_TOLERANCE:.0%} slower than the baseline")
+    parser.add_argument("--keep", action="store_true", help="Keep each scenario's working directory (outputs, log)")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    baseline = {}
+    if os.path.exists(RESULTS_PATH):
+        with open(RESULTS_PATH, encoding="utf-8") as f:
+            baseline = json.load(f).get("scenarios", {})
+
+    server = start_server()
+    print(f"Mock LOINC server on {server.base_url}; scripts paced at {args.rps:g} rps")
+    results = {}
+    any_regression = False
+    for name in args.scenarios or list(SCENARIOS):
+        print(f"Running {name}...")
+        results[name] = run_scenario(name, SCENARIOS[name], server, args.rps, keep_dirs=args.keep)
+        line, regressed = compare(name, results[name], baseline.get(name))
+        any_regression = any_regression or regressed
+        print(line)
+    server.shutdown()
+
+    if args.save:
+        os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+        with open(RESULTS_PATH, "w", encoding="utf-8") as f:
+            json.dump({
+                "environment": {"python": platform.python_version(), "platform": platform.platform(terse=True),
+                                "cpus": os.cpu_count(), "requests_per_second": args.rps},
+                "scenarios": {**baseline, **results},
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved results to {RESULTS_PATH}")
+    if args.check and any_regression:
+        sys.exit(1)
@@ -3,16 +3,74 @@ import csv
 import time
 import os
 import json
+import argparse
+
+from loinc_cache import ResponseCache, OfflineCacheMiss
+from loinc_client import LoincClient
+from loinc_retry import RetryPolicy, CircuitBreakers, AimdRateController
+from loinc_local_index import LocalLoincClient
+from loinc_checkpoint import CheckpointJournal, RunManifest, fingerprint
+from loinc_export import open_row_writer, open_text_input
+from loinc_concurrency import RateLimiter, imap_ordered
+from loinc_normalize import group_terms, fan_out, normalize_term
+from loinc_metrics import MetricsRegistry, JsonEventLog
+from loinc_filters import HitFilter, collect_hits
+from loinc_rank import CandidateScorer
+from loinc_records import HitBatch
+from loinc_json import decode_search_response, default_decoder
 
 # --- Configuration ---
 LOINC_USERNAME = os.getenv("LOINC_USERNAME")
 LOINC_PASSWORD = os.getenv("LOINC_PASSWORD")
 
-OUTPUT_CSV_TESTS = "loinc_tests_detailed.csv"
+OUTPUT_CSV_TESTS = "loinc_tests_detailed.csv"           # Add a .gz suffix to write gzip-compressed CSV, or use .parquet
 OUTPUT_CSV_PARAMETERS = "loinc_parameters_detailed.csv"
-API_ENDPOINT = "https://loinc.regenstrief.org/searchapi/loincs"
+CHECKPOINT_PATH = "fetch_loinc.checkpoint.jsonl" # Per-term journal used by --resume
+MANIFEST_PATH = "fetch_loinc.manifest.sqlite" # Cross-run term fingerprints + rows used by --delta
+API_ENDPOINT = os.getenv("LOINC_SEARCH_API_URL", "https://loinc.regenstrief.org/searchapi/loincs") # Override to point at a mirror/mock
 HEADERS = {'User-Agent': 'LIMSMappingScript/1.2 (Contact: your-email@example.com)'}
 
+# --- Response Cache Configuration ---
+CACHE_ENABLED = True
+CACHE_PATH = os.getenv("LOINC_CACHE_PATH", "loinc_cache.sqlite")
+CACHE_TTL_SECONDS = 30 * 24 * 3600
+CACHE_NEGATIVE_TTL_SECONDS = 7 * 24 * 3600 # Searches with no results expire sooner
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+OFFLINE_MODE = os.getenv("LOINC_OFFLINE", "") == "1" # Serve only from cache, never hit the network
+
+# --- Search Backend ---
+SEARCH_BACKEND = os.getenv("LOINC_SEARCH_BACKEND", "api") # "api" (remote) or "local" (index built by loinc_local_index.py)
+LOCAL_INDEX_PATH = os.getenv("LOINC_LOCAL_INDEX_PATH", "loinc_local_index.sqlite")
+
+# --- Concurrency Configuration ---
+MAX_WORKERS = 8              # Terms searched in parallel
+REQUESTS_PER_SECOND = float(os.getenv("LOINC_REQUESTS_PER_SECOND", "8.0")) # Global request budget shared by all workers
+MAX_IN_FLIGHT = 4            # Max simultaneous open requests
+
+# --- HTTP Connection Pool Configuration ---
+POOL_MAXSIZE = 8             # Keep-alive connections per host (>= MAX_IN_FLIGHT)
+TRANSPORT_RETRIES = 3        # Failed connection attempts retried by the session
+
+# --- Retry / Adaptive Rate Configuration ---
+MAX_ATTEMPTS = 4             # Per request: first try + retries on 429/5xx/read errors (jittered, honors Retry-After)
+RETRY_BASE_DELAY = 0.5       # Seconds; the backoff cap doubles with every retry
+RETRY_MAX_DELAY = 30.0
+CIRCUIT_FAILURE_THRESHOLD = 5 # Consecutive failures before requests to a host fail fast
+CIRCUIT_RESET_SECONDS = 30.0 # Then one trial request is let through
+ADAPTIVE_RATE = True         # AIMD: ramp REQUESTS_PER_SECOND up while healthy, halve it on 429/503
+MIN_REQUESTS_PER_SECOND = 1.0
+MAX_REQUESTS_PER_SECOND = float(os.getenv("LOINC_MAX_REQUESTS_PER_SECOND", str(2 * REQUESTS_PER_SECOND))) # AIMD ceiling
+
+# --- Metrics ---
+METRICS_LOG_PATH = None        # JSON-lines log of every request + the run summary ("-" = stderr)
+METRICS_JSON_PATH = None       # End-of-run metrics snapshot as JSON
+METRICS_PROMETHEUS_PATH = None # End-of-run metrics in Prometheus text format (e.g. for node_exporter's textfile collector)
+run_metrics = MetricsRegistry() # Request, cache, filter and stage metrics for this run
+
+# --- Term Normalization ---
+NORMALIZE_TERMS = True      # Search spellings that differ only in case/whitespace/punctuation ("Serum Urea" / "SERUM UREA.") once
+MERGE_TERM_VARIANTS = False # Also merge specimen prefixes and spelling variants ("Serum Urea" / "UREA"); changes which results a term gets
+
 # --- Pre-filtering Configuration ---
 ENABLE_PRE_FILTERING = True # Master switch for all filters below
 
@@ -26,8 +84,26 @@ FILTER_CLASSTYPE_KEEP = 1     # Class Type to keep (1=Lab)
 
 FILTER_ON_SCALE = True
 FILTER_SCALE_EXCLUDE = 'Doc' # Scale Type to EXCLUDE (e.g., 'Doc')
+
+# Also send the filters to the Search API as field-qualified clauses ("STATUS:ACTIVE CLASSTYPE:1 NOT SCALE_TYP:Doc"),
+# so dropped hits are never downloaded. Off by default: check your API account honors the syntax first.
+SERVER_SIDE_FILTERING = False
 # --- End Filter Criteria ---
 
+# --- Result Limits ---
+MAX_RESULTS_PER_TERM = None  # Top-K: keep at most this many filtered results per term (None = all); --top-k
+SEARCH_PAGE_SIZE = None      # Fetch results in pages of this many ("rows"/"offset") and stop once K are kept; None = one request
+SEARCH_MAX_PAGES = 10        # Never fetch more pages than this per term
+
+# --- Candidate Ranking ---
+# Score every kept hit against the term (token overlap, COMPONENT, specimen vs SYSTEM; see loinc_rank.py)
+# and write rows best-first. match_rank stays the Search API's position; the score goes to match_score.
+RERANK_RESULTS = True
+
+# Compiled once; checks each raw hit before a result row is built for it
+hit_filter = HitFilter.from_settings(ENABLE_PRE_FILTERING, FILTER_ON_STATUS, FILTER_STATUS_KEEP, FILTER_ON_CLASSTYPE,
+                                     FILTER_CLASSTYPE_KEEP, FILTER_ON_SCALE, FILTER_SCALE_EXCLUDE)
+
 # --- Input Data ---
 # (Keep your test_names and parameter_names lists)
 test_names = [
@@ -83,169 +159,331 @@ parameter_names = [
     "Abs. Monocytes", "Urine Microalbumin Spot", "FSH"
 ]
 
-# --- Helper Function to Fetch LOINC Codes ---
-def fetch_loinc_codes(terms_list, auth_credentials, list_name="terms"):
-    all_results = []
-    processed_terms = set()
-    total_unique_terms = len(set(terms_list))
-    current_term_index = 0
+def read_terms_csv(path):
+    """Reads test and parameter names from the `test_name` / `parameter_name` columns of a
+       CSV (e.g. the loinc_aggreg.py input), in first-appearance order without blanks or repeats."""
+    with open_text_input(path) as f:
+        rows = list(csv.DictReader(f))
+    def column(name):
+        return list(dict.fromkeys(row[name] for row in rows if (row.get(name) or "").strip()))
+    return column("test_name"), column("parameter_name")
+
+# --- Helper Function to Fetch LOINC Codes for a Single Term ---
+def fetch_term_results(term, client, progress_label=""):
+    """Searches one term and returns its (filtered) results as a HitBatch, or a
+       list holding a placeholder or error row."""
+    print(f"{progress_label}Searching for: '{term}'")
+    term_results = []
+    results_found_for_term = 0
+    results_kept_for_term = 0
+
+    try:
+        def fetch_page(offset, rows):
+            params = {"query": search_query(term)}
+            if rows:
+                params.update(rows=rows, offset=offset)
+            data = client.get_json(API_ENDPOINT, params, headers=HEADERS, timeout=45,
+                                   is_negative=lambda data: not data.get("Results"),
+                                   decode=decode_search_response) # SearchHit structs with msgspec, hit dicts otherwise
+            return data.get("Results", [])
+
+        # --- Apply Pre-filtering (before building rows, so dropped hits cost one dict lookup each) ---
+        kept_hits, outcomes, results_found_for_term = collect_hits(
+            fetch_page, hit_filter, top_k=MAX_RESULTS_PER_TERM, page_size=SEARCH_PAGE_SIZE, max_pages=SEARCH_MAX_PAGES)
+
+        if not results_found_for_term:
+            print(f"  -> No LOINC results found.")
+            # Add placeholder only if filtering is off
+            if not ENABLE_PRE_FILTERING:
+                 term_results.append({
+                    "search_term": term, "match_rank": 0, "match_score": "N/A", "loinc": "Not Found",
+                    "long_common_name": "N/A", "status": "Not Found in DB", "class_type": "N/A",
+                    "component": "N/A", "property": "N/A", "time_aspect": "N/A",
+                    "system": "N/A", "scale_type": "N/A", "method_type": "N/A",
+                    "example_units": "N/A", "class": "N/A", "short_name": "N/A",
+                    "loinc_url": "N/A"
+                })
+        else:
+            for outcome, count in outcomes.items():
+                run_metrics.inc("loinc_rows_total", count, outcome=outcome)
+            results_kept_for_term = len(kept_hits)
+            if RERANK_RESULTS:
+                scored_hits = CandidateScorer(term).rerank(kept_hits) # One pass over all candidates
+            else:
+                scored_hits = [(rank, hit, None) for rank, hit in kept_hits]
+
+            # Columnar rows: interned categorical fields, URLs derived when written
+            term_results = HitBatch.from_scored(term, scored_hits)
+
+            print(f"  -> Found {results_found_for_term} results. Kept {results_kept_for_term} after filtering.")
+
+    # (Keep the existing except blocks)
+    except OfflineCacheMiss as miss:
+         print(f"  -> {miss}")
+         error_row = {"search_term": term, "match_rank": 0, "loinc": "Not Cached", "long_common_name": str(miss), "status": "Error", "loinc_url": "Error"}
+         term_results.append({**{k: "Error" for k in fieldnames if k not in error_row}, **error_row})
+    except requests.exceptions.HTTPError as http_err:
+         status_code = http_err.response.status_code if http_err.response is not None else "N/A"
+         print(f"  -> HTTP error: {http_err} (Status: {status_code})")
+         # Simplified error row creation
+         error_row = {"search_term": term, "match_rank": 0, "loinc": f"HTTP Error {status_code}", "long_common_name": str(http_err), "status": "Error", "loinc_url": "Error"}
+         term_results.append({**{k: "Error" for k in fieldnames if k not in error_row}, **error_row}) # Fill remaining fields
+    except requests.exceptions.RequestException as req_err: # Catch other request errors (conn, timeout)
+         print(f"  -> Request error: {req_err}")
+         error_row = {"search_term": term, "match_rank": 0, "loinc": "Request Error", "long_common_name": str(req_err), "status": "Error", "loinc_url": "Error"}
+         term_results.append({**{k: "Error" for k in fieldnames if k not in error_row}, **error_row})
+    except json.JSONDecodeError as json_err:
+         print(f"  -> JSON decoding error: {json_err}")
+         error_row = {"search_term": term, "match_rank": 0, "loinc": "JSON Error", "long_common_name": str(json_err), "status": "Error", "loinc_url": "Error"}
+         term_results.append({**{k: "Error" for k in fieldnames if k not in error_row}, **error_row})
+    except Exception as e:
+        print(f"  -> Unexpected error: {e}")
+        error_row = {"search_term": term, "match_rank": 0, "loinc": "Unexpected Error", "long_common_name": str(e), "status": "Error", "loinc_url": "Error"}
+        # Define fieldnames here or pass it to make this work robustly
+        fieldnames_for_error = ["search_term", "match_rank", "match_score", "loinc", "loinc_url", "status", "long_common_name", "short_name", "class_type", "component", "property", "time_aspect", "system", "scale_type", "method_type", "example_units", "class"]
+        term_results.append({**{k: "Error" for k in fieldnames_for_error if k not in error_row}, **error_row})
+
+    return term_results
+
+# --- Helper Function to Build the Search Query ---
+def search_query(term):
+    """The query sent for a term: with SERVER_SIDE_FILTERING (remote API only) the
+       filter rules are appended as field-qualified clauses."""
+    if SERVER_SIDE_FILTERING and SEARCH_BACKEND == "api":
+        return hit_filter.server_query(term)
+    return term
+
+# --- Helper Function to Group Input Terms into Searches ---
+def search_groups(terms_list):
+    """Returns the TermGroups to search: spellings folded together with NORMALIZE_TERMS
+       (also specimen/synonym variants with MERGE_TERM_VARIANTS), otherwise one group
+       per distinct term (exact dedup only)."""
+    if NORMALIZE_TERMS and MERGE_TERM_VARIANTS:
+        return group_terms(terms_list, key=normalize_term)
+    if NORMALIZE_TERMS:
+        return group_terms(terms_list)
+    return group_terms(terms_list, key=lambda term: term)
+
+def checkpoint_keys(terms_list, list_name):
+    """Journal/manifest keys `iter_loinc_rows` uses for a list of terms."""
+    return [f"{list_name}::{group.query}" for group in search_groups(terms_list)]
+
+# --- Helper Function to Fingerprint a Term for Delta Runs ---
+def term_fingerprint(term):
+    """Fingerprint of a term plus the filter settings that shape its rows."""
+    return fingerprint(term, ENABLE_PRE_FILTERING, FILTER_ON_STATUS, FILTER_STATUS_KEEP, FILTER_ON_CLASSTYPE,
+                       FILTER_CLASSTYPE_KEEP, FILTER_ON_SCALE, FILTER_SCALE_EXCLUDE, SERVER_SIDE_FILTERING,
+                       MAX_RESULTS_PER_TERM, SEARCH_PAGE_SIZE, RERANK_RESULTS)
+
+# --- Helper Function to Search Many Terms Concurrently ---
+def iter_loinc_rows(terms_list, client, list_name="terms", max_workers=MAX_WORKERS, journal=None,
+                    manifest=None, delta=False):
+    """Searches every unique term concurrently and yields each term's rows as a list,
+    in input-term order, as soon as they are ready. Only a small window of terms is
+    in flight at once, so memory does not grow with the size of the catalog.
+
+    With NORMALIZE_TERMS, near-duplicate terms are grouped (see `search_groups`): each
+    group is searched once and its rows are yielded for every member term in turn.
+
+    With a CheckpointJournal, each successfully searched term is recorded as soon
+    as it finishes, and terms already in the journal are not searched again.
+    With a RunManifest, results are recorded for later runs; if `delta` is set,
+    terms whose fingerprint is unchanged reuse the rows from the manifest."""
+    term_groups = search_groups(terms_list)
+    total_unique_terms = len(term_groups)
+    for group in term_groups:
+        for member in group.members[1:]:
+            print(f"[Sharing results of '{group.query}' with: '{member}']")
+    duplicate_count = len(terms_list) - sum(len(group.members) for group in term_groups)
+    if duplicate_count:
+        print(f"[Skipping {duplicate_count} exact duplicate input terms]")
 
     print(f"\n--- Starting LOINC search for {total_unique_terms} unique {list_name} ---")
+    if NORMALIZE_TERMS:
+        print(f"--- Normalization: {len(terms_list)} input terms -> {total_unique_terms} searches ---")
     if ENABLE_PRE_FILTERING:
-        filter_desc = []
-        if FILTER_ON_STATUS: filter_desc.append(f"STATUS='{FILTER_STATUS_KEEP}'")
-        if FILTER_ON_CLASSTYPE: filter_desc.append(f"CLASSTYPE={FILTER_CLASSTYPE_KEEP}")
-        if FILTER_ON_SCALE: filter_desc.append(f"SCALE_TYP!='{FILTER_SCALE_EXCLUDE}'")
-        print(f"--- Pre-filtering ENABLED: Keeping results WHERE {' AND '.join(filter_desc)} ---")
+        print(f"--- Pre-filtering ENABLED: Keeping results WHERE {hit_filter.describe()} ---")
+        if SERVER_SIDE_FILTERING and SEARCH_BACKEND == "api":
+            print(f"--- Server-side filtering: queries end with '{hit_filter.query_clauses()}' ---")
     else:
         print("--- Pre-filtering DISABLED ---")
+    if MAX_RESULTS_PER_TERM:
+        paging = f", fetched {SEARCH_PAGE_SIZE} per page" if SEARCH_PAGE_SIZE else ""
+        print(f"--- Keeping the top {MAX_RESULTS_PER_TERM} results per term{paging} ---")
+    if RERANK_RESULTS:
+        print("--- Reranking results by local match score ---")
 
-    for term in terms_list:
-        if term in processed_terms:
-           print(f"[Skipping duplicate input term: {term}]")
-           continue
+    def fetch_indexed(indexed_group):
+        index, group = indexed_group
+        term = group.query
+        checkpoint_key = f"{list_name}::{term}"
+        unit_fingerprint = term_fingerprint(term)
+        if delta and manifest is not None:
+            previous_rows = manifest.lookup(checkpoint_key, unit_fingerprint)
+            if previous_rows is not None:
+                print(f"[{index}/{total_unique_terms}] Unchanged since last run (delta): '{term}'")
+                return previous_rows
+        if journal is not None and journal.is_done(checkpoint_key):
+            print(f"[{index}/{total_unique_terms}] Already done (checkpoint): '{term}'")
+            term_results = journal.get(checkpoint_key)
+        else:
+            with run_metrics.timer(stage="search"):
+                term_results = fetch_term_results(term, client, f"[{index}/{total_unique_terms}] ")
+        # Error rows are not checkpointed, so a resumed or delta run retries those terms
+        if isinstance(term_results, HitBatch) or not any(row.get("status") == "Error" for row in term_results):
+            if journal is not None and not journal.is_done(checkpoint_key):
+                journal.record(checkpoint_key, list(term_results))
+            if manifest is not None:
+                manifest.update(checkpoint_key, unit_fingerprint, list(term_results))
+        return term_results
 
-        processed_terms.add(term)
-        current_term_index += 1
-        print(f"[{current_term_index}/{total_unique_terms}] Searching for: '{term}'")
-        results_found_for_term = 0
-        results_kept_for_term = 0
-
-        try:
-            response = requests.get(
-                API_ENDPOINT, params={"query": term}, auth=auth_credentials,
-                headers=HEADERS, timeout=45
-            )
-            response.raise_for_status()
-            data = response.json()
-            loinc_results = data.get("Results", [])
-            results_found_for_term = len(loinc_results)
-
-            if not loinc_results:
-                print(f"  -> No LOINC results found.")
-                # Add placeholder only if filtering is off
-                if not ENABLE_PRE_FILTERING:
-                     all_results.append({
-                        "search_term": term, "match_rank": 0, "loinc": "Not Found",
-                        "long_common_name": "N/A", "status": "Not Found in DB", "class_type": "N/A",
-                        "component": "N/A", "property": "N/A", "time_aspect": "N/A",
-                        "system": "N/A", "scale_type": "N/A", "method_type": "N/A",
-                        "example_units": "N/A", "class": "N/A", "short_name": "N/A",
-                        "loinc_url": "N/A"
-                    })
+    for group, term_results in zip(term_groups, imap_ordered(fetch_indexed, enumerate(term_groups, start=1),
+                                                              max_workers=max_workers)):
+        if len(group.members) == 1 and group.members[0] == group.query:
+            yield term_results
+            continue
+        for member in group.members:
+            if isinstance(term_results, HitBatch):
+                yield term_results.for_term(member) # Shares the columns, no row copies
             else:
-                for i, hit in enumerate(loinc_results):
-                    loinc_num = hit.get("LOINC_NUM", "Parse Error")
-                    loinc_url = f"https://loinc.org/{loinc_num}" if loinc_num != "Parse Error" else "N/A"
-                    scale_type = hit.get("SCALE_TYP", "N/A") # Get scale type
-
-                    result_entry = {
-                        "search_term": term, "match_rank": i + 1, "loinc": loinc_num,
-                        "long_common_name": hit.get("LONG_COMMON_NAME", "N/A"),
-                        "status": hit.get("STATUS", "N/A"),
-                        "class_type": hit.get("CLASSTYPE", None),
-                        "component": hit.get("COMPONENT", "N/A"),
-                        "property": hit.get("PROPERTY", "N/A"),
-                        "time_aspect": hit.get("TIME_ASPCT", "N/A"),
-                        "system": hit.get("SYSTEM", "N/A"),
-                        "scale_type": scale_type, # Store the scale type
-                        "method_type": hit.get("METHOD_TYP", "N/A"),
-                        "example_units": hit.get("EXAMPLE_UNITS", "N/A"),
-                        "class": hit.get("CLASS", "N/A"),
-                        "short_name": hit.get("SHORTNAME", "N/A"),
-                        "loinc_url": loinc_url
-                    }
-
-                    # --- Apply Pre-filtering ---
-                    passes_filter = True
-                    if ENABLE_PRE_FILTERING:
-                        # Check Status filter
-                        if FILTER_ON_STATUS and result_entry['status'] != FILTER_STATUS_KEEP:
-                            passes_filter = False
-                        # Check Class Type filter (only if Status passed)
-                        if passes_filter and FILTER_ON_CLASSTYPE and result_entry['class_type'] != FILTER_CLASSTYPE_KEEP:
-                            passes_filter = False
-                        # Check Scale Type Exclude filter (only if previous passed)
-                        if passes_filter and FILTER_ON_SCALE and result_entry['scale_type'] == FILTER_SCALE_EXCLUDE:
-                            passes_filter = False
-
-                    if passes_filter:
-                        all_results.append(result_entry)
-                        results_kept_for_term += 1
-                    # --- End Pre-filtering ---
-
-                print(f"  -> Found {results_found_for_term} results. Kept {results_kept_for_term} after filtering.")
-
-        # (Keep the existing except blocks)
-        except requests.exceptions.HTTPError as http_err:
-             print(f"  -> HTTP error: {http_err} (Status: {response.status_code})")
-             # Simplified error row creation
-             error_row = {"search_term": term, "match_rank": 0, "loinc": f"HTTP Error {response.status_code}", "long_common_name": str(http_err), "status": "Error", "loinc_url": "Error"}
-             all_results.append({**{k: "Error" for k in fieldnames if k not in error_row}, **error_row}) # Fill remaining fields
-        except requests.exceptions.RequestException as req_err: # Catch other request errors (conn, timeout)
-             print(f"  -> Request error: {req_err}")
-             error_row = {"search_term": term, "match_rank": 0, "loinc": "Request Error", "long_common_name": str(req_err), "status": "Error", "loinc_url": "Error"}
-             all_results.append({**{k: "Error" for k in fieldnames if k not in error_row}, **error_row})
-        except json.JSONDecodeError as json_err:
-             print(f"  -> JSON decoding error: {json_err}")
-             error_row = {"search_term": term, "match_rank": 0, "loinc": "JSON Error", "long_common_name": str(json_err), "status": "Error", "loinc_url": "Error"}
-             all_results.append({**{k: "Error" for k in fieldnames if k not in error_row}, **error_row})
-        except Exception as e:
-            print(f"  -> Unexpected error: {e}")
-            error_row = {"search_term": term, "match_rank": 0, "loinc": "Unexpected Error", "long_common_name": str(e), "status": "Error", "loinc_url": "Error"}
-            # Define fieldnames here or pass it to make this work robustly
-            fieldnames_for_error = ["search_term", "match_rank", "loinc", "loinc_url", "status", "long_common_name", "short_name", "class_type", "component", "property", "time_aspect", "system", "scale_type", "method_type", "example_units", "class"]
-            all_results.append({**{k: "Error" for k in fieldnames_for_error if k not in error_row}, **error_row})
-
-        time.sleep(0.1)
+                yield fan_out(term_results, member)
 
     print(f"--- Finished LOINC search for {list_name} ---")
-    return all_results
+
+# --- Helper Function to Fetch LOINC Codes ---
+def fetch_loinc_codes(terms_list, client, list_name="terms", **kwargs):
+    """Returns all result rows for the terms as one list (see `iter_loinc_rows`)."""
+    return [row for term_results in iter_loinc_rows(terms_list, client, list_name, **kwargs) for row in term_results]
 
 # --- Helper Function to Save Results to CSV ---
 # Define fieldnames globally or pass it to the function if needed for error handling above
 fieldnames = [
-    "search_term", "match_rank", "loinc", "loinc_url", "status",
+    "search_term", "match_rank", "match_score", "loinc", "loinc_url", "status",
     "long_common_name", "short_name", "class_type", "component",
     "property", "time_aspect", "system", "scale_type", "method_type",
     "example_units", "class",
 ]
 
-def save_to_csv(results_list, filename):
-    """Saves a list of result dictionaries to a CSV file."""
-    if not results_list:
-        print(f"No results to save for {filename} (possibly due to filtering).")
-        return
-
-    print(f"Saving {len(results_list)} results/rows to {filename}...")
-    try:
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
-            writer.writeheader()
-            writer.writerows(results_list)
-        print(f"Successfully saved results to {filename}.")
-    except IOError as e:
-        print(f"Error saving CSV file {filename}: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred during CSV writing for {filename}: {e}")
+def stream_to_csv(term_rows_iter, filename):
+    """Writes per-term row lists to CSV (or Parquet, for .parquet names) as they arrive,
+       flushing after every term. Returns the number of rows written."""
+    print(f"Streaming results to {filename}...")
+    with open_row_writer(filename, fieldnames) as csv_writer:
+        for term_results in term_rows_iter:
+            with run_metrics.timer(stage="write"):
+                csv_writer.write_rows(term_results)
+                csv_writer.flush()
+    if csv_writer.rows_written == 0:
+        print(f"No results written to {filename} (possibly due to filtering).")
+    else:
+        print(f"Successfully saved {csv_writer.rows_written} results/rows to {filename}.")
+    return csv_writer.rows_written
 
 
 # --- Main Execution ---
 if __name__ == "__main__":
-    if not LOINC_USERNAME or not LOINC_PASSWORD:
+    parser = argparse.ArgumentParser(description="Fetch LOINC codes for the configured test and parameter names.")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"Skip terms already completed in the checkpoint journal ({CHECKPOINT_PATH})")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Checkpoint journal path")
+    parser.add_argument("--delta", action="store_true",
+                        help=f"Only search terms that are new or changed since the last run ({MANIFEST_PATH})")
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help="Delta manifest path")
+    parser.add_argument("--top-k", type=int, default=MAX_RESULTS_PER_TERM,
+                        help="Keep at most this many filtered results per term (default: all)")
+    parser.add_argument("--page-size", type=int, default=SEARCH_PAGE_SIZE,
+                        help="Page through results this many at a time, stopping once --top-k are kept")
+    parser.add_argument("--metrics-log", default=METRICS_LOG_PATH,
+                        help="Append structured JSON-lines events (one per request, plus the run summary); '-' = stderr")
+    parser.add_argument("--metrics-json", default=METRICS_JSON_PATH, help="Write the end-of-run metrics as JSON")
+    parser.add_argument("--prometheus", default=METRICS_PROMETHEUS_PATH,
+                        help="Write the end-of-run metrics in Prometheus text format")
+    parser.add_argument("--terms-csv",
+                        help="Read test_name/parameter_name columns from this CSV instead of the lists above")
+    args = parser.parse_args()
+    if args.terms_csv:
+        test_names, parameter_names = read_terms_csv(args.terms_csv)
+        print(f"Read {len(test_names)} test names and {len(parameter_names)} parameter names from {args.terms_csv}")
+    if args.metrics_log:
+        run_metrics.event_log = JsonEventLog(args.metrics_log)
+    MAX_RESULTS_PER_TERM, SEARCH_PAGE_SIZE = args.top_k, args.page_size
+
+    use_local_index = SEARCH_BACKEND == "local"
+    if not use_local_index and not OFFLINE_MODE and (not LOINC_USERNAME or not LOINC_PASSWORD):
         print("ERROR: LOINC_USERNAME and LOINC_PASSWORD environment variables must be set.")
         exit(1)
+    if OFFLINE_MODE and not CACHE_ENABLED:
+        print("ERROR: Offline mode (LOINC_OFFLINE=1) requires CACHE_ENABLED = True.")
+        exit(1)
 
     loinc_auth = (LOINC_USERNAME, LOINC_PASSWORD)
+    response_cache = None
+    if CACHE_ENABLED and not use_local_index:
+        response_cache = ResponseCache(CACHE_PATH, ttl_seconds=CACHE_TTL_SECONDS,
+                                       negative_ttl_seconds=CACHE_NEGATIVE_TTL_SECONDS,
+                                       max_bytes=CACHE_MAX_BYTES, offline=OFFLINE_MODE)
+        print(f"Using response cache: {CACHE_PATH}" + (" (OFFLINE mode)" if OFFLINE_MODE else ""))
+    print(f"JSON decoder: {default_decoder.backend}")
+    rate_limiter = RateLimiter(REQUESTS_PER_SECOND, max_in_flight=MAX_IN_FLIGHT)
+    if use_local_index:
+        try:
+            loinc_client = LocalLoincClient(LOCAL_INDEX_PATH)
+        except FileNotFoundError as e:
+            print(f"ERROR: {e}")
+            exit(1)
+        print(f"Using local LOINC index: {LOCAL_INDEX_PATH} (no network requests)")
+    else:
+        loinc_client = LoincClient(loinc_auth, cache=response_cache, limiter=rate_limiter,
+                                   retry_policy=RetryPolicy(MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                                                            max_delay=RETRY_MAX_DELAY),
+                                   breakers=CircuitBreakers(failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                                                            reset_timeout=CIRCUIT_RESET_SECONDS),
+                                   rate_controller=AimdRateController(
+                                       rate_limiter, min_rate=MIN_REQUESTS_PER_SECOND,
+                                       max_rate=MAX_REQUESTS_PER_SECOND) if ADAPTIVE_RATE else None,
+                                   metrics=run_metrics, pool_maxsize=POOL_MAXSIZE,
+                                   transport_retries=TRANSPORT_RETRIES)
+    journal = CheckpointJournal(args.checkpoint, resume=args.resume)
+    if args.resume:
+        print(f"Resuming from {args.checkpoint}: {len(journal.completed)} terms already completed.")
+    manifest = RunManifest(args.manifest)
+    if args.delta:
+        print(f"Delta mode: reusing results for unchanged terms from {args.manifest} ({len(manifest)} recorded).")
     start_time = time.time()
 
-    test_results = fetch_loinc_codes(test_names, loinc_auth, list_name="Test Names")
-    save_to_csv(test_results, OUTPUT_CSV_TESTS)
+    test_row_count = stream_to_csv(
+        iter_loinc_rows(test_names, loinc_client, list_name="Test Names", journal=journal,
+                        manifest=manifest, delta=args.delta),
+        OUTPUT_CSV_TESTS
+    )
 
-    parameter_results = fetch_loinc_codes(parameter_names, loinc_auth, list_name="Parameter Names")
-    save_to_csv(parameter_results, OUTPUT_CSV_PARAMETERS)
+    parameter_row_count = stream_to_csv(
+        iter_loinc_rows(parameter_names, loinc_client, list_name="Parameter Names", journal=journal,
+                        manifest=manifest, delta=args.delta),
+        OUTPUT_CSV_PARAMETERS
+    )
+    journal.close()
+    manifest.save(keep_keys=checkpoint_keys(test_names, "Test Names") + checkpoint_keys(parameter_names, "Parameter Names"))
+    print(manifest.summary())
+    manifest.close()
 
     end_time = time.time()
-    total_results = len(test_results) + len(parameter_results)
+    total_results = test_row_count + parameter_row_count
     print(f"\nScript finished in {end_time - start_time:.2f} seconds.")
-    print(f"Total rows written to CSV files: {total_results}")
\ No newline at end of file
+    print(f"Total rows written to CSV files: {total_results}")
+    print(loinc_client.summary())
+    loinc_client.close()
+    if response_cache is not None:
+        print(response_cache.summary())
+        response_cache.close()
+
+    print(run_metrics.summary())
+    run_metrics.event("run_finished", script="fetch_loinc", elapsed_seconds=round(end_time - start_time, 3),
+                      rows_written=total_results, metrics=run_metrics.as_dict())
+    if args.metrics_json:
+        run_metrics.write_json(args.metrics_json)
+        print(f"Metrics written to {args.metrics_json}")
+    if args.prometheus:
+        run_metrics.write_prometheus(args.prometheus)
+        print(f"Prometheus metrics written to {args.prometheus}")
+    run_metrics.close()
\ No newline at end of file
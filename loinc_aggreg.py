@@ -4,17 +4,42 @@ import time
 import os
 import json
 import re
+import argparse
 from requests.auth import HTTPBasicAuth
 
+from loinc_cache import ResponseCache, OfflineCacheMiss
+from loinc_client import LoincClient
+from loinc_retry import RetryPolicy, CircuitBreakers, AimdRateController
+from loinc_local_index import LocalLoincClient
+from loinc_checkpoint import CheckpointJournal, RunManifest, fingerprint
+from loinc_export import open_mapping_exporter
+from loinc_columnar import read_input_frame
+from loinc_normalize import test_search_term
+from loinc_lcn import LcnResolver
+from loinc_panels import PanelPrecheck, load_panel_graph, questionnaire_leaves
+from loinc_concurrency import RateLimiter
+from loinc_pipeline import Pipeline, Stage, StageError
+from loinc_metrics import MetricsRegistry, JsonEventLog
+from loinc_filters import HitFilter, collect_hits
+from loinc_rank import CandidateScorer
+from loinc_records import AGGREG_LAYOUT, HitBatch
+from loinc_json import decode_search_response, default_decoder
+from loinc_match import ParameterMatcher
+
 # --- Configuration ---
 LOINC_USERNAME = os.getenv("LOINC_USERNAME")
 LOINC_PASSWORD = os.getenv("LOINC_PASSWORD")
-INPUT_CSV = "test_to_param_mapping.csv"
+INPUT_CSV = "test_to_param_mapping.csv" # .csv, or .parquet (read via pyarrow)
 OUTPUT_EXCEL = "loinc_mapping_results_with_lcn.xlsx" # Changed output filename
+OUTPUT_FORMAT = "xlsx" # "xlsx" (one sheet per test), or "csv"/"parquet" (one long table + summary table)
+CHECKPOINT_PATH = "loinc_aggreg.checkpoint.jsonl" # Per-test journal used by --resume
+MANIFEST_PATH = "loinc_aggreg.manifest.sqlite" # Cross-run test fingerprints + rows used by --delta
 
 # API Endpoints
-LOINC_SEARCH_API = "https://loinc.regenstrief.org/searchapi/loincs"
-LOINC_FHIR_QUESTIONNAIRE_API = "https://fhir.loinc.org/Questionnaire/" # Query params added later
+# (LOINC_SEARCH_API_URL / LOINC_FHIR_BASE_URL override them, e.g. for benchmarks/mock_server.py)
+LOINC_SEARCH_API = os.getenv("LOINC_SEARCH_API_URL", "https://loinc.regenstrief.org/searchapi/loincs")
+LOINC_FHIR_BASE = os.getenv("LOINC_FHIR_BASE_URL", "https://fhir.loinc.org/") # Batch Bundles (CodeSystem/$lookup) are POSTed here
+LOINC_FHIR_QUESTIONNAIRE_API = LOINC_FHIR_BASE.rstrip("/") + "/Questionnaire/" # Query params added later
 
 # Headers for requests
 HEADERS = {
@@ -26,6 +51,60 @@ FHIR_HEADERS = {
     'Accept': 'application/fhir+json'
 }
 
+# --- Response Cache Configuration ---
+CACHE_ENABLED = True
+CACHE_PATH = os.getenv("LOINC_CACHE_PATH", "loinc_cache.sqlite") # Shared with fetch_loinc.py
+CACHE_TTL_SECONDS = 30 * 24 * 3600
+CACHE_NEGATIVE_TTL_SECONDS = 7 * 24 * 3600 # Empty searches / "no Questionnaire" answers expire sooner
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+OFFLINE_MODE = os.getenv("LOINC_OFFLINE", "") == "1" # Serve only from cache, never hit the network
+
+# --- Search Backend ---
+SEARCH_BACKEND = os.getenv("LOINC_SEARCH_BACKEND", "api") # "api" (remote) or "local" (index built by loinc_local_index.py)
+LOCAL_INDEX_PATH = os.getenv("LOINC_LOCAL_INDEX_PATH", "loinc_local_index.sqlite")
+
+# --- Panel Pre-check ---
+PANEL_PRECHECK = True        # Skip FHIR Questionnaire requests for codes known not to be panels
+PANEL_LIST_INDEX = LOCAL_INDEX_PATH # Panel list source if this local index exists (built with --panels-csv)
+
+# --- Panel Graph ---
+# Expand panels (including nested sub-panels) in-process from a PanelGraph instead of one FHIR call each.
+# Loaded from PanelsAndForms.csv, else PANEL_LIST_INDEX if it exists, plus Questionnaires already in the cache.
+PANEL_GRAPH = True
+PANELS_CSV_PATH = os.getenv("LOINC_PANELS_CSV", "") # AccessoryFiles/PanelsAndForms/PanelsAndForms.csv
+
+# --- Concurrency Configuration ---
+MAX_WORKERS = 6              # Tests searched in parallel (pipeline "search" stage)
+EXPAND_WORKERS = 4           # Tests whose panels are expanded via FHIR in parallel ("expand" stage)
+LCN_WORKERS = 4              # Parallel LCN batch requests ("resolve" stage)
+PIPELINE_QUEUE_SIZE = 8      # Max tests waiting between two pipeline stages
+REQUESTS_PER_SECOND = float(os.getenv("LOINC_REQUESTS_PER_SECOND", "8.0")) # Global budget shared by search, FHIR and LCN calls
+MAX_IN_FLIGHT = 4            # Max simultaneous open requests
+
+# --- HTTP Connection Pool Configuration ---
+POOL_MAXSIZE = 8             # Keep-alive connections per host (>= MAX_IN_FLIGHT)
+TRANSPORT_RETRIES = 3        # Failed connection attempts retried by the session
+
+# --- Retry / Adaptive Rate Configuration ---
+MAX_ATTEMPTS = 4             # Per request: first try + retries on 429/5xx/read errors (jittered, honors Retry-After)
+RETRY_BASE_DELAY = 0.5       # Seconds; the backoff cap doubles with every retry
+RETRY_MAX_DELAY = 30.0
+CIRCUIT_FAILURE_THRESHOLD = 5 # Consecutive failures before requests to a host fail fast
+CIRCUIT_RESET_SECONDS = 30.0 # Then one trial request is let through
+ADAPTIVE_RATE = True         # AIMD: ramp REQUESTS_PER_SECOND up while healthy, halve it on 429/503
+MIN_REQUESTS_PER_SECOND = 1.0
+MAX_REQUESTS_PER_SECOND = float(os.getenv("LOINC_MAX_REQUESTS_PER_SECOND", str(2 * REQUESTS_PER_SECOND))) # AIMD ceiling
+
+# --- Metrics ---
+METRICS_LOG_PATH = None        # JSON-lines log of every request + the run summary ("-" = stderr)
+METRICS_JSON_PATH = None       # End-of-run metrics snapshot as JSON
+METRICS_PROMETHEUS_PATH = None # End-of-run metrics in Prometheus text format
+run_metrics = MetricsRegistry() # Request, cache, filter and stage metrics for this run
+
+# --- Long Common Name Resolution ---
+LCN_BATCH_LOOKUP = True      # Resolve codes via FHIR batch $lookup; False = one search call per code
+LCN_BATCH_SIZE = 50          # Codes per batch Bundle
+
 
 # --- Pre-filtering Configuration for LOINC Search API ---
 ENABLE_PRE_FILTERING = True
@@ -35,8 +114,41 @@ FILTER_ON_CLASSTYPE = False # As per your settings
 FILTER_CLASSTYPE_KEEP = 1 # 1=Lab (Ignored if FILTER_ON_CLASSTYPE is False)
 FILTER_ON_SCALE = False # As per your settings
 FILTER_SCALE_EXCLUDE = 'Doc' # (Ignored if FILTER_ON_SCALE is False)
+SERVER_SIDE_FILTERING = False # Also send the filters as field-qualified query clauses (see fetch_loinc.py)
 # --- End Filter Criteria ---
 
+# --- Result Limits ---
+# Every kept search result is expanded via FHIR and its parameters resolved, so a top-K bounds that fan-out per test
+MAX_RESULTS_PER_TERM = None  # Top-K: keep at most this many filtered candidates per test (None = all); --top-k
+SEARCH_PAGE_SIZE = None      # Fetch results in pages of this many ("rows"/"offset") and stop once K are kept; None = one request
+SEARCH_MAX_PAGES = 10        # Never fetch more pages than this per test
+
+# --- Candidate Ranking ---
+# Score every kept candidate against the test name and its parameter set (see loinc_rank.py) and order the
+# sheet rows best-first; match_rank stays the Search API's position and the score goes to match_score.
+RERANK_RESULTS = True
+EXPAND_TOP_N = None          # Only the N best-scoring candidates get FHIR/LCN resolution (None = all); --expand-top
+NOT_EXPANDED_STATUS = "Not Expanded" # loinc_parameter_codes/names of candidates below EXPAND_TOP_N
+
+# --- Parameter Matching ---
+# Match each expanded panel's member LCNs against the test's internal parameter names (see loinc_match.py):
+# parameter_coverage = share of internal parameters found in the panel, parameter_matches = "name: code" per parameter
+MATCH_PARAMETERS = True
+
+# Compiled once; checks each raw hit before a sheet row is built for it
+hit_filter = HitFilter.from_settings(ENABLE_PRE_FILTERING, FILTER_ON_STATUS, FILTER_STATUS_KEEP, FILTER_ON_CLASSTYPE,
+                                     FILTER_CLASSTYPE_KEEP, FILTER_ON_SCALE, FILTER_SCALE_EXCLUDE)
+
+# Column order of each per-test sheet - keeping names descriptive
+SHEET_COLUMNS = [
+    "loinc_test_code", "search_term", "loinc_test_long_name", "loinc_test_short_name", "loinc_test_url",
+    "loinc_parameter_names", "loinc_parameter_codes", # Swapped order slightly, LCN first
+    "loinc_test_status", "loinc_test_class_type", "loinc_test_class", "loinc_test_component",
+    "loinc_test_property", "loinc_test_time", "loinc_test_system", "loinc_test_scale",
+    "loinc_test_method", "match_rank", "match_score", "parameter_coverage", "parameter_matches"
+]
+SUMMARY_COLUMNS = ['test_id', 'test_name', 'test_alias_name', 'test_code', 'internal_parameter_names', 'internal_parameter_ids']
+
 # --- Helper Function to Clean Sheet Names ---
 def clean_sheet_name(name):
     """Removes invalid characters and truncates name for Excel sheet names."""
@@ -44,108 +156,71 @@ def clean_sheet_name(name):
     return name[:31] # Excel limit is 31
 
 # --- Helper Function to Fetch LOINC Test Codes ---
-# (Identical to your provided function - no changes needed here)
-def search_loinc_tests(term, auth, headers, max_retries=2, initial_delay=1):
-    """Searches the LOINC Search API for a given term and applies filters."""
+def search_loinc_tests(term, client, headers, scorer=None):
+    """Searches the LOINC Search API for a given term and applies filters.
+       With a CandidateScorer, the kept results are scored and returned best-first.
+       Returns the kept results as a HitBatch ([] if nothing matched), or None if the search failed."""
     print(f"  Searching LOINC for test term: '{term}'")
-    results_list = []
-    retry_count = 0
-    delay = initial_delay
 
-    while retry_count <= max_retries:
-        try:
-            response = requests.get(
+    try:
+        def fetch_page(offset, rows):
+            params = {"query": hit_filter.server_query(term) if SERVER_SIDE_FILTERING and SEARCH_BACKEND == "api" else term}
+            if rows:
+                params.update(rows=rows, offset=offset)
+            data = client.get_json(
                 LOINC_SEARCH_API,
-                params={"query": term},
-                auth=auth,
+                params,
                 headers=headers,
-                timeout=45
+                timeout=45,
+                is_negative=lambda data: not data.get("Results"),
+                decode=decode_search_response # SearchHit structs with msgspec, hit dicts otherwise
             )
-            response.raise_for_status()
-            data = response.json()
-            loinc_results = data.get("Results", [])
-            results_found_total = len(loinc_results)
-            results_kept_count = 0
-
-            if not loinc_results:
-                print(f"    -> No LOINC results found.")
-                return []
-
-            for i, hit in enumerate(loinc_results):
-                loinc_num = hit.get("LOINC_NUM", "Parse Error")
-                loinc_url = f"https://loinc.org/{loinc_num}" if loinc_num != "Parse Error" else "N/A"
-                scale_type = hit.get("SCALE_TYP", "N/A")
-
-                result_entry = {
-                    "search_term": term,
-                    "match_rank": i + 1,
-                    "loinc_test_code": loinc_num,
-                    "loinc_test_long_name": hit.get("LONG_COMMON_NAME", "N/A"),
-                    "loinc_test_status": hit.get("STATUS", "N/A"),
-                    "loinc_test_class_type": hit.get("CLASSTYPE", None),
-                    "loinc_test_component": hit.get("COMPONENT", "N/A"),
-                    "loinc_test_property": hit.get("PROPERTY", "N/A"),
-                    "loinc_test_time": hit.get("TIME_ASPCT", "N/A"),
-                    "loinc_test_system": hit.get("SYSTEM", "N/A"),
-                    "loinc_test_scale": scale_type,
-                    "loinc_test_method": hit.get("METHOD_TYP", "N/A"),
-                    "loinc_test_class": hit.get("CLASS", "N/A"),
-                    "loinc_test_short_name": hit.get("SHORTNAME", "N/A"),
-                    "loinc_test_url": loinc_url
-                }
-
-                passes_filter = True
-                if ENABLE_PRE_FILTERING:
-                    if FILTER_ON_STATUS and result_entry['loinc_test_status'] != FILTER_STATUS_KEEP:
-                        passes_filter = False
-                    if passes_filter and FILTER_ON_CLASSTYPE and result_entry['loinc_test_class_type'] != FILTER_CLASSTYPE_KEEP:
-                        passes_filter = False
-                    if passes_filter and FILTER_ON_SCALE and result_entry['loinc_test_scale'] == FILTER_SCALE_EXCLUDE:
-                        passes_filter = False
-
-                if passes_filter:
-                    results_list.append(result_entry)
-                    results_kept_count += 1
-
-            print(f"    -> Found {results_found_total} results. Kept {results_kept_count} after filtering.")
-            return results_list
-
-        except requests.exceptions.HTTPError as http_err:
-            print(f"    -> HTTP error on search API: {http_err} (Status: {response.status_code})")
-            if response.status_code == 429 or 500 <= response.status_code < 600:
-                print(f"    -> Retrying in {delay} seconds...")
-                time.sleep(delay)
-                delay *= 2
-                retry_count += 1
-            else:
-                 print(f"    -> Unrecoverable HTTP error for term '{term}'. Skipping.")
-                 return []
-        except requests.exceptions.RequestException as req_err:
-             print(f"    -> Request error on search API for term '{term}': {req_err}. Retrying in {delay} seconds...")
-             time.sleep(delay)
-             delay *= 2
-             retry_count += 1
-        except json.JSONDecodeError as json_err:
-             print(f"    -> JSON decoding error on search API for term '{term}': {json_err}. Response text: {response.text[:200]}... Skipping.")
-             return []
-        except Exception as e:
-            print(f"    -> Unexpected error during LOINC search for '{term}': {e}. Skipping.")
-            return []
+            return data.get("Results", [])
 
-        time.sleep(0.2)
+        # Filter raw hits before building rows; with a top-K, stop paging once K are kept
+        kept_hits, outcomes, results_found_total = collect_hits(
+            fetch_page, hit_filter, top_k=MAX_RESULTS_PER_TERM, page_size=SEARCH_PAGE_SIZE, max_pages=SEARCH_MAX_PAGES)
 
-    print(f"    -> Failed to get results for term '{term}' after {max_retries + 1} attempts.")
-    return []
+        if not results_found_total:
+            print(f"    -> No LOINC results found.")
+            return []
+
+        for outcome, count in outcomes.items():
+            run_metrics.inc("loinc_rows_total", count, outcome=outcome)
+        results_kept_count = len(kept_hits)
+        if scorer is not None:
+            scored_hits = scorer.rerank(kept_hits) # One pass over all candidates
+        else:
+            scored_hits = [(rank, hit, None) for rank, hit in kept_hits]
+
+        print(f"    -> Found {results_found_total} results. Kept {results_kept_count} after filtering.")
+        return HitBatch.from_scored(term, scored_hits, layout=AGGREG_LAYOUT)
+
+    except OfflineCacheMiss:
+        print(f"    -> Search for '{term}' not in cache (offline mode). Skipping.")
+        return None
+    except requests.exceptions.HTTPError as http_err:
+        status_code = http_err.response.status_code if http_err.response is not None else 0
+        print(f"    -> HTTP error on search API: {http_err} (Status: {status_code})")
+        print(f"    -> Giving up on term '{term}'. Skipping.")
+        return None
+    except requests.exceptions.RequestException as req_err:
+         print(f"    -> Request error on search API for term '{term}': {req_err}. Skipping.")
+         return None
+    except json.JSONDecodeError as json_err:
+         print(f"    -> JSON decoding error on search API for term '{term}': {json_err}. Response text: {json_err.doc[:200]}... Skipping.")
+         return None
+    except Exception as e:
+        print(f"    -> Unexpected error during LOINC search for '{term}': {e}. Skipping.")
+        return None
 
 # --- Helper Function to Fetch LOINC Panel Parameter Codes via FHIR API ---
 # (Modified slightly to *only* return codes or an error string)
-def get_loinc_parameter_codes_from_fhir(loinc_panel_code, auth, headers, max_retries=2, initial_delay=1):
+def get_loinc_parameter_codes_from_fhir(loinc_panel_code, client, headers):
     """Fetches panel member codes for a given LOINC code using the FHIR Questionnaire API.
        Returns a list of codes or an error/status string."""
     print(f"      Fetching FHIR Questionnaire for LOINC Panel: {loinc_panel_code}")
     param_codes = []
-    retry_count = 0
-    delay = initial_delay
 
     if not loinc_panel_code or loinc_panel_code == "Parse Error":
         print("      -> Invalid LOINC panel code provided. Skipping FHIR search.")
@@ -153,69 +228,58 @@ def get_loinc_parameter_codes_from_fhir(loinc_panel_code, auth, headers, max_ret
 
     params = {"url": f"http://loinc.org/q/{loinc_panel_code}"}
 
-    while retry_count <= max_retries:
-        try:
-            response = requests.get(
-                LOINC_FHIR_QUESTIONNAIRE_API,
-                params=params,
-                auth=auth,
-                headers=headers,
-                timeout=45
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get("total", 0) > 0 and data.get("entry"):
-                questionnaire_resource = data["entry"][0].get("resource")
-                if questionnaire_resource and questionnaire_resource.get("resourceType") == "Questionnaire":
-                    items = questionnaire_resource.get("item", [])
-                    if not items:
-                         print(f"      -> Questionnaire found for {loinc_panel_code}, but contains no 'item' elements (parameters).")
-                         return "No Params Found" # Special string indicating success but no items
-
-                    for item in items:
-                        code_info = item.get("code", [{}])[0]
-                        code = code_info.get("code", "No Code")
-                        param_codes.append(code)
-
-                    print(f"      -> Found {len(param_codes)} parameter codes via FHIR.")
-                    return param_codes # Return the list of codes
-                else:
-                    print(f"      -> FHIR response for {loinc_panel_code} does not contain a valid Questionnaire resource.")
-                    return "FHIR Resource Error"
-            else:
-                print(f"      -> No FHIR Questionnaire found for LOINC panel code: {loinc_panel_code}")
-                return "FHIR Not Found"
-
-        except requests.exceptions.HTTPError as http_err:
-            print(f"      -> HTTP error on FHIR API for {loinc_panel_code}: {http_err} (Status: {response.status_code})")
-            if response.status_code == 429 or 500 <= response.status_code < 600:
-                print(f"      -> Retrying in {delay} seconds...")
-                time.sleep(delay)
-                delay *= 2
-                retry_count += 1
+    try:
+        data = client.get_json(
+            LOINC_FHIR_QUESTIONNAIRE_API,
+            params,
+            headers=headers,
+            timeout=45,
+            is_negative=lambda data: not data.get("total")
+        )
+
+        if data.get("total", 0) > 0 and data.get("entry"):
+            questionnaire_resource = data["entry"][0].get("resource")
+            if questionnaire_resource and questionnaire_resource.get("resourceType") == "Questionnaire":
+                items = questionnaire_resource.get("item", [])
+                if not items:
+                     print(f"      -> Questionnaire found for {loinc_panel_code}, but contains no 'item' elements (parameters).")
+                     return "No Params Found" # Special string indicating success but no items
+
+                # Nested sub-panels (e.g. a CBC's differential) are replaced by their own members
+                param_codes = [code for code, _ in questionnaire_leaves(items)]
+
+                print(f"      -> Found {len(param_codes)} parameter codes via FHIR.")
+                return param_codes # Return the list of codes
             else:
-                print(f"      -> Unrecoverable FHIR HTTP error for {loinc_panel_code}.")
-                return f"FHIR HTTP Error {response.status_code}"
-        except requests.exceptions.RequestException as req_err:
-            print(f"      -> Request error on FHIR API for {loinc_panel_code}: {req_err}. Retrying...")
-            time.sleep(delay)
-            delay *= 2
-            retry_count += 1
-        except json.JSONDecodeError as json_err:
-            print(f"      -> JSON decoding error on FHIR API for {loinc_panel_code}: {json_err}. Response: {response.text[:200]}...")
-            return "FHIR JSON Error"
-        except Exception as e:
-            print(f"      -> Unexpected error during FHIR fetch for {loinc_panel_code}: {e}.")
-            return "FHIR Unexpected Error"
-
-        time.sleep(0.2)
-
-    print(f"      -> Failed to get FHIR results for {loinc_panel_code} after {max_retries + 1} attempts.")
-    return "FHIR Fetch Failed"
+                print(f"      -> FHIR response for {loinc_panel_code} does not contain a valid Questionnaire resource.")
+                return "FHIR Resource Error"
+        else:
+            print(f"      -> No FHIR Questionnaire found for LOINC panel code: {loinc_panel_code}")
+            return "FHIR Not Found"
+
+    except OfflineCacheMiss:
+        print(f"      -> FHIR Questionnaire for {loinc_panel_code} not in cache (offline mode).")
+        return "FHIR Not Cached"
+    except requests.exceptions.HTTPError as http_err:
+        status_code = http_err.response.status_code if http_err.response is not None else 0
+        print(f"      -> HTTP error on FHIR API for {loinc_panel_code}: {http_err} (Status: {status_code})")
+        if status_code == 429 or 500 <= status_code < 600:
+            print(f"      -> Failed to get FHIR results for {loinc_panel_code} after retries.")
+            return "FHIR Fetch Failed"
+        print(f"      -> Unrecoverable FHIR HTTP error for {loinc_panel_code}.")
+        return f"FHIR HTTP Error {status_code}"
+    except requests.exceptions.RequestException as req_err:
+        print(f"      -> Request error on FHIR API for {loinc_panel_code}: {req_err}.")
+        return "FHIR Fetch Failed"
+    except json.JSONDecodeError as json_err:
+        print(f"      -> JSON decoding error on FHIR API for {loinc_panel_code}: {json_err}. Response: {json_err.doc[:200]}...")
+        return "FHIR JSON Error"
+    except Exception as e:
+        print(f"      -> Unexpected error during FHIR fetch for {loinc_panel_code}: {e}.")
+        return "FHIR Unexpected Error"
 
 # --- NEW Helper Function to Get Long Common Name for a Specific LOINC Code ---
-def get_long_common_name_for_code(loinc_code, auth, headers, max_retries=2, initial_delay=1):
+def get_long_common_name_for_code(loinc_code, client, headers):
     """Fetches the Long Common Name for a specific LOINC code using the search API."""
     print(f"        Fetching LCN for parameter code: {loinc_code}")
 
@@ -223,84 +287,244 @@ def get_long_common_name_for_code(loinc_code, auth, headers, max_retries=2, init
         print(f"        -> Invalid or missing code ('{loinc_code}'). Cannot fetch LCN.")
         return f"{loinc_code} (LCN N/A)" # Return original code with note
 
-    retry_count = 0
-    delay = initial_delay
 
-    while retry_count <= max_retries:
-        try:
-            # Search specifically for the LOINC code
-            response = requests.get(
-                LOINC_SEARCH_API,
-                params={"query": f'"{loinc_code}"'}, # Exact match search if possible
-                auth=auth,
-                headers=headers,
-                timeout=30 # Can likely use shorter timeout for code lookup
-            )
-            response.raise_for_status()
-            data = response.json()
-            loinc_results = data.get("Results", [])
-
-            if not loinc_results:
-                print(f"        -> No search results found for code {loinc_code}.")
-                return f"{loinc_code} (LCN Not Found)"
-
-            # Find the result that exactly matches the requested LOINC code
-            for hit in loinc_results:
-                if hit.get("LOINC_NUM") == loinc_code:
-                    lcn = hit.get("LONG_COMMON_NAME", f"{loinc_code} (LCN Missing in Record)")
-                    print(f"        -> Found LCN: {lcn[:50]}...") # Print truncated LCN
-                    return lcn # Return the found Long Common Name
-
-            # If loop finishes without finding an exact match (should be rare when searching by code)
-            print(f"        -> Search results found, but none matched code {loinc_code} exactly.")
-            return f"{loinc_code} (LCN Not Found - No Exact Match)"
-
-        except requests.exceptions.HTTPError as http_err:
-            print(f"        -> HTTP error fetching LCN for {loinc_code}: {http_err} (Status: {response.status_code})")
-            if response.status_code == 429 or 500 <= response.status_code < 600:
-                 print(f"        -> Retrying in {delay} seconds...")
-                 time.sleep(delay)
-                 delay *= 2
-                 retry_count += 1
-            else:
-                 print(f"        -> Unrecoverable HTTP error for code {loinc_code}. Cannot get LCN.")
-                 return f"{loinc_code} (LCN HTTP Error)"
-        except requests.exceptions.RequestException as req_err:
-             print(f"        -> Request error fetching LCN for {loinc_code}: {req_err}. Retrying...")
-             time.sleep(delay)
-             delay *= 2
-             retry_count += 1
-        except json.JSONDecodeError as json_err:
-             print(f"        -> JSON error fetching LCN for {loinc_code}: {json_err}.")
-             return f"{loinc_code} (LCN JSON Error)"
-        except Exception as e:
-            print(f"        -> Unexpected error fetching LCN for {loinc_code}: {e}.")
-            return f"{loinc_code} (LCN Unexpected Error)"
-
-        time.sleep(0.1) # Shorter delay between LCN lookups is probably fine
-
-    print(f"        -> Failed to get LCN for code {loinc_code} after {max_retries + 1} attempts.")
-    return f"{loinc_code} (LCN Fetch Failed)"
+    try:
+        # Search specifically for the LOINC code
+        data = client.get_json(
+            LOINC_SEARCH_API,
+            {"query": f'"{loinc_code}"'}, # Exact match search if possible
+            headers=headers,
+            timeout=30 # Can likely use shorter timeout for code lookup
+        )
+        loinc_results = data.get("Results", [])
+
+        if not loinc_results:
+            print(f"        -> No search results found for code {loinc_code}.")
+            return f"{loinc_code} (LCN Not Found)"
+
+        # Find the result that exactly matches the requested LOINC code
+        for hit in loinc_results:
+            if hit.get("LOINC_NUM") == loinc_code:
+                lcn = hit.get("LONG_COMMON_NAME", f"{loinc_code} (LCN Missing in Record)")
+                print(f"        -> Found LCN: {lcn[:50]}...") # Print truncated LCN
+                return lcn # Return the found Long Common Name
+
+        # If loop finishes without finding an exact match (should be rare when searching by code)
+        print(f"        -> Search results found, but none matched code {loinc_code} exactly.")
+        return f"{loinc_code} (LCN Not Found - No Exact Match)"
+
+    except OfflineCacheMiss:
+        print(f"        -> LCN for {loinc_code} not in cache (offline mode).")
+        return f"{loinc_code} (LCN Not Cached)"
+    except requests.exceptions.HTTPError as http_err:
+        status_code = http_err.response.status_code if http_err.response is not None else 0
+        print(f"        -> HTTP error fetching LCN for {loinc_code}: {http_err} (Status: {status_code})")
+        if status_code == 429 or 500 <= status_code < 600:
+             print(f"        -> Failed to get LCN for code {loinc_code} after retries.")
+             return f"{loinc_code} (LCN Fetch Failed)"
+        print(f"        -> Unrecoverable HTTP error for code {loinc_code}. Cannot get LCN.")
+        return f"{loinc_code} (LCN HTTP Error)"
+    except requests.exceptions.RequestException as req_err:
+         print(f"        -> Request error fetching LCN for {loinc_code}: {req_err}.")
+         return f"{loinc_code} (LCN Fetch Failed)"
+    except json.JSONDecodeError as json_err:
+         print(f"        -> JSON error fetching LCN for {loinc_code}: {json_err}.")
+         return f"{loinc_code} (LCN JSON Error)"
+    except Exception as e:
+        print(f"        -> Unexpected error fetching LCN for {loinc_code}: {e}.")
+        return f"{loinc_code} (LCN Unexpected Error)"
+
+# --- Helper Function to Search LOINC for a Single Internal Test ---
+def placeholder_row(search_term, code, long_name, failed=False):
+    """The single row written for a test without candidates. `failed` rows are kept
+       out of the checkpoint, so the test is tried again on the next run."""
+    return {
+        "search_term": search_term, "match_rank": 0, "match_score": "N/A",
+        "loinc_test_code": code, "loinc_test_long_name": long_name,
+        # Fill other test fields as N/A
+        "loinc_test_status": "N/A", "loinc_test_class_type": "N/A", "loinc_test_component": "N/A",
+        "loinc_test_property": "N/A", "loinc_test_time": "N/A", "loinc_test_system": "N/A",
+        "loinc_test_scale": "N/A", "loinc_test_method": "N/A", "loinc_test_class": "N/A",
+        "loinc_test_short_name": "N/A", "loinc_test_url": "N/A",
+        # Parameter fields also N/A
+        "loinc_parameter_codes": "N/A", "loinc_parameter_names": "N/A",
+        "_search_failed": failed # Not an output column; keeps it out of the checkpoint
+    }
+
+def search_test(test_row, client, progress_label=""):
+    """Searches LOINC for one internal test. Returns one row per kept candidate
+       (parameters not yet expanded), or a single placeholder row."""
+    internal_test_id = test_row['test_id']
+    internal_test_name = test_row['test_name']
+    print(f"\n{progress_label}Processing Test ID: {internal_test_id}, Name: '{internal_test_name}'")
+
+    search_term = test_search_term(internal_test_name)
+
+    # --- 4a. Search LOINC for potential test matches ---
+    scorer = None
+    if RERANK_RESULTS:
+        scorer = CandidateScorer(search_term, parameter_names=str(test_row['parameter_name']).split('\n'))
+    loinc_test_matches = search_loinc_tests(search_term, client, HEADERS, scorer)
+
+    test_sheet_data = []
+
+    if not loinc_test_matches:
+        print(f"  No suitable LOINC test matches found or kept for '{internal_test_name}'. Adding placeholder row.")
+        test_sheet_data.append(placeholder_row(search_term, "Not Found", "No matching LOINC term found/kept",
+                                               failed=loinc_test_matches is None))
+        return test_sheet_data
+
+    return loinc_test_matches.rows() # One fresh dict per candidate; expanded in place later
+
+# --- Helper Function to Expand a Test's Candidate Panels into Parameter Codes ---
+def expand_test(test_sheet_data, client, precheck=None, max_expanded=None, panel_graph=None):
+    """Fetches each candidate's panel members from FHIR. For expanded panels
+       'loinc_parameter_codes' holds the list of codes until `attach_parameter_names`.
+       Panels the PanelGraph knows are expanded locally, with no request.
+       With a PanelPrecheck, codes known not to be panels skip the request.
+       With `max_expanded`, only the first that many candidates (the best-scoring
+       ones when reranked) are expanded; the rest are marked NOT_EXPANDED_STATUS."""
+    for index, row_data in enumerate(test_sheet_data):
+        if "loinc_parameter_codes" in row_data:
+            continue # Placeholder row, or already expanded
+        loinc_test_code = row_data['loinc_test_code']
+        panel_type = row_data.pop("_panel_type", None)
+        if max_expanded is not None and index >= max_expanded:
+            row_data["loinc_parameter_codes"] = NOT_EXPANDED_STATUS
+            row_data["loinc_parameter_names"] = NOT_EXPANDED_STATUS
+            continue
+
+        # --- 4b-i. Get parameter codes from the panel graph, else FHIR (unless the code cannot be a panel) ---
+        members = panel_graph.expand(loinc_test_code) if panel_graph is not None else None
+        skip_reason = None
+        if members is None and precheck is not None:
+            skip_reason = precheck.skip_reason(loinc_test_code, panel_type)
+        if members is not None:
+            print(f"      Expanded {loinc_test_code} from the panel graph ({len(members)} members)")
+            parameter_codes_result = [code for code, _ in members]
+            row_data["_member_names"] = {code: name for code, name in members if name} # Seeds the LCN resolver
+        elif skip_reason:
+            print(f"      Skipping FHIR Questionnaire for {loinc_test_code}: {skip_reason}")
+            parameter_codes_result = "FHIR Not Found"
+        else:
+            parameter_codes_result = get_loinc_parameter_codes_from_fhir(loinc_test_code, client, FHIR_HEADERS)
+            if parameter_codes_result == "FHIR Not Found" and precheck is not None:
+                precheck.record_not_found(loinc_test_code)
+
+        # --- 4b-ii. Keep the codes; LCNs are resolved in the next pipeline stage ---
+        if isinstance(parameter_codes_result, list): # Success, got a list of codes
+            row_data["loinc_parameter_codes"] = parameter_codes_result
+            row_data["loinc_parameter_names"] = None
+        else: # Handle error strings or "No Params Found" from FHIR function
+            error_or_status_msg = parameter_codes_result
+            print(f"      -> Parameter fetch status for {loinc_test_code}: {error_or_status_msg}")
+            row_data["loinc_parameter_codes"] = error_or_status_msg # e.g., "No Params Found", "FHIR HTTP Error 404"
+            row_data["loinc_parameter_names"] = error_or_status_msg # Keep message consistent
+
+    return test_sheet_data
+
+# --- Helper Function to Decide Whether a Test's Result Can Be Checkpointed ---
+RETRYABLE_PARAMETER_STATUSES = ("FHIR HTTP Error", "FHIR Fetch Failed", "FHIR Not Cached",
+                                "FHIR JSON Error", "FHIR Unexpected Error")
+RETRYABLE_LCN_MARKERS = ("(LCN Fetch Failed)", "(LCN HTTP Error)", "(LCN Not Cached)",
+                         "(LCN JSON Error)", "(LCN Unexpected Error)")
+
+def is_final_result(test_sheet_data):
+    """False if the search, a panel expansion or an LCN lookup failed in a way a later run could fix."""
+    for row_data in test_sheet_data:
+        if row_data.get("_search_failed"):
+            return False
+        parameter_codes = row_data.get("loinc_parameter_codes")
+        if isinstance(parameter_codes, str) and parameter_codes.startswith(RETRYABLE_PARAMETER_STATUSES):
+            return False
+        parameter_names = row_data.get("loinc_parameter_names")
+        if isinstance(parameter_names, str) and any(marker in parameter_names for marker in RETRYABLE_LCN_MARKERS):
+            return False
+    return True
+
+# --- Helper Function to Fingerprint an Aggregated Test for Delta Runs ---
+def test_fingerprint(test_row):
+    """Fingerprint of a test's name, alias and parameter set, plus the filter settings."""
+    parameter_names = sorted(p for p in str(test_row['parameter_name']).split('\n') if p)
+    return fingerprint(test_row['test_name'], test_row['test_alias_name'], parameter_names,
+                       ENABLE_PRE_FILTERING, FILTER_ON_STATUS, FILTER_STATUS_KEEP, FILTER_ON_CLASSTYPE,
+                       FILTER_CLASSTYPE_KEEP, FILTER_ON_SCALE, FILTER_SCALE_EXCLUDE, SERVER_SIDE_FILTERING,
+                       MAX_RESULTS_PER_TERM, SEARCH_PAGE_SIZE, RERANK_RESULTS, EXPAND_TOP_N, MATCH_PARAMETERS)
+
+# --- Helper Function to Fill In Parameter LCNs from the Resolver ---
+def attach_parameter_names(test_sheet_data, resolver, matcher=None):
+    """Replaces code lists from `expand_test` with newline-joined codes and the LCNs the resolve stage fetched.
+       With a ParameterMatcher, also fills parameter_coverage/parameter_matches."""
+    for row_data in test_sheet_data:
+        parameter_codes = row_data.get("loinc_parameter_codes")
+        if isinstance(parameter_codes, list):
+            long_common_names = resolver.resolve(parameter_codes) # Memo hits, no network
+            if matcher is not None:
+                panel_match = matcher.match(long_common_names)
+                row_data["parameter_coverage"] = panel_match.coverage
+                row_data["parameter_matches"] = "\n".join(panel_match.matched_codes(parameter_codes))
+            row_data["loinc_parameter_codes"] = "\n".join(parameter_codes)
+            row_data["loinc_parameter_names"] = "\n".join(long_common_names)
+    return test_sheet_data
 
 
 # --- Main Execution ---
 if __name__ == "__main__":
-    if not LOINC_USERNAME or not LOINC_PASSWORD:
+    parser = argparse.ArgumentParser(description="Map internal tests to LOINC panels and their parameters.")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"Skip tests already completed in the checkpoint journal ({CHECKPOINT_PATH})")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Checkpoint journal path")
+    parser.add_argument("--delta", action="store_true",
+                        help=f"Only fetch tests that are new or changed since the last run ({MANIFEST_PATH})")
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help="Delta manifest path")
+    parser.add_argument("--output-format", choices=["xlsx", "csv", "parquet"], default=OUTPUT_FORMAT,
+                        help="Workbook (xlsx) or one long machine-readable table (csv/parquet)")
+    parser.add_argument("--input", default=INPUT_CSV, help=f"Test-to-parameter mapping (.csv or .parquet, default: {INPUT_CSV})")
+    parser.add_argument("--output", help="Output path (default: OUTPUT_EXCEL with the matching extension)")
+    parser.add_argument("--top-k", type=int, default=MAX_RESULTS_PER_TERM,
+                        help="Keep at most this many filtered LOINC candidates per test (default: all)")
+    parser.add_argument("--page-size", type=int, default=SEARCH_PAGE_SIZE,
+                        help="Page through search results this many at a time, stopping once --top-k are kept")
+    parser.add_argument("--expand-top", type=int, default=EXPAND_TOP_N,
+                        help="Resolve panel parameters (FHIR + LCN) for only the N best-scoring candidates per test")
+    parser.add_argument("--metrics-log", default=METRICS_LOG_PATH,
+                        help="Append structured JSON-lines events (one per request, plus the run summary); '-' = stderr")
+    parser.add_argument("--metrics-json", default=METRICS_JSON_PATH, help="Write the end-of-run metrics as JSON")
+    parser.add_argument("--prometheus", default=METRICS_PROMETHEUS_PATH,
+                        help="Write the end-of-run metrics in Prometheus text format")
+    args = parser.parse_args()
+    if args.metrics_log:
+        run_metrics.event_log = JsonEventLog(args.metrics_log)
+    MAX_RESULTS_PER_TERM, SEARCH_PAGE_SIZE, EXPAND_TOP_N = args.top_k, args.page_size, args.expand_top
+    output_path = args.output or (os.path.splitext(OUTPUT_EXCEL)[0] + "." + args.output_format)
+
+    use_local_index = SEARCH_BACKEND == "local"
+    if not use_local_index and not OFFLINE_MODE and (not LOINC_USERNAME or not LOINC_PASSWORD):
         print("ERROR: LOINC_USERNAME and LOINC_PASSWORD environment variables must be set.")
         exit(1)
+    if OFFLINE_MODE and not CACHE_ENABLED:
+        print("ERROR: Offline mode (LOINC_OFFLINE=1) requires CACHE_ENABLED = True.")
+        exit(1)
 
-    loinc_auth = HTTPBasicAuth(LOINC_USERNAME, LOINC_PASSWORD)
+    loinc_auth = HTTPBasicAuth(LOINC_USERNAME or "", LOINC_PASSWORD or "")
+    response_cache = None
+    if CACHE_ENABLED and not use_local_index:
+        response_cache = ResponseCache(CACHE_PATH, ttl_seconds=CACHE_TTL_SECONDS,
+                                       negative_ttl_seconds=CACHE_NEGATIVE_TTL_SECONDS,
+                                       max_bytes=CACHE_MAX_BYTES, offline=OFFLINE_MODE)
+        print(f"Using response cache: {CACHE_PATH}" + (" (OFFLINE mode)" if OFFLINE_MODE else ""))
+    print(f"JSON decoder: {default_decoder.backend}")
 
     # --- 1. Read and Process Input CSV ---
-    print(f"Reading input file: {INPUT_CSV}")
+    print(f"Reading input file: {args.input}")
     try:
-        input_df = pd.read_csv(INPUT_CSV, dtype=str)
+        input_df = read_input_frame(args.input, dtype=str).astype(object)
         input_df.fillna('', inplace=True)
     except FileNotFoundError:
-        print(f"ERROR: Input file not found: {INPUT_CSV}")
+        print(f"ERROR: Input file not found: {args.input}")
         exit(1)
     except Exception as e:
-        print(f"ERROR: Failed to read input CSV: {e}")
+        print(f"ERROR: Failed to read input file: {e}")
         exit(1)
 
     print("Aggregating internal parameters by test...")
@@ -313,170 +537,218 @@ if __name__ == "__main__":
     }
     unique_tests_df = input_df.groupby('test_id', as_index=False).agg(agg_funcs)
 
-    summary_cols = ['test_id', 'test_name', 'test_alias_name', 'test_code', 'parameter_name', 'parameter_id']
-    summary_df = unique_tests_df[summary_cols]
-    summary_df = summary_df.rename(columns={
+    summary_df = unique_tests_df.rename(columns={
         'parameter_id': 'internal_parameter_ids',
         'parameter_name': 'internal_parameter_names'
-    })
+    })[SUMMARY_COLUMNS]
 
     print(f"Found {len(unique_tests_df)} unique tests.")
 
-    # --- 2. Prepare Excel Writer ---
-    print(f"Preparing Excel output file: {OUTPUT_EXCEL}")
+    # --- 2. Prepare Output Writer ---
+    print(f"Preparing {args.output_format} output file: {output_path}")
     try:
-        # Ensure the directory exists if OUTPUT_EXCEL includes a path
-        output_dir = os.path.dirname(OUTPUT_EXCEL)
+        # Ensure the directory exists if the output path includes a directory
+        output_dir = os.path.dirname(output_path)
         if output_dir and not os.path.exists(output_dir):
              os.makedirs(output_dir)
              print(f"Created output directory: {output_dir}")
-        writer = pd.ExcelWriter(OUTPUT_EXCEL, engine='openpyxl')
+        exporter = open_mapping_exporter(output_path, args.output_format)
     except Exception as e:
-        print(f"ERROR: Could not create Excel writer for {OUTPUT_EXCEL}: {e}")
+        print(f"ERROR: Could not create {args.output_format} writer for {output_path}: {e}")
         exit(1)
 
     # --- 3. Write Summary Sheet ---
     print("Writing summary sheet...")
     try:
-        summary_df.to_excel(writer, sheet_name='Test Summary', index=False)
-        worksheet = writer.sheets['Test Summary']
-        for i, col in enumerate(summary_df.columns):
-             try: # Added try-except for robustness in width calculation
-                 max_len = max(summary_df[col].astype(str).map(len).max(), len(col)) + 2
-                 worksheet.column_dimensions[chr(65+i)].width = min(max_len, 80) # Increased limit slightly
-             except Exception as width_e:
-                 print(f"Warning: Could not auto-adjust width for column '{col}' in Summary Sheet: {width_e}")
+        exporter.write_summary(SUMMARY_COLUMNS, summary_df.to_dict('records'))
     except Exception as e:
         print(f"ERROR: Failed to write summary sheet: {e}")
 
-    # --- 4. Iterate Through Tests, Search LOINC, Fetch Parameters, Write Sheets ---
+    # --- 4. Search LOINC and Fetch Parameters for All Tests (pipelined) ---
     start_time = time.time()
     total_tests = len(unique_tests_df)
-
-    for loop_count, (index, test_row) in enumerate(unique_tests_df.iterrows()):
-        internal_test_id = test_row['test_id']
-        internal_test_name = test_row['test_name']
-        print(f"\n[{loop_count + 1}/{total_tests}] Processing Test ID: {internal_test_id}, Name: '{internal_test_name}'")
-
-        search_term = re.sub(r'(?i)\s+(test|panel)$', '', internal_test_name).strip()
-        if not search_term:
-            search_term = internal_test_name
-
-        # --- 4a. Search LOINC for potential test matches ---
-        loinc_test_matches = search_loinc_tests(search_term, loinc_auth, HEADERS)
-        time.sleep(0.2)
-
-        test_sheet_data = []
-
-        if not loinc_test_matches:
-            print(f"  No suitable LOINC test matches found or kept for '{internal_test_name}'. Adding placeholder row.")
-            placeholder_row = {
-                "search_term": search_term, "match_rank": 0,
-                "loinc_test_code": "Not Found", "loinc_test_long_name": "No matching LOINC term found/kept",
-                # Fill other test fields as N/A
-                "loinc_test_status": "N/A", "loinc_test_class_type": "N/A", "loinc_test_component": "N/A",
-                "loinc_test_property": "N/A", "loinc_test_time": "N/A", "loinc_test_system": "N/A",
-                "loinc_test_scale": "N/A", "loinc_test_method": "N/A", "loinc_test_class": "N/A",
-                "loinc_test_short_name": "N/A", "loinc_test_url": "N/A",
-                # Parameter fields also N/A
-                "loinc_parameter_codes": "N/A", "loinc_parameter_names": "N/A"
-            }
-            test_sheet_data.append(placeholder_row)
-        else:
-            # --- 4b. For each potential test match... ---
-            for test_match in loinc_test_matches:
-                loinc_test_code = test_match['loinc_test_code']
-
-                # --- 4b-i. Get parameter codes from FHIR ---
-                parameter_codes_result = get_loinc_parameter_codes_from_fhir(loinc_test_code, loinc_auth, FHIR_HEADERS)
-                time.sleep(0.1) # Delay after FHIR call
-
-                final_param_codes_str = ""
-                final_param_names_str = ""
-
-                # --- 4b-ii. If codes found, get LCN for each code ---
-                if isinstance(parameter_codes_result, list): # Success, got a list of codes
-                    parameter_codes = parameter_codes_result
-                    long_common_names = []
-                    actual_codes_found = [] # Store codes for which we attempt LCN lookup
-
-                    for p_code in parameter_codes:
-                         actual_codes_found.append(p_code) # Add code regardless of LCN success
-                         lcn = get_long_common_name_for_code(p_code, loinc_auth, HEADERS)
-                         long_common_names.append(lcn)
-                         time.sleep(0.1) # Politeness delay *between* LCN lookups
-
-                    final_param_codes_str = "\n".join(actual_codes_found)
-                    final_param_names_str = "\n".join(long_common_names)
-
-                else: # Handle error strings or "No Params Found" from FHIR function
-                    error_or_status_msg = parameter_codes_result
-                    print(f"      -> Parameter fetch status for {loinc_test_code}: {error_or_status_msg}")
-                    final_param_codes_str = error_or_status_msg # e.g., "No Params Found", "FHIR HTTP Error 404"
-                    final_param_names_str = error_or_status_msg # Keep message consistent
-
-                # --- 4b-iii. Combine test match info with final parameter info ---
-                row_data = test_match.copy()
-                row_data["loinc_parameter_codes"] = final_param_codes_str
-                row_data["loinc_parameter_names"] = final_param_names_str # Now contains LCNs or error messages
-                test_sheet_data.append(row_data)
-                # time.sleep(0.2) # Moved delays inside loops
-
-
-        # --- 4c. Write the sheet for this internal test ---
-        if test_sheet_data:
-            # Use clean_sheet_name function for safety
-            sheet_name = internal_test_name[:31]
-            print(f"  Writing sheet: '{sheet_name}' ({len(test_sheet_data)} rows)")
-            try:
-                test_df = pd.DataFrame(test_sheet_data)
-                # Define column order - keeping names descriptive
-                cols_order = [
-                    "loinc_test_code", "search_term", "loinc_test_long_name", "loinc_test_short_name", "loinc_test_url",
-                    "loinc_parameter_names", "loinc_parameter_codes", # Swapped order slightly, LCN first
-                    "loinc_test_status", "loinc_test_class_type", "loinc_test_class", "loinc_test_component",
-                    "loinc_test_property", "loinc_test_time", "loinc_test_system", "loinc_test_scale",
-                    "loinc_test_method", "match_rank"
-                ]
-                # Ensure all expected columns exist, add if missing (e.g., if all rows were placeholders)
-                for col in cols_order:
-                    if col not in test_df.columns:
-                        test_df[col] = "N/A" # Or appropriate default
-
-                test_df = test_df[cols_order]
-                test_df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-                worksheet = writer.sheets[sheet_name]
-                for j, col in enumerate(test_df.columns):
-                    try:
-                        if col in ["loinc_parameter_codes", "loinc_parameter_names"]:
-                             # Calculate max line length within multiline cells
-                             max_line_len = test_df[col].astype(str).map(lambda x: max((len(line) for line in x.split('\n')), default=0)).max()
-                             max_len = max(max_line_len, len(col)) + 2
-                        else:
-                             max_len = max(test_df[col].astype(str).map(len).max(), len(col)) + 2
-                        worksheet.column_dimensions[chr(65+j)].width = min(max_len, 80) # Limit max width
-                    except Exception as width_e:
-                        print(f"Warning: Could not auto-adjust width for column '{col}' in sheet '{sheet_name}': {width_e}")
-
-            except Exception as e:
-                print(f"ERROR: Failed to write sheet '{sheet_name}': {e}")
+    rate_limiter = RateLimiter(REQUESTS_PER_SECOND, max_in_flight=MAX_IN_FLIGHT)
+    if use_local_index:
+        try:
+            loinc_client = LocalLoincClient(LOCAL_INDEX_PATH)
+        except FileNotFoundError as e:
+            print(f"ERROR: {e}")
+            exit(1)
+        print(f"Using local LOINC index: {LOCAL_INDEX_PATH} (no network requests)")
+    else:
+        loinc_client = LoincClient(loinc_auth, cache=response_cache, limiter=rate_limiter,
+                                   retry_policy=RetryPolicy(MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                                                            max_delay=RETRY_MAX_DELAY),
+                                   breakers=CircuitBreakers(failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                                                            reset_timeout=CIRCUIT_RESET_SECONDS),
+                                   rate_controller=AimdRateController(
+                                       rate_limiter, min_rate=MIN_REQUESTS_PER_SECOND,
+                                       max_rate=MAX_REQUESTS_PER_SECOND) if ADAPTIVE_RATE else None,
+                                   metrics=run_metrics, pool_maxsize=POOL_MAXSIZE,
+                                   transport_retries=TRANSPORT_RETRIES)
+
+    journal = CheckpointJournal(args.checkpoint, resume=args.resume)
+    if args.resume:
+        print(f"Resuming from {args.checkpoint}: {len(journal.completed)} tests already completed.")
+    manifest = RunManifest(args.manifest)
+    if args.delta:
+        print(f"Delta mode: reusing results for unchanged tests from {args.manifest} ({len(manifest)} recorded).")
+    lcn_resolver = LcnResolver(
+        loinc_client, FHIR_HEADERS, fhir_base=LOINC_FHIR_BASE, batch_size=LCN_BATCH_SIZE,
+        fallback=lambda p_code: get_long_common_name_for_code(p_code, loinc_client, HEADERS),
+        max_workers=LCN_WORKERS, use_batch=LCN_BATCH_LOOKUP
+    )
+
+    panel_graph = None
+    if PANEL_GRAPH:
+        panel_graph = load_panel_graph(PANELS_CSV_PATH or None,
+                                       PANEL_LIST_INDEX if os.path.exists(PANEL_LIST_INDEX) else None,
+                                       response_cache, LOINC_FHIR_QUESTIONNAIRE_API)
+
+    panel_precheck = None
+    if PANEL_PRECHECK:
+        if os.path.exists(PANEL_LIST_INDEX):
+            panel_precheck = PanelPrecheck.from_local_index(PANEL_LIST_INDEX)
+            print(f"Panel pre-check: using the panel list in {PANEL_LIST_INDEX}")
+        elif panel_graph is not None and panel_graph.complete:
+            panel_precheck = PanelPrecheck(panel_graph.panel_codes())
+            print(f"Panel pre-check: using the panel list in {PANELS_CSV_PATH}")
         else:
-             print(f"  No data generated for test '{internal_test_name}' (ID: {internal_test_id}). Skipping sheet creation.")
-
-
-    # --- 5. Save and Close Excel File ---
-    print("\nSaving Excel file...")
+            panel_precheck = PanelPrecheck()
+
+    # Pipeline stages: search -> expand -> resolve -> assemble.
+    # Each stage has its own workers and a bounded queue in front of it, so e.g. a slow
+    # FHIR Questionnaire only holds up one "expand" worker while other tests move on.
+    def search_stage(unit):
+        test_row = unit["test_row"]
+        label = f"[{unit['index'] + 1}/{total_tests}] "
+        if args.delta:
+            previous_rows = manifest.lookup(test_row['test_id'], test_fingerprint(test_row))
+            if previous_rows is not None:
+                print(f"{label}Unchanged since last run (delta): '{test_row['test_name']}'")
+                unit.update(rows=previous_rows, reused=True)
+                return unit
+        if journal.is_done(test_row['test_id']):
+            print(f"{label}Already done (checkpoint): '{test_row['test_name']}'")
+            unit.update(rows=journal.get(test_row['test_id']), reused=True)
+            return unit
+        unit["rows"] = search_test(test_row, loinc_client, label)
+        return unit
+
+    def expand_stage(unit):
+        if not unit["reused"]:
+            expand_test(unit["rows"], loinc_client, panel_precheck, max_expanded=EXPAND_TOP_N, panel_graph=panel_graph)
+        return unit
+
+    def resolve_stage(unit):
+        for row_data in unit["rows"]:
+            lcn_resolver.seed(row_data.pop("_member_names", {})) # Names from the panel file need no lookup
+        parameter_codes = [p_code for row_data in unit["rows"]
+                           if isinstance(row_data.get("loinc_parameter_codes"), list)
+                           for p_code in row_data["loinc_parameter_codes"]]
+        if parameter_codes:
+            lcn_resolver.resolve(parameter_codes)
+        return unit
+
+    def failed_unit(stage_error):
+        """The unit a stage failed on, with its rows replaced by one error row (not checkpointed)."""
+        unit, error = stage_error.item, stage_error.error
+        search_term = test_search_term(unit["test_row"]['test_name'])
+        unit["rows"] = [placeholder_row(search_term, "Error", f"{stage_error.stage} stage failed: "
+                                        f"{type(error).__name__}: {error}", failed=True)]
+        return unit
+
+    def assemble_stage(unit):
+        if isinstance(unit, StageError): # An earlier stage raised; the test gets an error row
+            return failed_unit(unit)
+        test_row, test_sheet_data = unit["test_row"], unit["rows"]
+        matcher = ParameterMatcher(str(test_row['parameter_name']).split('\n')) if MATCH_PARAMETERS else None
+        attach_parameter_names(test_sheet_data, lcn_resolver, matcher) # Memo hits, no network
+        covered = [row_data for row_data in test_sheet_data if isinstance(row_data.get("parameter_coverage"), float)]
+        if covered:
+            best = max(covered, key=lambda row_data: row_data["parameter_coverage"])
+            print(f"  Best parameter coverage for '{test_row['test_name']}': "
+                  f"{best['parameter_coverage']:.0%} ({best['loinc_test_code']})")
+        if not unit["reused"] and is_final_result(test_sheet_data):
+            journal.record(test_row['test_id'], test_sheet_data)
+            manifest.update(test_row['test_id'], test_fingerprint(test_row), test_sheet_data)
+        return unit
+
+    pipeline = Pipeline([
+        Stage("search", search_stage, workers=MAX_WORKERS),
+        Stage("expand", expand_stage, workers=EXPAND_WORKERS),
+        Stage("resolve", resolve_stage, workers=LCN_WORKERS),
+        Stage("assemble", assemble_stage, workers=1, handle_errors=True),
+    ], queue_size=PIPELINE_QUEUE_SIZE, metrics=run_metrics)
+    units = ({"index": loop_count, "test_row": test_row, "rows": None, "reused": False}
+             for loop_count, (index, test_row) in enumerate(unique_tests_df.iterrows()))
+    # --- 4c. Write one sheet per internal test, in input order, as soon as it is assembled ---
+    run_error = None
+    try:
+        for unit in pipeline.run(units):
+            if isinstance(unit, StageError): # The assemble stage itself raised
+                unit = failed_unit(unit)
+            test_row, test_sheet_data = unit["test_row"], unit["rows"]
+            internal_test_id = test_row['test_id']
+            internal_test_name = test_row['test_name']
+            if test_sheet_data:
+                sheet_name = clean_sheet_name(internal_test_name)
+                print(f"  Writing sheet: '{sheet_name}' ({len(test_sheet_data)} rows)")
+                try:
+                    with run_metrics.timer(stage="write"):
+                        exporter.write_test_sheet(sheet_name, SHEET_COLUMNS, test_sheet_data,
+                                                  test_id=internal_test_id, test_name=internal_test_name)
+                except Exception as e:
+                    print(f"ERROR: Failed to write sheet '{sheet_name}': {e}")
+            else:
+                 print(f"  No data generated for test '{internal_test_name}' (ID: {internal_test_id}). Skipping sheet creation.")
+    except Exception as e:
+        run_error = e # The loop stopped early (e.g. iterating the tests raised); the sheets written so far are still saved below
+        print(f"ERROR: Stopped reading tests: {e}")
+    finally:
+        journal.close()
+    print("\n" + pipeline.summary())
+    print(lcn_resolver.summary())
+    if panel_graph is not None:
+        print(panel_graph.summary())
+    if panel_precheck is not None:
+        print(panel_precheck.summary())
+
+    # --- 4d. Keep only the current tests in the manifest for the next --delta run ---
+    manifest.save(keep_keys=unique_tests_df['test_id'])
+    print(manifest.summary())
+    manifest.close()
+
+    # --- 5. Save and Close Output File ---
+    print("\nSaving output file...")
     try:
-        writer.close()
-        print(f"Successfully saved results to {OUTPUT_EXCEL}")
+        exporter.close()
+        print(f"Successfully saved results to {output_path}")
     except Exception as e:
         # Specific check for file possibly being open
         if isinstance(e, PermissionError):
-             print(f"ERROR: Failed to save Excel file: {e}. Please ensure the file '{OUTPUT_EXCEL}' is not open in another application.")
+             print(f"ERROR: Failed to save output file: {e}. Please ensure the file '{output_path}' is not open in another application.")
         else:
-             print(f"ERROR: Failed to save Excel file: {e}")
+             print(f"ERROR: Failed to save output file: {e}")
 
 
     end_time = time.time()
-    print(f"\nScript finished in {end_time - start_time:.2f} seconds.")
\ No newline at end of file
+    print(f"\nScript finished in {end_time - start_time:.2f} seconds.")
+    print(loinc_client.summary())
+    loinc_client.close()
+    if response_cache is not None:
+        print(response_cache.summary())
+        response_cache.close()
+
+    print(run_metrics.summary())
+    run_metrics.event("run_finished", script="loinc_aggreg", elapsed_seconds=round(end_time - start_time, 3),
+                      tests=total_tests, metrics=run_metrics.as_dict())
+    if args.metrics_json:
+        run_metrics.write_json(args.metrics_json)
+        print(f"Metrics written to {args.metrics_json}")
+    if args.prometheus:
+        run_metrics.write_prometheus(args.prometheus)
+        print(f"Prometheus metrics written to {args.prometheus}")
+    run_metrics.close()
+    if run_error is not None:
+        exit(1)
\ No newline at end of file
@@ -0,0 +1,228 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.auth import HTTPBasicAuth
+
+from loinc_cache import ResponseCache
+from loinc_client import LoincClient
+from loinc_concurrency import RateLimiter
+from loinc_filters import DEFAULT_MAX_PAGES, HitFilter, collect_hits
+from loinc_lcn import LcnResolver
+from loinc_local_index import LocalLoincClient
+from loinc_match import ParameterMatcher
+from loinc_normalize import test_search_term
+from loinc_panels import questionnaire_leaves
+from loinc_rank import CandidateScorer
+from loinc_retry import CircuitBreakers, RetryPolicy
+
+# --- Async Client Defaults ---
+DEFAULT_SEARCH_API_URL = "https://loinc.regenstrief.org/searchapi/loincs"
+DEFAULT_FHIR_BASE_URL = "https://fhir.loinc.org/"
+DEFAULT_USER_AGENT = "LIMSMappingScript/2.1 (Contact: ayush.wardhan@iqline.co.in)"
+DEFAULT_CONCURRENCY = 8     # Lookups running at once (threads in the executor)
+DEFAULT_TIMEOUT = 60.0      # Seconds per library call, including retries and rate-limit waits
+
+
+class ClientConfig:
+    """Where and how fast to talk to LOINC; replaces the scripts' module-level settings.
+
+    With `local_index_path`, everything is answered from a local index (no network).
+    `cache_path` enables the shared SQLite response cache. `timeout` bounds each
+    library call and `concurrency` how many run at once."""
+
+    def __init__(self, username=None, password=None, search_api_url=DEFAULT_SEARCH_API_URL,
+                 fhir_base_url=DEFAULT_FHIR_BASE_URL, requests_per_second=8.0, max_in_flight=4,
+                 concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, request_timeout=45,
+                 max_attempts=4, cache_path=None, offline=False, local_index_path=None, metrics=None,
+                 user_agent=DEFAULT_USER_AGENT):
+        self.username = username
+        self.password = password
+        self.search_api_url = search_api_url
+        self.fhir_base_url = fhir_base_url
+        self.requests_per_second = requests_per_second
+        self.max_in_flight = max_in_flight
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        self.max_attempts = max_attempts
+        self.cache_path = cache_path
+        self.offline = offline
+        self.local_index_path = local_index_path
+        self.metrics = metrics
+        self.user_agent = user_agent
+
+    @property
+    def questionnaire_url(self):
+        return self.fhir_base_url.rstrip("/") + "/Questionnaire/"
+
+
+class SearchConfig:
+    """What a search keeps: the scripts' ENABLE_PRE_FILTERING/FILTER_*, top-K, paging and ranking settings."""
+
+    def __init__(self, hit_filter=None, top_k=None, page_size=None, max_pages=DEFAULT_MAX_PAGES,
+                 server_side_filtering=False, rerank=True, expand_top_n=None):
+        self.hit_filter = hit_filter if hit_filter is not None else HitFilter(status_keep="ACTIVE")
+        self.top_k = top_k
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.server_side_filtering = server_side_filtering
+        self.rerank = rerank
+        self.expand_top_n = expand_top_n # map_tests: candidates per test whose panels are expanded (None = all)
+
+
+class AsyncLoincClient:
+    """Asyncio front end to the LOINC Search API and FHIR server, for use as a library.
+
+        async with AsyncLoincClient(ClientConfig(username, password)) as client:
+            hits = await client.search("Serum Iron")
+            mappings = await client.map_tests([("LIVER FUNCTION TEST", ["SGOT", "SGPT"])])
+
+    Calls run on the blocking LoincClient (cache, rate limiter, retries, circuit
+    breakers) in a dedicated thread pool, so the event loop is never blocked and
+    many lookups proceed concurrently. Each call is bounded by `config.timeout`.
+    Cancelling a call (or hitting the timeout) raises in the caller at once; a
+    request already on the wire finishes in its thread and its result is dropped."""
+
+    def __init__(self, config=None, panel_graph=None):
+        self.config = config or ClientConfig()
+        self.panel_graph = panel_graph
+        self.headers = {"User-Agent": self.config.user_agent, "Accept": "application/json"}
+        self.fhir_headers = {"User-Agent": self.config.user_agent, "Accept": "application/fhir+json"}
+        self.cache = None
+        if self.config.local_index_path:
+            self.client = LocalLoincClient(self.config.local_index_path)
+        else:
+            if self.config.cache_path:
+                self.cache = ResponseCache(self.config.cache_path, offline=self.config.offline)
+            auth = HTTPBasicAuth(self.config.username, self.config.password) if self.config.username else None
+            self.client = LoincClient(auth, cache=self.cache,
+                                      limiter=RateLimiter(self.config.requests_per_second,
+                                                          max_in_flight=self.config.max_in_flight),
+                                      retry_policy=RetryPolicy(self.config.max_attempts),
+                                      breakers=CircuitBreakers(), metrics=self.config.metrics,
+                                      pool_maxsize=max(self.config.concurrency, self.config.max_in_flight))
+        self.resolver = LcnResolver(self.client, self.fhir_headers, fhir_base=self.config.fhir_base_url,
+                                    fallback=self._lcn_by_search, max_workers=1)
+        self._executor = ThreadPoolExecutor(max_workers=self.config.concurrency, thread_name_prefix="loinc-async")
+
+    async def _run(self, func, *args, **kwargs):
+        """Runs a blocking call in the pool, bounded by `config.timeout`."""
+        loop = asyncio.get_running_loop()
+        call = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        return await asyncio.wait_for(call, self.config.timeout)
+
+    # --- Blocking Helpers (run in the pool) ---
+    def _search_blocking(self, term, config):
+        query = config.hit_filter.server_query(term) if config.server_side_filtering else term
+
+        def fetch_page(offset, rows):
+            params = {"query": query}
+            if rows:
+                params.update(rows=rows, offset=offset)
+            data = self.client.get_json(self.config.search_api_url, params, headers=self.headers,
+                                        timeout=self.config.request_timeout,
+                                        is_negative=lambda data: not data.get("Results"))
+            return data.get("Results") or [] # "Results": null means no results
+
+        kept, _, _ = collect_hits(fetch_page, config.hit_filter, top_k=config.top_k,
+                                  page_size=config.page_size, max_pages=config.max_pages)
+        return kept
+
+    def _questionnaire_blocking(self, panel_code):
+        data = self.client.get_json(self.config.questionnaire_url, {"url": f"http://loinc.org/q/{panel_code}"},
+                                    headers=self.fhir_headers, timeout=self.config.request_timeout,
+                                    is_negative=lambda data: not data.get("total"))
+        if not data.get("total") or not data.get("entry"):
+            return None
+        resource = data["entry"][0].get("resource") or {}
+        if resource.get("resourceType") != "Questionnaire":
+            return None
+        return [code for code, _ in questionnaire_leaves(resource.get("item", []))]
+
+    def _lcn_by_search(self, code):
+        data = self.client.get_json(self.config.search_api_url, {"query": code}, headers=self.headers,
+                                    timeout=self.config.request_timeout)
+        for hit in data.get("Results") or []:
+            if hit.get("LOINC_NUM") == code:
+                return hit.get("LONG_COMMON_NAME") or f"{code} (LCN Not Found)"
+        return f"{code} (LCN Not Found)"
+
+    # --- Library API ---
+    async def search(self, term, config=None, parameter_names=()):
+        """Kept Search API hits for `term`, each a copy with "match_rank" (API position) and
+           "match_score" added; best-scoring first when `config.rerank` is set."""
+        config = config or SearchConfig()
+        kept = await self._run(self._search_blocking, term, config)
+        if config.rerank:
+            scored = CandidateScorer(term, parameter_names).rerank(kept)
+        else:
+            scored = [(rank, hit, None) for rank, hit in kept]
+        return [{**hit, "match_rank": rank, "match_score": score} for rank, hit, score in scored]
+
+    async def expand_panel(self, panel_code):
+        """Flattened member codes of a panel, or None if it has no Questionnaire.
+           Panels known to `panel_graph` are answered in-process."""
+        if self.panel_graph is not None:
+            members = self.panel_graph.expand(panel_code)
+            if members is not None:
+                self.resolver.seed({code: name for code, name in members if name})
+                return [code for code, _ in members]
+        return await self._run(self._questionnaire_blocking, panel_code)
+
+    async def lookup_lcn(self, codes):
+        """Long Common Names for `codes`, in order (batched $lookup, memoized across calls)."""
+        return await self._run(self.resolver.resolve, list(codes))
+
+    async def map_test(self, test_name, parameter_names=(), config=None):
+        """Searches one internal test, expands its best candidates and matches their members
+           against `parameter_names`. Returns {"test_name", "search_term", "candidates": [...]}."""
+        config = config or SearchConfig()
+        search_term = test_search_term(test_name)
+        hits = await self.search(search_term, config, parameter_names)
+        expand_count = len(hits) if config.expand_top_n is None else min(config.expand_top_n, len(hits))
+        member_lists = await asyncio.gather(*(self.expand_panel(hit["LOINC_NUM"]) for hit in hits[:expand_count]))
+        expanded = [position for position, members in enumerate(member_lists) if members]
+        name_lists = await asyncio.gather(*(self.lookup_lcn(member_lists[position]) for position in expanded))
+        names_by_position = dict(zip(expanded, name_lists))
+        matcher = ParameterMatcher(parameter_names)
+        candidates = []
+        for position, hit in enumerate(hits):
+            candidate = {"loinc_test_code": hit.get("LOINC_NUM"), "loinc_test_long_name": hit.get("LONG_COMMON_NAME"),
+                         "match_rank": hit["match_rank"], "match_score": hit["match_score"],
+                         "parameter_codes": None, "parameter_names": None, "parameter_coverage": None,
+                         "parameter_matches": None}
+            members = member_lists[position] if position < expand_count else None
+            if members:
+                names = names_by_position[position]
+                panel_match = matcher.match(names)
+                candidate.update(parameter_codes=members, parameter_names=names,
+                                 parameter_coverage=panel_match.coverage,
+                                 parameter_matches=panel_match.matched_codes(members))
+            candidates.append(candidate)
+        return {"test_name": test_name, "search_term": search_term, "candidates": candidates}
+
+    async def map_tests(self, tests, config=None):
+        """Maps many tests concurrently; `tests` holds (test_name, parameter_names) pairs.
+           Results come back in input order; a failed test yields {"test_name", "error"}."""
+        async def map_one(test_name, parameter_names):
+            try:
+                return await self.map_test(test_name, parameter_names, config)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return {"test_name": test_name, "error": f"{type(e).__name__}: {e}"}
+        return await asyncio.gather(*(map_one(name, params) for name, params in tests))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.client.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+        return False
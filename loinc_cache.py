@@ -0,0 +1,178 @@
+import sqlite3
+import hashlib
+import json
+import threading
+import time
+import zlib
+
+from loinc_json import loads
+
+# --- Cache Defaults ---
+DEFAULT_CACHE_PATH = "loinc_cache.sqlite"
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600     # LOINC releases twice a year; a month is safe
+DEFAULT_NEGATIVE_TTL_SECONDS = 7 * 24 * 3600 # "Nothing found" answers; shorter so new content shows up sooner
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024    # Compressed payload budget before LRU eviction
+LOCK_TIMEOUT_SECONDS = 30.0              # Wait this long for another process's write (sharded runs share one cache)
+
+
+class OfflineCacheMiss(Exception):
+    """Raised when offline mode is on and a request is not in the cache."""
+
+
+def normalize_params(params):
+    """Returns a stable JSON string for query params (sorted keys, collapsed whitespace)."""
+    normalized = {}
+    for key, value in (params or {}).items():
+        if isinstance(value, str):
+            value = " ".join(value.split())
+        normalized[str(key)] = value
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+
+def make_cache_key(endpoint, params):
+    """Content-addressed key: sha256 of endpoint + normalized params."""
+    raw = f"{endpoint}\n{normalize_params(params)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Persistent SQLite cache of decoded JSON API responses.
+
+    Entries expire after `ttl_seconds`; negative answers (empty search results,
+    "no Questionnaire" bundles) stored with `negative=True` expire after
+    `negative_ttl_seconds` instead. Once the stored (compressed) payloads exceed
+    `max_bytes` the least recently used entries are evicted. With `offline=True`
+    callers must not touch the network (see `LoincClient.get_json`)."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_bytes=DEFAULT_MAX_BYTES, offline=False, negative_ttl_seconds=DEFAULT_NEGATIVE_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stores = 0
+        self.negative_stores = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT_SECONDS, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                   key TEXT PRIMARY KEY,
+                   endpoint TEXT NOT NULL,
+                   params TEXT NOT NULL,
+                   body BLOB NOT NULL,
+                   size INTEGER NOT NULL,
+                   created_at REAL NOT NULL,
+                   expires_at REAL NOT NULL,
+                   accessed_at REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+        self._conn.commit()
+
+    def get(self, endpoint, params, decode=None):
+        """Returns the cached JSON data for a request, or None on a miss/expired entry.
+           `decode` turns the stored body (bytes) into data; default `loinc_json.loads`."""
+        key = make_cache_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            body, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return (decode or loads)(zlib.decompress(body))
+
+    def set(self, endpoint, params, data, ttl_seconds=None, negative=False):
+        """Stores JSON data for a request, then evicts LRU entries if over budget.
+           `data` may also be the response body as received (bytes), stored without re-encoding.
+           `negative` marks a "nothing found" answer, kept for `negative_ttl_seconds`."""
+        key = make_cache_key(endpoint, params)
+        raw = data if isinstance(data, bytes) else json.dumps(data, ensure_ascii=False).encode("utf-8")
+        body = zlib.compress(raw)
+        now = time.time()
+        if ttl_seconds is not None:
+            ttl = ttl_seconds
+        else:
+            ttl = self.negative_ttl_seconds if negative else self.ttl_seconds
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, normalize_params(params), body, len(body), now, now + ttl, now)
+            )
+            self.stores += 1
+            if negative:
+                self.negative_stores += 1
+            self._evict_over_budget()
+            self._conn.commit()
+
+    def _evict_over_budget(self):
+        """Drops expired entries, then least recently used ones until under max_bytes."""
+        cur = self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        self.evictions += max(cur.rowcount, 0)
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def entries(self, endpoint):
+        """Yields (params, data) for every unexpired entry of `endpoint`. Not counted as hits."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT params, body FROM responses WHERE endpoint = ? AND expires_at > ?", (endpoint, time.time())
+            ).fetchall()
+        for params, body in rows:
+            yield json.loads(params), loads(zlib.decompress(body))
+
+    def clear(self):
+        """Removes every cached entry."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self):
+        """Returns hit/miss/evict counters plus current entry count and size."""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "stores": self.stores, "negative_stores": self.negative_stores, "entries": entries, "bytes": size,
+        }
+
+    def summary(self):
+        s = self.stats()
+        total = s["hits"] + s["misses"]
+        hit_rate = (s["hits"] / total * 100) if total else 0.0
+        return (f"Cache: {s['hits']} hits, {s['misses']} misses ({hit_rate:.1f}% hit rate), "
+                f"{s['evictions']} evicted, {s['negative_stores']} negative stored, "
+                f"{s['entries']} entries ({s['bytes'] / 1024:.0f} KB)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class CheckpointJournal:
+    """Append-only JSONL journal of finished work units (one search term or test per line).
+
+    Each `record` is flushed and fsynced before returning, so a crash or Ctrl-C
+    loses at most the unit in progress. `load` returns the latest payload per key
+    and ignores a truncated final line. Only units from the resumed run are kept
+    in memory (`completed`); newly recorded payloads go straight to disk."""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = self.load() if resume else {}
+        mode = "a" if resume else "w" # A fresh run starts a new journal
+        self._file = open(path, mode, encoding="utf-8")
+
+    def load(self):
+        completed = {}
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # Partially written line from an interrupted run
+                completed[entry["key"]] = entry["payload"]
+        return completed
+
+    def is_done(self, key):
+        return key in self.completed
+
+    def get(self, key):
+        return self.completed.get(key)
+
+    def record(self, key, payload):
+        line = json.dumps({"key": key, "ts": time.time(), "payload": payload}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def fingerprint(*parts):
+    """Stable sha256 over JSON-serializable parts (e.g. test name, alias, sorted parameters)."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class RunManifest:
+    """Cross-run record of the fingerprint and output rows produced for each input unit.
+
+    A `--delta` run looks each unit up by key and fingerprint: unchanged units reuse
+    their stored rows, new or changed ones are fetched and then `update`d. Entries
+    live in SQLite rather than memory, so large catalogs keep a flat footprint.
+    `save` commits and keeps only the units passed as `keep_keys`, so the manifest
+    always mirrors the latest outputs."""
+
+    def __init__(self, path):
+        self.path = path
+        self.reused = 0
+        self.refreshed = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS manifest (
+                   key TEXT PRIMARY KEY,
+                   fingerprint TEXT NOT NULL,
+                   rows TEXT NOT NULL,
+                   updated_at REAL NOT NULL
+               )"""
+        )
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM manifest").fetchone()[0]
+
+    def lookup(self, key, unit_fingerprint):
+        """Returns the stored rows if the unit is unchanged since the last run, else None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT rows FROM manifest WHERE key = ? AND fingerprint = ?", (key, unit_fingerprint)
+            ).fetchone()
+            if row is None:
+                return None
+            self.reused += 1
+        return json.loads(row[0])
+
+    def update(self, key, unit_fingerprint, rows):
+        payload = json.dumps(rows, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?)",
+                               (key, unit_fingerprint, payload, time.time()))
+            self.refreshed += 1
+
+    def save(self, keep_keys=None):
+        with self._lock:
+            if keep_keys is not None:
+                self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_keys (key TEXT PRIMARY KEY)")
+                self._conn.execute("DELETE FROM keep_keys")
+                self._conn.executemany("INSERT OR IGNORE INTO keep_keys VALUES (?)", ((str(k),) for k in keep_keys))
+                self._conn.execute("DELETE FROM manifest WHERE key NOT IN (SELECT key FROM keep_keys)")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def summary(self):
+        return f"Delta manifest: {self.reused} unchanged (reused), {self.refreshed} new/changed (fetched)"
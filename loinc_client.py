@@ -0,0 +1,209 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from loinc_cache import OfflineCacheMiss, normalize_params
+from loinc_json import loads
+from loinc_retry import THROTTLE_STATUSES, parse_retry_after
+from loinc_metrics import endpoint_label
+
+# --- Client Defaults ---
+DEFAULT_POOL_CONNECTIONS = 4      # Number of per-host pools kept (search API + FHIR server)
+DEFAULT_POOL_MAXSIZE = 16         # Keep-alive connections per host; should be >= max in-flight
+DEFAULT_TRANSPORT_RETRIES = 3     # Failed connection attempts retried by urllib3
+DEFAULT_BACKOFF_FACTOR = 0.5
+
+
+def build_session(auth=None, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                  transport_retries=DEFAULT_TRANSPORT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+    """Creates a requests.Session with keep-alive connection pools.
+
+    urllib3 only retries failures to connect (nothing was sent yet); status codes
+    and read errors are left to the client's RetryPolicy."""
+    retry = Retry(
+        total=transport_retries,
+        connect=transport_retries,
+        read=0,
+        status=0,
+        other=0,
+        allowed_methods=frozenset(["GET", "POST"]),
+        backoff_factor=backoff_factor,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.auth = auth
+    return session
+
+
+class LoincClient:
+    """Shared HTTP client for the LOINC Search API and the LOINC FHIR server.
+
+    Holds one pooled Session (so connections and TLS sessions are reused across
+    calls and threads), plus the optional ResponseCache and RateLimiter that every
+    request goes through. With a RetryPolicy, failed requests (connection/read
+    errors, 429, 5xx) are retried here, honoring Retry-After; per-host
+    CircuitBreakers fail fast while a server keeps failing, and an
+    AimdRateController raises or lowers the limiter's rate from the outcomes.
+    With a MetricsRegistry, every attempt's latency, status and bytes, retries and
+    cache hits/misses are recorded per endpoint."""
+
+    def __init__(self, auth=None, cache=None, limiter=None, session=None, retry_policy=None,
+                 breakers=None, rate_controller=None, metrics=None, **session_options):
+        self.auth = auth
+        self.cache = cache
+        self.limiter = limiter
+        self.retry_policy = retry_policy
+        self.breakers = breakers
+        self.rate_controller = rate_controller
+        self.metrics = metrics
+        self.session = session if session is not None else build_session(auth, **session_options)
+        # Counters for `summary`
+        self.requests_sent = 0
+        self.retries = 0
+        self.throttled = 0
+        self._counter_lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _send_once(self, method, url, **kwargs):
+        if self.limiter is not None:
+            with self.limiter:
+                return self._send(method, url, **kwargs)
+        return self._send(method, url, **kwargs)
+
+    def _send(self, method, url, **kwargs):
+        """One HTTP exchange, recorded in `metrics` when set (limiter wait not included)."""
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
+        endpoint = endpoint_label(url)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            elapsed = time.perf_counter() - start
+            self.metrics.observe("loinc_http_request_seconds", elapsed, endpoint=endpoint, method=method)
+            self.metrics.inc("loinc_http_requests_total", endpoint=endpoint, method=method, status=type(e).__name__)
+            self.metrics.event("http_request", endpoint=endpoint, method=method, status=type(e).__name__,
+                               seconds=round(elapsed, 4), error=str(e))
+            raise
+        elapsed = time.perf_counter() - start
+        response_bytes = len(response.content)
+        request_bytes = len(response.request.body or b"")
+        self.metrics.observe("loinc_http_request_seconds", elapsed, endpoint=endpoint, method=method)
+        self.metrics.inc("loinc_http_requests_total", endpoint=endpoint, method=method, status=response.status_code)
+        self.metrics.inc("loinc_http_response_bytes_total", response_bytes, endpoint=endpoint)
+        if request_bytes:
+            self.metrics.inc("loinc_http_request_bytes_total", request_bytes, endpoint=endpoint)
+        self.metrics.event("http_request", endpoint=endpoint, method=method, status=response.status_code,
+                           seconds=round(elapsed, 4), response_bytes=response_bytes, request_bytes=request_bytes)
+        return response
+
+    def _request(self, method, url, **kwargs):
+        """Sends one request through the breaker, limiter and retry policy.
+           Returns a successful response or raises the last error."""
+        max_attempts = self.retry_policy.max_attempts if self.retry_policy is not None else 1
+        host, breaker = self.breakers.for_url(url) if self.breakers is not None else ("", None)
+        for attempt in range(max_attempts):
+            if breaker is not None:
+                breaker.before_request(host)
+            retry_after = None
+            settled = False # Whether the breaker has been told how this attempt went
+            try:
+                self._count("requests_sent")
+                response = self._send_once(method, url, **kwargs)
+                status_code = response.status_code
+                if status_code in THROTTLE_STATUSES:
+                    self._count("throttled")
+                    if self.rate_controller is not None:
+                        self.rate_controller.on_throttle()
+                if status_code < 400:
+                    if breaker is not None:
+                        breaker.record_success()
+                        settled = True
+                    if self.rate_controller is not None:
+                        self.rate_controller.on_success()
+                    return response
+                retryable = self.retry_policy is not None and self.retry_policy.is_retryable_status(status_code)
+                if breaker is not None and status_code >= 500:
+                    breaker.record_failure() # 429 only means "slow down" and 4xx says nothing about host health
+                    settled = True
+                if not retryable or attempt + 1 >= max_attempts:
+                    response.raise_for_status()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
+                if breaker is not None:
+                    breaker.record_failure()
+                    settled = True
+                if attempt + 1 >= max_attempts:
+                    raise
+            finally:
+                if breaker is not None and not settled:
+                    breaker.record_neutral() # 429/4xx or an unexpected error: never leave a trial hanging
+            self._count("retries")
+            if self.metrics is not None:
+                self.metrics.inc("loinc_http_retries_total", endpoint=endpoint_label(url))
+            time.sleep(self.retry_policy.delay(attempt, retry_after))
+
+    def get_json(self, url, params, headers=None, timeout=45, is_negative=None, decode=None):
+        """GETs `url` and returns decoded JSON, going through the cache when one is set.
+
+        Network requests (not cache hits) wait on the rate limiter. Raises requests
+        exceptions on failure (failed responses are never cached), and OfflineCacheMiss
+        when the cache is in offline mode and holds no entry for the request.
+        `is_negative(data)` flags "nothing found" answers, which the cache keeps for
+        its shorter negative TTL. `decode` turns a body (bytes) into data, for fresh and
+        cached responses alike (default `loinc_json.loads`); the cache stores the body as received."""
+        decode = decode or loads
+        if self.cache is not None:
+            data = self.cache.get(url, params, decode=decode)
+            if self.metrics is not None:
+                self.metrics.inc("loinc_cache_lookups_total", endpoint=endpoint_label(url),
+                                 result="miss" if data is None else "hit")
+            if data is not None:
+                return data
+            if self.cache.offline:
+                raise OfflineCacheMiss(f"Not in cache (offline mode): {url} {normalize_params(params)}")
+
+        response = self._request("GET", url, params=params, headers=headers, timeout=timeout)
+        data = decode(response.content)
+
+        if self.cache is not None:
+            self.cache.set(url, params, response.content, negative=bool(is_negative and is_negative(data)))
+        return data
+
+    def post_json(self, url, payload, headers=None, timeout=60):
+        """POSTs a JSON payload (e.g. a FHIR batch Bundle) and returns decoded JSON.
+
+        POSTs are never served from the cache; in offline mode they raise OfflineCacheMiss."""
+        if self.cache is not None and self.cache.offline:
+            raise OfflineCacheMiss(f"POST not possible in offline mode: {url}")
+        response = self._request("POST", url, json=payload, headers=headers, timeout=timeout)
+        return loads(response.content)
+
+    def summary(self):
+        line = f"HTTP: {self.requests_sent} requests sent, {self.retries} retries, {self.throttled} throttled (429/503)"
+        if self.breakers is not None:
+            line += f", circuit opened {self.breakers.times_opened()} times"
+        if self.rate_controller is not None and self.limiter is not None:
+            line += (f", rate now {self.limiter.rate:.1f} rps (peak {self.rate_controller.peak_rate:.1f}, "
+                     f"{self.rate_controller.decreases} back-offs)")
+        return line
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
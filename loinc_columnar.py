@@ -0,0 +1,253 @@
+import argparse
+import csv
+import os
+import re
+import sys
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from loinc_records import HitBatch
+
+# --- Columnar Layout ---
+ROW_GROUP_ROWS = 50000 # Rows buffered before a Parquet row group is written
+METADATA_COLUMNS_KEY = b"loinc_columns" # Original column order, including the dropped URL columns
+
+# Low-cardinality columns repeated on every hit -> dictionary-encoded strings
+CATEGORICAL_COLUMNS = {
+    "search_term", "status", "class", "system", "scale_type", "property", "time_aspect", "method_type",
+    "example_units", "component",
+    "loinc_test_status", "loinc_test_class", "loinc_test_system", "loinc_test_scale", "loinc_test_property",
+    "loinc_test_time", "loinc_test_method", "loinc_test_component", "test_id", "test_name",
+}
+INTEGER_COLUMNS = {"match_rank": "int32", "class_type": "int8", "loinc_test_class_type": "int8"}
+FLOAT_COLUMNS = {"match_score": "float32", "parameter_coverage": "float32"}
+# Newline-joined multi-value cells in the CSV/Excel outputs -> list<string>
+LIST_COLUMNS = {"loinc_parameter_codes", "loinc_parameter_names", "parameter_matches"}
+# URL columns are never stored: they are derived from the code column on read
+DERIVED_URL_COLUMNS = {"loinc_url": ("loinc", "status"), "loinc_test_url": ("loinc_test_code", "loinc_test_status")}
+
+LOINC_CODE_PATTERN = re.compile(r"^\d{1,7}-\d$")
+
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise ImportError("Parquet/Arrow support requires pyarrow (pip install pyarrow)")
+
+
+def loinc_url(code, status=None):
+    """Rebuilds the loinc.org URL the fetch scripts write for a result row."""
+    if isinstance(code, str) and LOINC_CODE_PATTERN.match(code):
+        return f"https://loinc.org/{code}"
+    return "Error" if status == "Error" else "N/A"
+
+
+def arrow_type(column):
+    require_pyarrow()
+    if column in INTEGER_COLUMNS:
+        return getattr(pyarrow, INTEGER_COLUMNS[column])()
+    if column in FLOAT_COLUMNS:
+        return getattr(pyarrow, FLOAT_COLUMNS[column])()
+    if column in LIST_COLUMNS:
+        return pyarrow.list_(pyarrow.string())
+    if column in CATEGORICAL_COLUMNS:
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.string()
+
+
+def arrow_schema(columns):
+    """Arrow schema for a result table with `columns` (e.g. fetch_loinc's `fieldnames` or
+       loinc_aggreg's SHEET_COLUMNS). Derived URL columns are left out of the stored schema
+       but kept in the metadata so readers restore the original column order."""
+    require_pyarrow()
+    stored = [(col, arrow_type(col)) for col in columns if col not in DERIVED_URL_COLUMNS]
+    return pyarrow.schema(stored, metadata={METADATA_COLUMNS_KEY: "\x1f".join(columns).encode("utf-8")})
+
+
+def _to_int(value):
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None # Sentinels such as "N/A"/"Error" become nulls in typed columns
+
+
+def _to_float(value):
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_list(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return str(value).split("\n")
+
+
+def _to_str(value):
+    return None if value is None else str(value)
+
+
+def _converter(column):
+    if column in INTEGER_COLUMNS:
+        return _to_int
+    if column in FLOAT_COLUMNS:
+        return _to_float
+    if column in LIST_COLUMNS:
+        return _to_list
+    return _to_str
+
+
+class ParquetRowWriter:
+    """Streams result dicts into a Parquet file, mirroring StreamingCsvWriter's interface.
+
+    Rows are buffered and written in row groups of `row_group_rows`; `flush` only
+    writes once a full group is buffered so per-term flushes don't fragment the file.
+    A HitBatch is appended column by column."""
+
+    def __init__(self, filename, fieldnames, row_group_rows=ROW_GROUP_ROWS):
+        require_pyarrow()
+        self.filename = filename
+        self.rows_written = 0
+        self.schema = arrow_schema(fieldnames)
+        self.row_group_rows = row_group_rows
+        self._columns = [(field.name, _converter(field.name)) for field in self.schema]
+        self._buffer = {name: [] for name, _ in self._columns}
+        self._buffered = 0
+        self._writer = pyarrow.parquet.ParquetWriter(filename, self.schema, compression="zstd")
+
+    def write_rows(self, rows):
+        buffer = self._buffer
+        if isinstance(rows, HitBatch): # Append whole columns, no row dicts
+            for name, convert in self._columns:
+                buffer[name].extend(map(convert, rows.column(name)))
+            self._buffered += len(rows)
+            self.rows_written += len(rows)
+        else:
+            for row in rows:
+                for name, convert in self._columns:
+                    buffer[name].append(convert(row.get(name)))
+                self._buffered += 1
+                self.rows_written += 1
+        if self._buffered >= self.row_group_rows:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        if not self._buffered:
+            return
+        arrays = [pyarrow.array(self._buffer[field.name], type=field.type) for field in self.schema]
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+        for values in self._buffer.values():
+            values.clear()
+        self._buffered = 0
+
+    def flush(self):
+        if self._buffered >= self.row_group_rows:
+            self._write_buffer()
+
+    def close(self):
+        self._write_buffer()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+# --- Readers ---
+def read_table(path, columns=None):
+    """Reads a result file written by ParquetRowWriter as an Arrow table (stored columns only)."""
+    require_pyarrow()
+    return pyarrow.parquet.read_table(path, columns=columns)
+
+
+def _original_columns(schema):
+    metadata = schema.metadata or {}
+    if METADATA_COLUMNS_KEY in metadata:
+        return metadata[METADATA_COLUMNS_KEY].decode("utf-8").split("\x1f")
+    return schema.names
+
+
+def read_dataframe(path):
+    """Loads a Parquet result file into pandas with categorical columns kept as
+       `category` dtype and the URL columns re-derived, in the original column order."""
+    table = read_table(path)
+    df = table.to_pandas()
+    for column in _original_columns(table.schema):
+        if column in DERIVED_URL_COLUMNS and column not in df.columns:
+            code_col, status_col = DERIVED_URL_COLUMNS[column]
+            statuses = df[status_col] if status_col in df.columns else [None] * len(df)
+            df[column] = [loinc_url(code, status) for code, status in zip(df[code_col], statuses)]
+    return df[[c for c in _original_columns(table.schema) if c in df.columns]]
+
+
+def iter_rows(path, batch_size=ROW_GROUP_ROWS):
+    """Yields result dicts shaped like the CSV/Excel rows (URLs restored, list cells
+       newline-joined), one record batch at a time."""
+    require_pyarrow()
+    parquet_file = pyarrow.parquet.ParquetFile(path)
+    columns = _original_columns(parquet_file.schema_arrow)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        for row in batch.to_pylist():
+            for column in LIST_COLUMNS.intersection(row):
+                if row[column] is not None:
+                    row[column] = "\n".join(row[column])
+            for column, (code_col, status_col) in DERIVED_URL_COLUMNS.items():
+                if column in columns:
+                    row[column] = loinc_url(row.get(code_col), row.get(status_col))
+            yield {c: row.get(c) for c in columns}
+
+
+def read_input_frame(path, **csv_kwargs):
+    """Reads a tabular input for the scripts: .parquet via pyarrow, anything else as CSV."""
+    if path.endswith(".parquet"):
+        return read_dataframe(path)
+    import pandas as pd
+    return pd.read_csv(path, **csv_kwargs)
+
+
+# --- CSV <-> Parquet Conversion ---
+def convert_file(source, target):
+    """Converts a result file between CSV and Parquet based on the extensions.
+       Returns the number of rows converted."""
+    from loinc_export import StreamingCsvWriter, open_text_input
+
+    if source.endswith(".parquet"):
+        columns = _original_columns(pyarrow.parquet.ParquetFile(source).schema_arrow)
+        rows = iter_rows(source)
+    else:
+        csv_file = open_text_input(source)
+        reader = csv.DictReader(csv_file)
+        columns = reader.fieldnames
+        rows = reader
+    writer_cls = ParquetRowWriter if target.endswith(".parquet") else StreamingCsvWriter
+    with writer_cls(target, columns) as writer:
+        writer.write_rows(rows)
+    return writer.rows_written
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert LOINC result files between CSV and Parquet.")
+    parser.add_argument("source", help="Input .csv/.csv.gz or .parquet file")
+    parser.add_argument("target", help="Output .parquet or .csv/.csv.gz file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print(f"ERROR: Input file not found: {args.source}")
+        sys.exit(1)
+    row_count = convert_file(args.source, args.target)
+    print(f"Converted {row_count} rows: {args.source} -> {args.target} "
+          f"({os.path.getsize(args.source) / 1024:.0f} KB -> {os.path.getsize(args.target) / 1024:.0f} KB)")
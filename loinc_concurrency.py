@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Concurrency Defaults ---
+DEFAULT_REQUESTS_PER_SECOND = 8.0
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_MAX_WORKERS = 8
+
+
+class RateLimiter:
+    """Token-bucket limiter shared by every API call, with a cap on in-flight requests.
+
+    Use as a context manager around a single request:
+
+        with limiter:
+            response = requests.get(...)
+
+    `requests_per_second` is the sustained budget, `burst` how many tokens may be
+    spent back-to-back, and `max_in_flight` how many requests may be open at once."""
+
+    def __init__(self, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, burst=None,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second must be positive")
+        self.rate = float(requests_per_second)
+        self.burst = burst
+        self.capacity = float(burst if burst is not None else max(1.0, requests_per_second))
+        self.max_in_flight = max_in_flight
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._last_refill = now
+
+    def set_rate(self, requests_per_second):
+        """Changes the sustained rate for subsequent requests (and the burst size, unless fixed)."""
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second must be positive")
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(requests_per_second)
+            if self.burst is None:
+                self.capacity = max(1.0, self.rate)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def acquire_token(self):
+        """Blocks until one token is available and consumes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def __enter__(self):
+        self._in_flight.acquire()
+        try:
+            self.acquire_token()
+        except BaseException:
+            self._in_flight.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._in_flight.release()
+        return False
+
+
+# --- Helper Function to Run Work Concurrently in Input Order ---
+def run_ordered(func, items, max_workers=DEFAULT_MAX_WORKERS, executor=None):
+    """Applies `func` to every item on a thread pool and returns results in input order.
+
+    Pass an existing `executor` to share a pool; otherwise a pool of `max_workers`
+    threads is created for this call. With max_workers <= 1 the work runs serially."""
+    items = list(items)
+    if executor is not None:
+        return list(executor.map(func, items))
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(func, items))
+
+
+# --- Helper Function to Stream Concurrent Results in Input Order ---
+def imap_ordered(func, items, max_workers=DEFAULT_MAX_WORKERS, window=None):
+    """Like `run_ordered`, but yields results one at a time as soon as they are ready in order.
+
+    At most `window` items (default 2 x max_workers) are submitted ahead of the
+    consumer, so memory stays bounded however many items there are."""
+    if max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    window = window or max_workers * 2
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
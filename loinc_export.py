@@ -0,0 +1,223 @@
+import csv
+import gzip
+import os
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+from loinc_columnar import ParquetRowWriter, require_pyarrow
+from loinc_records import HitBatch
+
+
+def open_text_output(filename):
+    """Opens `filename` for CSV writing; names ending in .gz are gzip-compressed."""
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "wt", newline="", encoding="utf-8")
+    return open(filename, "w", newline="", encoding="utf-8")
+
+
+def open_text_input(filename):
+    """Opens a CSV written by `open_text_output` (plain or .gz) for reading."""
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt", newline="", encoding="utf-8")
+    return open(filename, newline="", encoding="utf-8")
+
+
+class StreamingCsvWriter:
+    """Writes result dicts to CSV as they arrive instead of buffering a whole run.
+
+    Call `flush` at natural boundaries (e.g. after each search term) so other tools
+    can tail the file while a run is in progress; for .gz outputs each flush is a
+    gzip sync point, so the data written so far can already be decompressed.
+    A HitBatch is written straight from its columns, without building row dicts."""
+
+    def __init__(self, filename, fieldnames):
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.rows_written = 0
+        self._file = open_text_output(filename)
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames, extrasaction='ignore')
+        self._value_writer = csv.writer(self._file)
+        self._writer.writeheader()
+        self._file.flush()
+
+    def write_rows(self, rows):
+        if isinstance(rows, HitBatch):
+            self._value_writer.writerows(rows.value_rows(self.fieldnames))
+            self.rows_written += len(rows)
+            return
+        for row in rows:
+            self._writer.writerow(row)
+            self.rows_written += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def open_row_writer(filename, fieldnames):
+    """Streaming result writer picked by extension: Parquet for .parquet, CSV (optionally .gz) otherwise."""
+    if filename.endswith(".parquet"):
+        return ParquetRowWriter(filename, fieldnames)
+    return StreamingCsvWriter(filename, fieldnames)
+
+
+# --- Mapping Workbook / Table Exporters ---
+MAX_COLUMN_WIDTH = 80
+
+
+def cell_text_width(value):
+    """Display width of a cell: the longest line, since multiline cells wrap on newlines."""
+    if value is None:
+        return 0
+    text = value if isinstance(value, str) else str(value)
+    if "\n" not in text:
+        return len(text)
+    return max(len(line) for line in text.split("\n"))
+
+
+class ColumnWidthTracker:
+    """Tracks per-column widths incrementally as rows are appended."""
+
+    def __init__(self, columns):
+        self.widths = [len(col) for col in columns]
+
+    def update(self, values):
+        widths = self.widths
+        for j, value in enumerate(values):
+            width = cell_text_width(value)
+            if width > widths[j]:
+                widths[j] = width
+        return values
+
+    def final_widths(self):
+        return [min(width + 2, MAX_COLUMN_WIDTH) for width in self.widths]
+
+
+def _row_values(row, columns, default):
+    return [row.get(col, default) for col in columns]
+
+
+def _unique_sheet_name(name, used_names):
+    """Keeps sheet names unique (case-insensitively, as Excel requires) within 31 chars."""
+    candidate = name[:31] or "Sheet"
+    suffix = 2
+    while candidate.lower() in used_names:
+        tail = f"~{suffix}"
+        candidate = name[:31 - len(tail)] + tail
+        suffix += 1
+    used_names.add(candidate.lower())
+    return candidate
+
+
+class WorkbookExporter:
+    """Write-only Excel exporter with constant memory per sheet.
+
+    Uses xlsxwriter in `constant_memory` mode when installed (rows are streamed to
+    temp files), otherwise openpyxl's write-only workbook. Column widths are tracked
+    while rows are appended rather than recomputed over DataFrame columns."""
+
+    def __init__(self, path):
+        self.path = path
+        self._used_names = set()
+        if xlsxwriter is not None:
+            self.engine = "xlsxwriter"
+            self._workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "strings_to_urls": False})
+        else:
+            import openpyxl
+            self.engine = "openpyxl"
+            self._workbook = openpyxl.Workbook(write_only=True)
+
+    def write_sheet(self, sheet_name, columns, rows, default="N/A"):
+        """Writes one sheet (header + rows of dicts, missing keys filled with `default`).
+           Returns the name actually used for the sheet."""
+        sheet_name = _unique_sheet_name(sheet_name, self._used_names)
+        tracker = ColumnWidthTracker(columns)
+        if self.engine == "xlsxwriter":
+            worksheet = self._workbook.add_worksheet(sheet_name)
+            worksheet.write_row(0, 0, columns)
+            for i, row in enumerate(rows, start=1):
+                worksheet.write_row(i, 0, tracker.update(_row_values(row, columns, default)))
+            for j, width in enumerate(tracker.final_widths()):
+                worksheet.set_column(j, j, width)
+        else:
+            # openpyxl write-only sheets need widths before the first row, so the (small)
+            # per-test row set is materialized once as value lists
+            from openpyxl.utils import get_column_letter
+            worksheet = self._workbook.create_sheet(sheet_name)
+            values = [tracker.update(_row_values(row, columns, default)) for row in rows]
+            for j, width in enumerate(tracker.final_widths(), start=1):
+                worksheet.column_dimensions[get_column_letter(j)].width = width
+            worksheet.append(columns)
+            for row_values in values:
+                worksheet.append(row_values)
+        return sheet_name
+
+    def write_summary(self, columns, rows):
+        return self.write_sheet("Test Summary", columns, rows, default="")
+
+    def write_test_sheet(self, sheet_name, columns, rows, test_id=None, test_name=None):
+        return self.write_sheet(sheet_name, columns, rows)
+
+    def close(self):
+        if self.engine == "xlsxwriter":
+            self._workbook.close()
+        else:
+            self._workbook.save(self.path)
+
+
+class TabularExporter:
+    """Machine-friendly alternative to the workbook: one long table of all test sheets
+    (prefixed with test_id/test_name) plus a separate summary table, as CSV or Parquet."""
+
+    def __init__(self, path, fmt="csv"):
+        if fmt == "parquet":
+            require_pyarrow()
+        self.path = path
+        self.fmt = fmt
+        stem, ext = os.path.splitext(path)
+        self.summary_path = f"{stem}_summary{ext}"
+        self._results = None
+
+    def _write_table(self, path, columns, rows, writer=None):
+        if writer is None:
+            # Parquet files use the typed/dictionary-encoded layout from loinc_columnar
+            writer = (ParquetRowWriter if self.fmt == "parquet" else StreamingCsvWriter)(path, columns)
+        writer.write_rows(rows)
+        writer.flush()
+        return writer
+
+    def write_summary(self, columns, rows):
+        self._write_table(self.summary_path, columns, rows).close()
+        return self.summary_path
+
+    def write_test_sheet(self, sheet_name, columns, rows, test_id=None, test_name=None):
+        rows = [{"test_id": test_id, "test_name": test_name, **{col: row.get(col, "N/A") for col in columns}}
+                for row in rows]
+        columns = ["test_id", "test_name"] + list(columns)
+        self._results = self._write_table(self.path, columns, rows, writer=self._results)
+        return sheet_name
+
+    def close(self):
+        if self._results is not None:
+            self._results.close()
+
+
+def open_mapping_exporter(path, fmt="xlsx"):
+    """Returns the exporter for `fmt`: 'xlsx' (WorkbookExporter), 'csv' or 'parquet' (TabularExporter)."""
+    if fmt == "xlsx":
+        return WorkbookExporter(path)
+    if fmt in ("csv", "parquet"):
+        return TabularExporter(path, fmt)
+    raise ValueError(f"Unknown output format: {fmt}")
@@ -0,0 +1,129 @@
+from collections import Counter
+
+# --- Search API Field Names ---
+# Raw hit keys the FILTER_ON_* rules test; the same names are used for field-qualified
+# query clauses ("STATUS:ACTIVE") when the filter is pushed to the server.
+STATUS_FIELD = "STATUS"
+CLASSTYPE_FIELD = "CLASSTYPE"
+SCALE_FIELD = "SCALE_TYP"
+
+# --- Paging Defaults ---
+DEFAULT_MAX_PAGES = 10 # Hard stop for paged searches, whatever the top-K
+
+
+class HitFilter:
+    """Compiled form of the scripts' FILTER_ON_* settings, applied to raw Search API hits.
+
+    The enabled rules are turned into a short list of checks once, so each hit is
+    tested with a few key lookups before any result row is built for it. Rules
+    set to None are off. `query_clauses` gives the same rules as field-qualified
+    search syntax for pushing them to the server."""
+
+    def __init__(self, status_keep=None, classtype_keep=None, scale_exclude=None):
+        self.status_keep = status_keep
+        self.classtype_keep = classtype_keep
+        self.scale_exclude = scale_exclude
+        # (outcome label, hit key, drop test), in the scripts' original order
+        self._checks = []
+        if status_keep is not None:
+            self._checks.append(("filtered_status", STATUS_FIELD, lambda value: value != status_keep))
+        if classtype_keep is not None:
+            self._checks.append(("filtered_class_type", CLASSTYPE_FIELD, lambda value: value != classtype_keep))
+        if scale_exclude is not None:
+            self._checks.append(("filtered_scale", SCALE_FIELD, lambda value: value == scale_exclude))
+
+    @classmethod
+    def from_settings(cls, enabled, on_status, status_keep, on_classtype, classtype_keep, on_scale, scale_exclude):
+        """Builds the filter from a script's ENABLE_PRE_FILTERING / FILTER_ON_* constants."""
+        if not enabled:
+            return cls()
+        return cls(status_keep if on_status else None, classtype_keep if on_classtype else None,
+                   scale_exclude if on_scale else None)
+
+    @property
+    def active(self):
+        return bool(self._checks)
+
+    def drop_reason(self, hit):
+        """Outcome label of the first rule that drops `hit`, or None if it is kept."""
+        for outcome, key, drops in self._checks:
+            if drops(hit.get(key, "N/A")):
+                return outcome
+        return None
+
+    def split(self, hits):
+        """Filters a batch of hits in one pass.
+
+        Returns ([(rank, hit), ...] for the kept hits, with rank the 1-based position in
+        `hits`), plus a Counter of outcomes ("kept" and one label per dropping rule)."""
+        if not self._checks:
+            return list(enumerate(hits, start=1)), Counter(kept=len(hits))
+        kept = []
+        outcomes = Counter()
+        drop_reason = self.drop_reason
+        for rank, hit in enumerate(hits, start=1):
+            outcome = drop_reason(hit)
+            if outcome is None:
+                kept.append((rank, hit))
+                outcome = "kept"
+            outcomes[outcome] += 1
+        return kept, outcomes
+
+    def query_clauses(self):
+        """The enabled rules as field-qualified search clauses, e.g. "STATUS:ACTIVE NOT SCALE_TYP:Doc"."""
+        clauses = []
+        if self.status_keep is not None:
+            clauses.append(f"{STATUS_FIELD}:{self.status_keep}")
+        if self.classtype_keep is not None:
+            clauses.append(f"{CLASSTYPE_FIELD}:{self.classtype_keep}")
+        if self.scale_exclude is not None:
+            clauses.append(f"NOT {SCALE_FIELD}:{self.scale_exclude}")
+        return " ".join(clauses)
+
+    def server_query(self, term):
+        """`term` with the filter clauses appended, for APIs that filter on the server."""
+        clauses = self.query_clauses()
+        return f"{term} {clauses}" if clauses else term
+
+    def describe(self):
+        parts = []
+        if self.status_keep is not None:
+            parts.append(f"STATUS='{self.status_keep}'")
+        if self.classtype_keep is not None:
+            parts.append(f"CLASSTYPE={self.classtype_keep}")
+        if self.scale_exclude is not None:
+            parts.append(f"SCALE_TYP!='{self.scale_exclude}'")
+        return " AND ".join(parts)
+
+
+def collect_hits(fetch_page, hit_filter, top_k=None, page_size=None, max_pages=DEFAULT_MAX_PAGES):
+    """Collects up to `top_k` filtered hits for one search, paging only as far as needed.
+
+    `fetch_page(offset, rows)` returns one page of raw hits; without a `page_size`
+    it is called once with (None, None) for the API's default result set. With a
+    `page_size`, pages are requested until `top_k` hits have been kept, a page
+    that is not exactly `page_size` long shows the results are exhausted (or that
+    the server ignored `rows`), or `max_pages` is reached.
+
+    Returns (kept [(rank, hit), ...], outcome Counter, raw hits seen). Ranks are
+    positions in the full result list. Kept hits past `top_k` are counted as
+    "beyond_top_k" instead of "kept"."""
+    if not page_size:
+        hits = fetch_page(None, None)
+        kept, outcomes = hit_filter.split(hits)
+        seen = len(hits)
+    else:
+        kept, outcomes, seen = [], Counter(), 0
+        for _ in range(max_pages):
+            page = fetch_page(seen, page_size)
+            page_kept, page_outcomes = hit_filter.split(page)
+            kept.extend((seen + rank, hit) for rank, hit in page_kept)
+            outcomes.update(page_outcomes)
+            seen += len(page)
+            if len(page) != page_size or (top_k and len(kept) >= top_k):
+                break # Early termination: enough candidates, results exhausted, or paging not honored
+    if top_k and len(kept) > top_k:
+        outcomes["beyond_top_k"] = len(kept) - top_k
+        outcomes["kept"] -= len(kept) - top_k
+        kept = kept[:top_k]
+    return kept, outcomes, seen
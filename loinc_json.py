@@ -0,0 +1,101 @@
+import json
+import os
+from typing import Any, List, Optional
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from loinc_records import API_FIELDS
+
+# --- Decoder Configuration ---
+JSON_BACKEND = os.getenv("LOINC_JSON_BACKEND", "auto") # "auto" (msgspec, else orjson, else json), or one of those
+BACKENDS = ("msgspec", "orjson", "json")
+
+
+def available_backends():
+    """Backends that can be used here, fastest first."""
+    installed = {"msgspec": msgspec is not None, "orjson": orjson is not None, "json": True}
+    return [name for name in BACKENDS if installed[name]]
+
+
+def _field_get(self, key, default=None):
+    return getattr(self, key, default)
+
+
+if msgspec is not None:
+    # A hit record with only the fields the scripts read (loinc_records.API_FIELDS, same defaults);
+    # msgspec skips every other key while parsing. `get` lets it stand in for a raw hit dict.
+    # Holds only strings/numbers, so it is left out of garbage collection.
+    SearchHit = msgspec.defstruct("SearchHit", [(key, Any, default) for key, (_, default) in API_FIELDS.items()],
+                                  namespace={"get": _field_get}, gc=False)
+
+    class SearchResponse(msgspec.Struct):
+        ResponseSummary: Any = None
+        Results: Optional[List[SearchHit]] = []
+
+
+class JsonDecoder:
+    """Decodes API response bodies (bytes) with the fastest installed JSON library.
+
+    `loads` returns plain Python objects, like `json.loads`. `search_response` decodes
+    a Search API body; with msgspec its Results are decoded straight into SearchHit
+    records (the loinc_records schema) and unused fields are never built. Other
+    backends return the hits as dicts, since slimming them in Python costs more
+    than it saves. A null or missing Results is returned as [] by every backend.
+    Any decoding failure is raised as json.JSONDecodeError."""
+
+    def __init__(self, backend=JSON_BACKEND):
+        if backend == "auto":
+            backend = available_backends()[0]
+        if backend not in available_backends():
+            raise ImportError(f"JSON backend '{backend}' is not installed (available: {', '.join(available_backends())})")
+        self.backend = backend
+        if backend == "msgspec":
+            self._generic = msgspec.json.Decoder()
+            self._search = msgspec.json.Decoder(SearchResponse)
+
+    def _decode(self, body, decode):
+        try:
+            return decode(body)
+        except json.JSONDecodeError:
+            raise
+        except ValueError as e: # msgspec.DecodeError/ValidationError
+            doc = body.decode("utf-8", "replace") if isinstance(body, bytes) else body
+            raise json.JSONDecodeError(str(e), doc, 0) from e
+
+    def loads(self, body):
+        if self.backend == "msgspec":
+            return self._decode(body, self._generic.decode)
+        if self.backend == "orjson":
+            return self._decode(body, orjson.loads)
+        return json.loads(body)
+
+    def search_response(self, body):
+        """{"ResponseSummary": ..., "Results": [hit, ...]} for a Search API body."""
+        if self.backend == "msgspec":
+            response = self._decode(body, self._search.decode)
+            return {"ResponseSummary": response.ResponseSummary, "Results": response.Results or []}
+        data = self.loads(body)
+        if isinstance(data, dict) and data.get("Results") is None:
+            data["Results"] = []
+        return data
+
+
+default_decoder = JsonDecoder()
+
+
+def loads(body):
+    """Decodes a JSON body with the configured backend (see JsonDecoder)."""
+    return default_decoder.loads(body)
+
+
+def decode_search_response(body):
+    """Decodes a Search API body, with its hits as compact records where possible (see JsonDecoder)."""
+    return default_decoder.search_response(body)
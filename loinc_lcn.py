@@ -0,0 +1,167 @@
+import threading
+
+import requests
+
+from loinc_cache import OfflineCacheMiss
+from loinc_concurrency import run_ordered
+
+# --- Resolver Defaults ---
+DEFAULT_FHIR_BASE = "https://fhir.loinc.org/"
+DEFAULT_BATCH_SIZE = 50
+LOINC_SYSTEM_URI = "http://loinc.org"
+INVALID_CODES = ("", "Parse Error", "No Code")
+
+
+def build_lookup_bundle(codes):
+    """Builds a FHIR batch Bundle with one CodeSystem/$lookup GET entry per code."""
+    return {
+        "resourceType": "Bundle",
+        "type": "batch",
+        "entry": [
+            {"request": {"method": "GET", "url": f"CodeSystem/$lookup?system={LOINC_SYSTEM_URI}&code={code}"}}
+            for code in codes
+        ],
+    }
+
+
+def display_from_lookup(resource):
+    """Returns the 'display' (the LOINC Long Common Name) from a $lookup Parameters resource."""
+    if not resource or resource.get("resourceType") != "Parameters":
+        return None
+    for parameter in resource.get("parameter", []):
+        if parameter.get("name") == "display":
+            return parameter.get("valueString")
+    return None
+
+
+class LcnResolver:
+    """Resolves LOINC codes to Long Common Names with a deduplicating in-process memo.
+
+    Codes not yet known are looked up in batches of `batch_size` via a FHIR batch
+    Bundle of CodeSystem/$lookup requests; each answer is also written to the
+    client's response cache so later runs resolve locally. Codes the batch cannot
+    answer (or every code, if the server rejects batches) go through `fallback`,
+    a per-code `code -> lcn` callable."""
+
+    def __init__(self, client, headers, fhir_base=DEFAULT_FHIR_BASE, batch_size=DEFAULT_BATCH_SIZE,
+                 fallback=None, max_workers=4, use_batch=True):
+        self.client = client
+        self.headers = headers
+        self.fhir_base = fhir_base
+        self.lookup_url = f"{fhir_base.rstrip('/')}/CodeSystem/$lookup"
+        self.batch_size = batch_size
+        self.fallback = fallback
+        self.max_workers = max_workers
+        self.use_batch = use_batch
+        self.memo = {}
+        self._in_flight = {} # code -> Event, for codes another thread is resolving right now
+        self.references = 0
+        self.batches = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def seed(self, names):
+        """Adds known code -> LCN pairs (e.g. from a panel file) to the memo, so they need no lookup."""
+        with self._lock:
+            for code, lcn in names.items():
+                if code and lcn:
+                    self.memo.setdefault(code, lcn)
+
+    def _cache_params(self, code):
+        return {"system": LOINC_SYSTEM_URI, "code": code}
+
+    def _remember(self, code, lcn, cacheable=False):
+        with self._lock:
+            self.memo[code] = lcn
+        if cacheable and self.client.cache is not None:
+            self.client.cache.set(self.lookup_url, self._cache_params(code), {"display": lcn})
+
+    def _resolve_one(self, code):
+        if self.fallback is not None:
+            with self._lock:
+                self.fallbacks += 1
+            self._remember(code, self.fallback(code))
+        else:
+            self._remember(code, f"{code} (LCN Not Found)")
+
+    def _resolve_batch(self, codes):
+        """Resolves one batch of codes, falling back to per-code lookups where needed."""
+        unresolved = list(codes)
+        offline = self.client.cache is not None and self.client.cache.offline
+        if self.use_batch and not offline:
+            try:
+                bundle = self.client.post_json(self.fhir_base, build_lookup_bundle(codes), headers=self.headers)
+                with self._lock:
+                    self.batches += 1
+                entries = bundle.get("entry", []) if isinstance(bundle, dict) else []
+                unresolved = []
+                for code, entry in zip(codes, entries):
+                    lcn = display_from_lookup(entry.get("resource"))
+                    if lcn:
+                        self._remember(code, lcn, cacheable=True)
+                    else:
+                        unresolved.append(code)
+                unresolved.extend(codes[len(entries):])
+            except (requests.exceptions.RequestException, ValueError, OfflineCacheMiss) as e:
+                print(f"        -> Batch LCN lookup failed for {len(codes)} codes ({e}). Falling back to per-code lookups.")
+                response = getattr(e, "response", None)
+                if response is not None and 400 <= response.status_code < 500 and response.status_code != 429:
+                    print("        -> Server rejected the batch request; using per-code lookups for the rest of the run.")
+                    self.use_batch = False
+                unresolved = list(codes)
+        for code in unresolved:
+            self._resolve_one(code)
+
+    def resolve(self, codes):
+        """Resolves every code (duplicates and already-known codes cost nothing) and
+           returns the Long Common Names in the same order as `codes`. Safe to call
+           from several threads: a code being resolved by one call is awaited, not
+           requested again, by the others."""
+        codes = list(codes)
+        claimed = []
+        awaited = []
+        with self._lock:
+            self.references += len(codes)
+            for code in dict.fromkeys(codes):
+                if code in self.memo:
+                    continue
+                if code in self._in_flight:
+                    awaited.append(self._in_flight[code])
+                    continue
+                self._in_flight[code] = threading.Event()
+                claimed.append(code)
+        try:
+            self._resolve_claimed(claimed)
+        finally:
+            with self._lock:
+                for code in claimed:
+                    self.memo.setdefault(code, f"{code} (LCN Fetch Failed)")
+                    self._in_flight.pop(code).set()
+        for event in awaited:
+            event.wait()
+
+        with self._lock:
+            return [self.memo[code] for code in codes]
+
+    def _resolve_claimed(self, codes):
+        """Resolves codes this call has claimed: invalid codes, cache hits, then batches."""
+        pending = []
+        for code in codes:
+            if not code or code in INVALID_CODES:
+                self._remember(code, f"{code} (LCN N/A)")
+                continue
+            if self.client.cache is not None:
+                cached = self.client.cache.get(self.lookup_url, self._cache_params(code))
+                if cached is not None and cached.get("display"):
+                    self._remember(code, cached["display"])
+                    continue
+            pending.append(code)
+
+        if pending:
+            print(f"      Resolving LCNs for {len(pending)} distinct codes in batches of {self.batch_size}...")
+            batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+            run_ordered(self._resolve_batch, batches, max_workers=self.max_workers)
+
+    def summary(self):
+        return (f"LCN resolver: {self.references} code references, {len(self.memo)} distinct codes, "
+                f"{self.batches} batch requests, {self.fallbacks} per-code fallbacks")
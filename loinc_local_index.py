@@ -0,0 +1,254 @@
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+# --- Local Index Defaults ---
+DEFAULT_INDEX_PATH = "loinc_local_index.sqlite"
+DEFAULT_MAX_ROWS = 100   # Hits returned per search, roughly what the Search API sends back
+INSERT_BATCH_SIZE = 5000
+
+# Loinc.csv columns kept in the index; the names match the Search API's JSON keys
+LOINC_COLUMNS = [
+    "LOINC_NUM", "COMPONENT", "PROPERTY", "TIME_ASPCT", "SYSTEM", "SCALE_TYP", "METHOD_TYP",
+    "CLASS", "CLASSTYPE", "STATUS", "LONG_COMMON_NAME", "SHORTNAME", "EXAMPLE_UNITS",
+    "ORDER_OBS", "PanelType", "COMMON_TEST_RANK",
+]
+# Free-text columns searched by the FTS5 index
+SEARCH_COLUMNS = ["LONG_COMMON_NAME", "COMPONENT", "SHORTNAME", "RELATEDNAMES2", "DisplayName", "CONSUMER_NAME"]
+
+CODE_PATTERN = re.compile(r'^"?(\d{1,7}-\d)"?$')
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+")
+
+
+# --- Index Builder ---
+def _stream_csv(path):
+    """Yields dict rows from a LOINC release CSV (UTF-8, optional BOM)."""
+    with open(path, newline="", encoding="utf-8-sig") as csvfile:
+        yield from csv.DictReader(csvfile)
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_local_index(loinc_csv, db_path=DEFAULT_INDEX_PATH, panels_csv=None):
+    """Streams Loinc.csv (and optionally PanelsAndForms.csv) into a SQLite/FTS5 index.
+
+    Rows are inserted in batches, so memory stays flat for the ~100k-row release.
+    An existing index at `db_path` is replaced."""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(f"CREATE TABLE loinc ({', '.join(c + (' INTEGER' if c in ('CLASSTYPE', 'COMMON_TEST_RANK') else ' TEXT') for c in LOINC_COLUMNS)}, PRIMARY KEY (LOINC_NUM))")
+    conn.execute(f"CREATE VIRTUAL TABLE loinc_fts USING fts5(LOINC_NUM UNINDEXED, {', '.join(SEARCH_COLUMNS)})")
+    conn.execute("""CREATE TABLE panel_members (
+                        parent_loinc TEXT NOT NULL, sequence INTEGER, loinc TEXT NOT NULL,
+                        loinc_name TEXT, row_id INTEGER, parent_row_id INTEGER)""")
+
+    start = time.time()
+    row_count = 0
+    loinc_batch, fts_batch = [], []
+    for row in _stream_csv(loinc_csv):
+        values = [row.get(c, "") for c in LOINC_COLUMNS]
+        values[LOINC_COLUMNS.index("CLASSTYPE")] = _int_or_none(row.get("CLASSTYPE"))
+        values[LOINC_COLUMNS.index("COMMON_TEST_RANK")] = _int_or_none(row.get("COMMON_TEST_RANK")) or 0
+        loinc_batch.append(values)
+        fts_batch.append([row.get("LOINC_NUM", "")] + [row.get(c, "") for c in SEARCH_COLUMNS])
+        row_count += 1
+        if len(loinc_batch) >= INSERT_BATCH_SIZE:
+            _flush(conn, loinc_batch, fts_batch)
+    _flush(conn, loinc_batch, fts_batch)
+    print(f"Indexed {row_count} LOINC terms from {loinc_csv} in {time.time() - start:.1f} seconds.")
+
+    if panels_csv:
+        panel_rows = import_panels(conn, panels_csv)
+        print(f"Imported {panel_rows} panel member rows from {panels_csv}.")
+
+    conn.execute("INSERT INTO loinc_fts(loinc_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    return row_count
+
+
+def _flush(conn, loinc_batch, fts_batch):
+    if loinc_batch:
+        placeholders = ", ".join("?" for _ in LOINC_COLUMNS)
+        conn.executemany(f"INSERT OR REPLACE INTO loinc VALUES ({placeholders})", loinc_batch)
+        conn.executemany(f"INSERT INTO loinc_fts VALUES ({', '.join('?' for _ in range(len(SEARCH_COLUMNS) + 1))})", fts_batch)
+        conn.commit()
+    loinc_batch.clear()
+    fts_batch.clear()
+
+
+def import_panels(conn, panels_csv):
+    """Loads PanelsAndForms.csv parent/child rows. Rows where a panel lists itself are skipped.
+       Row ids are stored as integers, so MIN(parent_row_id) is the first occurrence of a panel."""
+    batch = []
+    total = 0
+    for row in _stream_csv(panels_csv):
+        parent, child = row.get("ParentLoinc", ""), row.get("Loinc", "")
+        if not parent or not child or row.get("ID") == row.get("ParentId"):
+            continue
+        batch.append((parent, _int_or_none(row.get("SEQUENCE")), child, row.get("LoincName", ""),
+                      _int_or_none(row.get("ID")), _int_or_none(row.get("ParentId"))))
+        if len(batch) >= INSERT_BATCH_SIZE:
+            conn.executemany("INSERT INTO panel_members VALUES (?, ?, ?, ?, ?, ?)", batch)
+            total += len(batch)
+            batch.clear()
+    conn.executemany("INSERT INTO panel_members VALUES (?, ?, ?, ?, ?, ?)", batch)
+    total += len(batch)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_panel_members_parent ON panel_members(parent_loinc, sequence)")
+    conn.commit()
+    return total
+
+
+# --- Local Search ---
+class LocalLoincIndex:
+    """Read-only access to an index built by `build_local_index`.
+
+    `search` returns hits with the same keys as the Search API ("LOINC_NUM",
+    "LONG_COMMON_NAME", "STATUS", ...), so existing result-row code works unchanged."""
+
+    def __init__(self, db_path=DEFAULT_INDEX_PATH, max_rows=DEFAULT_MAX_ROWS):
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Local LOINC index not found: {db_path} (build it with loinc_local_index.py)")
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self._local = threading.local() # One read-only connection per thread
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _hits(self, rows):
+        return [{c: row[c] for c in LOINC_COLUMNS} for row in rows]
+
+    def get_code(self, loinc_code):
+        row = self._conn().execute("SELECT * FROM loinc WHERE LOINC_NUM = ?", (loinc_code,)).fetchone()
+        return self._hits([row])[0] if row else None
+
+    def search(self, term, rows=None, offset=0):
+        """Full-text search; every token of the term must match (as a prefix).
+           `rows`/`offset` page through the ranked results like the Search API's parameters."""
+        limit = rows or self.max_rows
+        code_match = CODE_PATTERN.match(term.strip())
+        if code_match:
+            hit = self.get_code(code_match.group(1))
+            return [hit] if hit and not offset else []
+        tokens = TOKEN_PATTERN.findall(term)
+        if not tokens:
+            return []
+        sql = ("SELECT loinc.* FROM loinc_fts JOIN loinc USING (LOINC_NUM) WHERE loinc_fts MATCH ? "
+               "ORDER BY bm25(loinc_fts), loinc.COMMON_TEST_RANK = 0, loinc.COMMON_TEST_RANK LIMIT ? OFFSET ?")
+        match_query = " AND ".join(f'"{token}"*' for token in tokens)
+        return self._hits(self._conn().execute(sql, (match_query, limit, offset or 0)).fetchall())
+
+    def panel_members(self, panel_code):
+        """Returns [(code, name), ...] for the direct members of a panel, in sequence order."""
+        return [tuple(row) for row in self._conn().execute(
+            "SELECT loinc, loinc_name FROM panel_members WHERE parent_loinc = ? "
+            "AND parent_row_id = (SELECT MIN(parent_row_id) FROM panel_members WHERE parent_loinc = ?) "
+            "ORDER BY sequence", (panel_code, panel_code))]
+
+    def panel_tree(self):
+        """Returns {panel code: [(code, name), ...]} for every panel, each with the same
+           members `panel_members` gives, read in one pass."""
+        rows = self._conn().execute(
+            "SELECT m.parent_loinc, m.loinc, m.loinc_name FROM panel_members m "
+            "JOIN (SELECT parent_loinc, MIN(parent_row_id) AS first_row FROM panel_members GROUP BY parent_loinc) f "
+            "ON m.parent_loinc = f.parent_loinc AND m.parent_row_id = f.first_row "
+            "ORDER BY m.parent_loinc, m.sequence")
+        tree = {}
+        for parent, code, name in rows:
+            tree.setdefault(parent, []).append((code, name))
+        return tree
+
+    def panel_codes(self):
+        """Returns the set of every LOINC code that has panel members in the index."""
+        return {row[0] for row in self._conn().execute("SELECT DISTINCT parent_loinc FROM panel_members")}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class LocalLoincClient:
+    """Drop-in replacement for LoincClient that answers from a LocalLoincIndex.
+
+    Search API URLs are answered by `LocalLoincIndex.search`, FHIR Questionnaire
+    URLs by the imported panel table, and $lookup batch Bundles by code lookups,
+    all in the same JSON shapes the remote services return. No network or
+    credentials are needed."""
+
+    cache = None # Nothing to cache; lookups are already local
+
+    def __init__(self, index):
+        self.index = index if isinstance(index, LocalLoincIndex) else LocalLoincIndex(index)
+
+    def get_json(self, url, params, headers=None, timeout=None, is_negative=None, decode=None):
+        if "Questionnaire" in url:
+            panel_code = (params or {}).get("url", "").rstrip("/").rsplit("/", 1)[-1]
+            return self._questionnaire(panel_code)
+        query = (params or {}).get("query", "")
+        results = self.index.search(query, rows=_int_or_none((params or {}).get("rows")),
+                                    offset=_int_or_none((params or {}).get("offset")) or 0)
+        return {"ResponseSummary": {"Query": query, "RowsReturned": len(results)}, "Results": results}
+
+    def post_json(self, url, payload, headers=None, timeout=None):
+        entries = []
+        for entry in payload.get("entry", []):
+            query = parse_qs(urlparse(entry.get("request", {}).get("url", "")).query)
+            hit = self.index.get_code(query.get("code", [""])[0])
+            if hit:
+                entries.append({"resource": {"resourceType": "Parameters", "parameter": [
+                    {"name": "display", "valueString": hit["LONG_COMMON_NAME"]}]}})
+            else:
+                entries.append({"resource": {"resourceType": "OperationOutcome"}})
+        return {"resourceType": "Bundle", "type": "batch-response", "entry": entries}
+
+    def _questionnaire(self, panel_code):
+        members = self.index.panel_members(panel_code)
+        if not members:
+            return {"resourceType": "Bundle", "total": 0}
+        items = [{"linkId": str(i), "text": name, "code": [{"system": "http://loinc.org", "code": code, "display": name}]}
+                 for i, (code, name) in enumerate(members, start=1)]
+        return {"resourceType": "Bundle", "total": 1,
+                "entry": [{"resource": {"resourceType": "Questionnaire", "item": items}}]}
+
+    def summary(self):
+        return f"HTTP: no requests sent (answered from local index {self.index.db_path})"
+
+    def close(self):
+        self.index.close()
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a local LOINC search index from the LOINC table release.")
+    parser.add_argument("loinc_csv", help="Path to LoincTable/Loinc.csv")
+    parser.add_argument("--panels-csv", help="Path to AccessoryFiles/PanelsAndForms/PanelsAndForms.csv")
+    parser.add_argument("--db", default=DEFAULT_INDEX_PATH, help=f"Output index path (default: {DEFAULT_INDEX_PATH})")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.loinc_csv):
+        print(f"ERROR: LOINC table not found: {args.loinc_csv}")
+        sys.exit(1)
+    build_local_index(args.loinc_csv, args.db, panels_csv=args.panels_csv)
+    print(f"Local index written to {args.db}")
@@ -0,0 +1,123 @@
+from collections import defaultdict
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+from loinc_normalize import PARENTHETICAL_PATTERN, TOKEN_PATTERN, TOKEN_SYNONYMS
+from loinc_rank import ABBREVIATIONS, SPECIMEN_SYSTEMS
+
+# --- Matching Defaults ---
+MATCH_THRESHOLD = 0.6 # Pairs scoring below this are never assigned
+TOKEN_WEIGHT = 0.7    # Score = TOKEN_WEIGHT * token Dice + (1 - TOKEN_WEIGHT) * character similarity
+UNMATCHED = "-"       # Placeholder code for internal parameters without a panel member
+
+# Connecting words that only dilute the token overlap
+FILLER_TOKENS = {"from", "of", "in", "by", "the", "and", "or", "level", "count", "automated"}
+
+
+def _analyte_tokens(text):
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text):
+        token = TOKEN_SYNONYMS.get(token, token)
+        if token in SPECIMEN_SYSTEMS or token in FILLER_TOKENS:
+            continue
+        for t in ABBREVIATIONS.get(token, (token,)):
+            t = t[:-1] if len(t) > 3 and t.endswith("s") else t
+            if t not in tokens:
+                tokens.append(t)
+    return tokens
+
+
+@lru_cache(maxsize=65536)
+def parameter_features(name):
+    """Variants [(token set, comparison text), ...] of an internal parameter name or a member LCN.
+
+    Only the analyte is compared: for LCNs that is the part before the first
+    " [" ("Bilirubin.direct [Mass/volume] in Serum or Plasma" -> bilirubin, direct).
+    Specimen words are dropped, lab shorthand is expanded and plurals are folded.
+    A parenthetical ("MCV (Mean Cell Volume)") is a separate variant next to the
+    text outside it. Memoized, since the same LCNs recur across panels and tests."""
+    analyte = str(name).split(" [", 1)[0].lower()
+    texts = [PARENTHETICAL_PATTERN.sub(" ", analyte)] + PARENTHETICAL_PATTERN.findall(analyte)
+    variants = []
+    for text in texts:
+        tokens = _analyte_tokens(text)
+        if tokens and all(frozenset(tokens) != existing for existing, _ in variants):
+            variants.append((frozenset(tokens), " ".join(tokens)))
+    return tuple(variants)
+
+
+def _similarity(a, b):
+    (a_tokens, a_text), (b_tokens, b_text) = a, b
+    overlap = len(a_tokens & b_tokens)
+    if not overlap:
+        return 0.0
+    dice = 2 * overlap / (len(a_tokens) + len(b_tokens))
+    return TOKEN_WEIGHT * dice + (1 - TOKEN_WEIGHT) * SequenceMatcher(None, a_text, b_text).ratio()
+
+
+class PanelMatch:
+    """Result of matching one test's internal parameters to one panel's members."""
+
+    def __init__(self, internal_names, assignments):
+        self.internal_names = internal_names
+        self.assignments = assignments # {internal index: (member index, score)}
+
+    @property
+    def coverage(self):
+        """Share of the internal parameters that found a panel member (0-1)."""
+        return round(len(self.assignments) / len(self.internal_names), 3) if self.internal_names else 0.0
+
+    def matched_codes(self, member_codes):
+        """One "internal name: LOINC code" line per internal parameter, in input order."""
+        lines = []
+        for i, name in enumerate(self.internal_names):
+            assigned = self.assignments.get(i)
+            lines.append(f"{name}: {member_codes[assigned[0]] if assigned else UNMATCHED}")
+        return lines
+
+
+class ParameterMatcher:
+    """Matches a test's internal parameter names against candidate panels' member LCNs.
+
+    The internal side is tokenized once per test and reused for every candidate
+    panel. For each panel, an inverted index (token -> members) yields only the
+    (parameter, member) pairs that share a token, so the similarity matrix is
+    filled sparsely instead of comparing every pair. Character similarity is
+    computed only for those pairs. Pairs are then assigned greedily, best score
+    first, one member per parameter."""
+
+    def __init__(self, internal_names, threshold=MATCH_THRESHOLD):
+        names = (str(name).strip() for name in internal_names if name and str(name).strip())
+        self.internal_names = list(dict.fromkeys(names)) # Drop repeated names, keep input order
+        self.threshold = threshold
+        self._internal = [parameter_features(name) for name in self.internal_names]
+
+    def similarities(self, member_names):
+        """Sparse similarity matrix: {(internal index, member index): score} for pairs sharing a token."""
+        members = [parameter_features(name) for name in member_names]
+        index = defaultdict(set)
+        for j, variants in enumerate(members):
+            for tokens, _ in variants:
+                for token in tokens:
+                    index[token].add(j)
+        scores = {}
+        for i, variants in enumerate(self._internal):
+            candidates = {j for tokens, _ in variants for token in tokens for j in index.get(token, ())}
+            for j in candidates:
+                scores[(i, j)] = max(_similarity(variant, member_variant)
+                                     for variant in variants for member_variant in members[j])
+        return scores
+
+    def match(self, member_names):
+        """Assigns internal parameters to panel members; returns a PanelMatch."""
+        assignments = {}
+        used_members = set()
+        ranked = sorted(self.similarities(member_names).items(), key=lambda item: (-item[1], item[0]))
+        for (i, j), score in ranked:
+            if score < self.threshold:
+                break
+            if i in assignments or j in used_members:
+                continue
+            assignments[i] = (j, round(score, 3))
+            used_members.add(j)
+        return PanelMatch(self.internal_names, assignments)
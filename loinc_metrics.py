@@ -0,0 +1,210 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# --- Metric Defaults ---
+# Upper bounds (seconds) of the latency histogram buckets; an implicit +Inf bucket follows
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Help text for the Prometheus output; unknown names are exported without HELP
+METRIC_HELP = {
+    "loinc_http_requests_total": "HTTP requests sent, by endpoint, method and status (or error class)",
+    "loinc_http_request_seconds": "Duration of single HTTP requests (one attempt each)",
+    "loinc_http_retries_total": "HTTP attempts that were retried",
+    "loinc_http_response_bytes_total": "Response body bytes received",
+    "loinc_http_request_bytes_total": "Request body bytes sent (POST payloads)",
+    "loinc_cache_lookups_total": "Response cache lookups, by result (hit/miss)",
+    "loinc_rows_total": "Search result rows, by outcome (kept or the filter rule that dropped them)",
+    "loinc_stage_seconds": "Time spent per item in each processing stage",
+}
+
+
+def endpoint_label(url):
+    """`host/path` of a request URL (query string dropped), used as the `endpoint` label."""
+    parsed = urlparse(url)
+    return f"{parsed.netloc}{parsed.path.rstrip('/')}" or url
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    """Bucketed observations (Prometheus-style) plus count, sum and max."""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the `fraction` quantile (max for the +Inf bucket)."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6),
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99),
+                "buckets": {str(bound): n for bound, n in zip(self.buckets + ("+Inf",), self.counts)}}
+
+
+class JsonEventLog:
+    """Writes one JSON object per line (`{"ts": ..., "event": ..., ...}`) to a file, or stderr for "-"."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = sys.stderr if path == "-" else open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, event, **fields):
+        line = json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        if self._file is not sys.stderr:
+            self._file.close()
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms for one run, keyed by name + labels.
+
+    `inc`/`observe`/`timer` record values; `event` additionally writes a
+    structured JSON line when the registry has an event log. At the end of a
+    run, `summary` gives a readable report, `as_dict` a JSON-able snapshot and
+    `to_prometheus` the Prometheus text exposition format."""
+
+    def __init__(self, event_log=None):
+        self.event_log = event_log
+        self.counters = {}   # name -> {label key: value}
+        self.histograms = {} # name -> {label key: Histogram}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=DEFAULT_LATENCY_BUCKETS, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name="loinc_stage_seconds", **labels):
+        """Times the `with` block into histogram `name` (default: per-stage timings)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def event(self, event, **fields):
+        if self.event_log is not None:
+            self.event_log.write(event, **fields)
+
+    def counter_value(self, name, **labels):
+        """Sum of `name` over every series whose labels include `labels`."""
+        wanted = set(_label_key(labels))
+        with self._lock:
+            return sum(value for key, value in self.counters.get(name, {}).items() if wanted <= set(key))
+
+    # --- Export ---
+    def as_dict(self):
+        with self._lock:
+            return {
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in sorted(series.items())]
+                             for name, series in sorted(self.counters.items())},
+                "histograms": {name: [{"labels": dict(key), **histogram.as_dict()}
+                                      for key, histogram in sorted(series.items())]
+                               for name, series in sorted(self.histograms.items())},
+            }
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', str(bound))])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def write_prometheus(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+
+    def summary(self):
+        """End-of-run report: one line per counter/histogram series."""
+        lines = ["Run metrics:"]
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                for key, value in sorted(series.items()):
+                    lines.append(f"  {name}{_format_labels(key)} = {value}")
+            for name, series in sorted(self.histograms.items()):
+                for key, h in sorted(series.items()):
+                    lines.append(f"  {name}{_format_labels(key)}: n={h.count} total={h.sum:.2f}s "
+                                 f"p50<={h.quantile(0.5) * 1000:.0f}ms p95<={h.quantile(0.95) * 1000:.0f}ms "
+                                 f"max={h.max * 1000:.0f}ms")
+        return "\n".join(lines)
+
+    def close(self):
+        if self.event_log is not None:
+            self.event_log.close()
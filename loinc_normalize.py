@@ -0,0 +1,78 @@
+import re
+import unicodedata
+from collections import OrderedDict, namedtuple
+
+# --- Normalization Rules ---
+# Specimen words dropped from the start of a term ("Serum Calcium" ~ "Calcium")
+SPECIMEN_PREFIXES = {"serum", "plasma"}
+# Spelling variants and abbreviations found in LIMS exports -> canonical token
+TOKEN_SYNONYMS = {
+    "haemoglobin": "hemoglobin", "foetal": "fetal", "leucocyte": "leukocyte", "leucocytes": "leukocytes",
+    "protien": "protein", "phosphatse": "phosphatase", "oestradiol": "estradiol", "abs": "absolute",
+    "hr": "hour", "hrs": "hours", "hb": "hemoglobin",
+}
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+PARENTHETICAL_PATTERN = re.compile(r"\(([^()]*)\)")
+TEST_SUFFIX_PATTERN = re.compile(r"(?i)\s+(test|panel)$") # "LIVER FUNCTION TEST" is searched as "LIVER FUNCTION"
+
+TermGroup = namedtuple("TermGroup", ["query", "members"])
+TermGroup.__doc__ = """One equivalence class: `query` is searched once and its rows are reused for every term in `members`."""
+
+
+def _tokens(text):
+    tokens = [TOKEN_SYNONYMS.get(token, token) for token in TOKEN_PATTERN.findall(text)]
+    while len(tokens) > 1 and tokens[0] in SPECIMEN_PREFIXES:
+        tokens = tokens[1:]
+    return tokens
+
+
+def fold_term(term):
+    """Key that only folds case, Unicode width, whitespace and punctuation
+       ("Serum  urea." ~ "SERUM UREA"), so grouped spellings always send the same search."""
+    return " ".join(TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", term).lower()))
+
+
+def _is_acronym(candidate, words):
+    """True if `candidate` spells the initials of `words` (e.g. "BUN" for Blood Urea Nitrogen)."""
+    letters = "".join(TOKEN_PATTERN.findall(candidate))
+    initials = "".join(word[0] for word in words if word)
+    return len(letters) > 1 and letters == initials
+
+
+def normalize_term(term):
+    """Canonical key for a lab term.
+
+    Case, Unicode width, whitespace and punctuation are folded, leading specimen
+    words ("Serum", "Plasma") are dropped, known spelling variants/abbreviations
+    are mapped to one form, and a parenthetical that only repeats the initials of
+    the name ("Blood Urea Nitrogen ( BUN )") is removed."""
+    text = unicodedata.normalize("NFKC", term).lower()
+    outside = PARENTHETICAL_PATTERN.sub(" ", text)
+    outside_words = TOKEN_PATTERN.findall(outside)
+    text = PARENTHETICAL_PATTERN.sub(
+        lambda m: " " if _is_acronym(m.group(1), outside_words) else f" {m.group(1)} ", text)
+    return " ".join(_tokens(text))
+
+
+def test_search_term(test_name):
+    """Search term for an internal test name: a trailing "test"/"panel" word is dropped."""
+    return TEST_SUFFIX_PATTERN.sub("", test_name).strip() or test_name
+
+
+def group_terms(terms, key=fold_term):
+    """Groups terms into equivalence classes by `key`, in first-appearance order.
+
+    Exact duplicates are listed once per group. The query of each group is its
+    first member (stripped), so the search sent is one the input actually used."""
+    groups = OrderedDict()
+    for term in terms:
+        canonical = key(term) or term.strip().lower()
+        members = groups.setdefault(canonical, [])
+        if term not in members:
+            members.append(term)
+    return [TermGroup(members[0].strip(), members) for members in groups.values()]
+
+
+def fan_out(rows, term, field="search_term"):
+    """Copies a group's result rows for one member term, relabelling `field`."""
+    return [{**row, field: term} for row in rows]
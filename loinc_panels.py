@@ -0,0 +1,225 @@
+import csv
+import threading
+import time
+
+from loinc_local_index import LocalLoincIndex
+
+class PanelPrecheck:
+    """Decides, before any FHIR request, whether a LOINC code can be a panel.
+
+    Most search hits are single observations, and asking the FHIR server for
+    their Questionnaire only yields "not found". A code is treated as a known
+    non-panel when:
+      - the search hit carries a PanelType field and it is empty,
+      - a panel list is loaded (e.g. from a local index) and the code is not in it,
+      - or a Questionnaire lookup already came back empty earlier in this run."""
+
+    def __init__(self, panel_codes=None):
+        self.panel_codes = set(panel_codes) if panel_codes is not None else None
+        self.not_found = set()
+        self.skipped = 0
+        self.checked = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_local_index(cls, db_path):
+        """Loads the panel list from an index built with panels (see loinc_local_index.py)."""
+        index = LocalLoincIndex(db_path)
+        try:
+            panel_codes = index.panel_codes()
+        finally:
+            index.close()
+        return cls(panel_codes or None) # An index built without PanelsAndForms.csv says nothing
+
+    def skip_reason(self, loinc_code, panel_type=None):
+        """Returns why `loinc_code` needs no Questionnaire request, or None if it might be a panel.
+           `panel_type` is the hit's PanelType value, or None when the hit does not carry one."""
+        with self._lock:
+            self.checked += 1
+            if loinc_code in self.not_found:
+                reason = "no Questionnaire found earlier in this run"
+            elif panel_type is not None and not str(panel_type).strip():
+                reason = "PanelType is empty"
+            elif self.panel_codes is not None and loinc_code not in self.panel_codes:
+                reason = "not in the panel list"
+            else:
+                return None
+            self.skipped += 1
+            return reason
+
+    def record_not_found(self, loinc_code):
+        with self._lock:
+            self.not_found.add(loinc_code)
+
+    def summary(self):
+        source = f"{len(self.panel_codes)} known panels" if self.panel_codes is not None else "no panel list"
+        return (f"Panel pre-check: {self.skipped} of {self.checked} FHIR Questionnaire lookups skipped "
+                f"({source}, {len(self.not_found)} codes without a Questionnaire)")
+
+
+# --- Questionnaire Items ---
+def _item_code(item):
+    return (item.get("code") or [{}])[0].get("code")
+
+
+def _item_name(item):
+    return (item.get("code") or [{}])[0].get("display") or item.get("text")
+
+
+def questionnaire_leaves(items):
+    """Flattens (possibly nested) Questionnaire items into [(code, display), ...] leaf members.
+
+    Items that carry their own `item` list (sub-panels such as a CBC's differential,
+    or uncoded groups) are replaced by their members, depth first, in order."""
+    leaves = []
+    for item in items:
+        if item.get("item"):
+            leaves.extend(questionnaire_leaves(item["item"]))
+        else:
+            leaves.append((_item_code(item) or "No Code", _item_name(item)))
+    return leaves
+
+
+class PanelGraph:
+    """In-process store of panel -> member edges, expanded recursively without network calls.
+
+    Filled from the LOINC PanelsAndForms.csv release file, a local index built with
+    it, or Questionnaires already in the response cache. `expand` flattens nested
+    sub-panels into their leaf members; each panel's flattened members are memoized,
+    so a sub-panel shared by many panels is walked once per run. Member names come
+    with the release file (LoincName) and are usable as LCNs; Questionnaire-sourced
+    members carry None."""
+
+    def __init__(self):
+        self.children = {}     # panel code -> [(member code, name or None), ...] in sequence order
+        self.complete = False  # True when loaded from the release file: every panel is known
+        self.expansions = 0
+        self._flat = {}        # panel code -> tuple of (code, name) leaves
+        self._lock = threading.Lock()
+
+    def add_panel(self, panel_code, members):
+        with self._lock:
+            self.children[panel_code] = list(members)
+            self._flat.clear() # Any memoized parent may contain this panel
+
+    def add_questionnaire(self, panel_code, questionnaire):
+        """Records a FHIR Questionnaire: coded items with nested items become sub-panels."""
+        members = []
+        for item in questionnaire.get("item", []):
+            code, nested = _item_code(item), item.get("item")
+            if nested and code:
+                self.add_questionnaire(code, item)
+                members.append((code, None))
+            elif nested:
+                members.extend((member_code, None) for member_code, _ in questionnaire_leaves(nested))
+            else:
+                members.append((code or "No Code", None))
+        if members:
+            self.add_panel(panel_code, members)
+
+    @classmethod
+    def from_panels_csv(cls, path):
+        """Loads PanelsAndForms.csv. Like the local index, a panel that appears under several
+           parents keeps the member block of its first occurrence (lowest numeric ParentId).
+           Rows without a numeric ParentId are skipped, as the local index ignores them."""
+        blocks = {} # panel code -> (parent row id, [(sequence, code, name), ...])
+        with open(path, newline="", encoding="utf-8-sig") as csvfile:
+            for row in csv.DictReader(csvfile):
+                parent, child = row.get("ParentLoinc", ""), row.get("Loinc", "")
+                if not parent or not child or row.get("ID") == row.get("ParentId"):
+                    continue
+                try:
+                    parent_id = int(row["ParentId"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                current = blocks.get(parent)
+                if current is None or parent_id < current[0]:
+                    current = blocks[parent] = (parent_id, [])
+                if parent_id == current[0]:
+                    sequence = int(row["SEQUENCE"]) if (row.get("SEQUENCE") or "").isdigit() else 0
+                    current[1].append((sequence, child, row.get("LoincName") or None))
+        graph = cls()
+        for parent, (_, members) in blocks.items():
+            members.sort(key=lambda member: member[0])
+            graph.children[parent] = [(code, name) for _, code, name in members]
+        graph.complete = True
+        return graph
+
+    @classmethod
+    def from_local_index(cls, db_path):
+        """Loads the panel table of an index built with --panels-csv (see loinc_local_index.py)."""
+        index = LocalLoincIndex(db_path)
+        try:
+            tree = index.panel_tree()
+        finally:
+            index.close()
+        graph = cls()
+        graph.children = tree
+        graph.complete = bool(tree)
+        return graph
+
+    def load_cached_questionnaires(self, cache, questionnaire_endpoint):
+        """Adds every Questionnaire in the response cache not already known; returns how many."""
+        added = 0
+        for params, data in cache.entries(questionnaire_endpoint):
+            panel_code = str(params.get("url", "")).rstrip("/").rsplit("/", 1)[-1]
+            if not panel_code or panel_code in self.children or not isinstance(data, dict):
+                continue
+            resource = (data.get("entry") or [{}])[0].get("resource") or {}
+            if resource.get("resourceType") == "Questionnaire" and resource.get("item"):
+                self.add_questionnaire(panel_code, resource)
+                added += 1
+        return added
+
+    def __contains__(self, panel_code):
+        return panel_code in self.children
+
+    def __len__(self):
+        return len(self.children)
+
+    def panel_codes(self):
+        return set(self.children)
+
+    def expand(self, panel_code):
+        """Flattened leaf members [(code, name), ...] of a panel in sequence order, or None if
+           the panel is unknown. Repeated codes are kept, as in the FHIR Questionnaire."""
+        if panel_code not in self.children:
+            return None
+        with self._lock:
+            self.expansions += 1
+            return list(self._expand(panel_code, (panel_code,)))
+
+    def _expand(self, panel_code, path):
+        flat = self._flat.get(panel_code)
+        if flat is not None:
+            return flat
+        leaves = []
+        for code, name in self.children[panel_code]:
+            if code in self.children and code not in path: # A sub-panel (`path` guards against cycles)
+                leaves.extend(self._expand(code, path + (code,)))
+            else:
+                leaves.append((code, name))
+        flat = self._flat[panel_code] = tuple(leaves)
+        return flat
+
+    def summary(self):
+        return f"Panel graph: {len(self.children)} panels, {self.expansions} expansions answered locally"
+
+
+def load_panel_graph(panels_csv=None, index_path=None, cache=None, questionnaire_endpoint=None):
+    """Builds a PanelGraph from the first available release source (PanelsAndForms.csv,
+       then a local index), plus any Questionnaires in the response cache."""
+    start = time.perf_counter()
+    if panels_csv:
+        graph, source = PanelGraph.from_panels_csv(panels_csv), panels_csv
+    elif index_path:
+        graph, source = PanelGraph.from_local_index(index_path), index_path
+    else:
+        graph, source = PanelGraph(), None
+    cached = 0
+    if cache is not None and questionnaire_endpoint:
+        cached = graph.load_cached_questionnaires(cache, questionnaire_endpoint)
+    sources = ([source] if source else []) + ([f"{cached} cached Questionnaires"] if cached else [])
+    print(f"Panel graph: {len(graph)} panels from {', '.join(sources) or 'nothing yet'} "
+          f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return graph
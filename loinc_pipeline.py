@@ -0,0 +1,161 @@
+import queue
+import threading
+import time
+
+# --- Pipeline Defaults ---
+DEFAULT_QUEUE_SIZE = 16 # Max items waiting in front of each stage
+
+_END = object() # End-of-input marker passed down the queues
+
+
+class StageError:
+    """An item whose processing raised in `stage`. Later stages pass it on untouched,
+       except those built with `handle_errors=True`, which get it in place of the item."""
+
+    def __init__(self, stage, item, error):
+        self.stage = stage
+        self.item = item
+        self.error = error
+
+    def __repr__(self):
+        return f"StageError({self.stage!r}, {type(self.error).__name__}: {self.error})"
+
+
+class Stage:
+    """One pipeline step: `func(item) -> item` run by `workers` threads."""
+
+    def __init__(self, name, func, workers=1, handle_errors=False):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.handle_errors = handle_errors
+        # Metrics
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def _record(self, depth, busy, failed=False):
+        with self._lock:
+            self.processed += 1
+            self.failed += failed
+            self.busy_seconds += busy
+            self.depth_samples += 1
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def summary(self, elapsed):
+        avg_depth = self.depth_total / self.depth_samples if self.depth_samples else 0.0
+        utilization = self.busy_seconds / (elapsed * self.workers) if elapsed > 0 else 0.0
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        failed = f"  failed={self.failed}" if self.failed else ""
+        return (f"  {self.name:<10} {self.processed:>5} items  {rate:7.2f}/s  workers={self.workers:<2} "
+                f"busy={utilization:5.0%}  queue avg={avg_depth:4.1f} max={self.max_depth}{failed}")
+
+
+class Pipeline:
+    """Runs items through a chain of stages connected by bounded queues.
+
+    Every stage works concurrently on different items, so a slow call in one
+    stage only holds up that stage's worker while the others keep going. When
+    a queue is full, the stage feeding it blocks, which keeps memory bounded.
+    At most `window` items are admitted but not yet yielded, so a slow early
+    item cannot make finished later ones pile up in the reorder buffer
+    (default: enough to fill every queue and worker).
+    `run` yields the results in input order. An item whose stage raises is not
+    dropped: it goes on as a StageError (see `Stage.handle_errors`), so one bad
+    item never stops the others. Stage metrics (throughput,
+    utilization, queue depth) point at the bottleneck; see `summary`. With a
+    MetricsRegistry, each item's time in a stage also goes into the
+    `loinc_stage_seconds{stage=...}` histogram."""
+
+    def __init__(self, stages, queue_size=DEFAULT_QUEUE_SIZE, metrics=None, window=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.window = window or queue_size * len(stages) + sum(stage.workers for stage in stages)
+        self.metrics = metrics
+        self.elapsed = 0.0
+
+    def _worker(self, stage, inbox, outbox, remaining):
+        while True:
+            entry = inbox.get()
+            if entry is _END:
+                with remaining["lock"]:
+                    remaining["count"] -= 1
+                    last = remaining["count"] == 0
+                if last: # Last worker out passes the end marker on
+                    for _ in range(remaining["next_workers"]):
+                        outbox.put(_END)
+                return
+            index, item = entry
+            if isinstance(item, StageError) and not stage.handle_errors: # Failed upstream; hand it on
+                outbox.put(entry)
+                continue
+            depth = inbox.qsize()
+            busy_start = time.monotonic()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                print(f"ERROR: Pipeline stage '{stage.name}' failed on item {index}: {type(e).__name__}: {e}")
+                result = StageError(stage.name, item, e)
+            busy = time.monotonic() - busy_start
+            stage._record(depth, busy, failed=isinstance(result, StageError))
+            if self.metrics is not None:
+                self.metrics.observe("loinc_stage_seconds", busy, stage=stage.name)
+            outbox.put((index, result))
+
+    def run(self, items):
+        """Yields the result (or StageError) of every item in input order. If iterating
+           `items` raises, the items read so far are finished and yielded, then it is re-raised."""
+        start = time.monotonic()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        queues.append(queue.Queue()) # Results; holds at most `window` items
+        in_flight = threading.BoundedSemaphore(self.window) # One slot per item admitted but not yet yielded
+        for i, stage in enumerate(self.stages):
+            next_workers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            remaining = {"count": stage.workers, "next_workers": next_workers, "lock": threading.Lock()}
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(stage, queues[i], queues[i + 1], remaining),
+                                          name=f"pipeline-{stage.name}", daemon=True)
+                thread.start()
+
+        input_errors = []
+
+        def feed():
+            try:
+                for entry in enumerate(items):
+                    in_flight.acquire()
+                    queues[0].put(entry)
+            except Exception as e:
+                input_errors.append(e)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_END)
+        feeder = threading.Thread(target=feed, name="pipeline-feed", daemon=True)
+        feeder.start()
+
+        # Reorder buffer: results can finish out of order, the caller gets them in input order
+        pending = {}
+        next_index = 0
+        while True:
+            entry = queues[-1].get()
+            if entry is _END:
+                break
+            index, result = entry
+            pending[index] = result
+            while next_index in pending:
+                result = pending.pop(next_index)
+                next_index += 1
+                in_flight.release()
+                yield result
+        self.elapsed = time.monotonic() - start
+        if input_errors:
+            raise input_errors[0]
+
+    def summary(self):
+        lines = [f"Pipeline stages ({self.elapsed:.1f}s wall):"]
+        lines.extend(stage.summary(self.elapsed) for stage in self.stages)
+        return "\n".join(lines)
@@ -0,0 +1,113 @@
+from loinc_normalize import TOKEN_PATTERN, TOKEN_SYNONYMS, normalize_term
+
+# --- Scoring Weights (features are 0..1, so scores are 0..1) ---
+DEFAULT_WEIGHTS = {
+    "name_coverage": 0.35,     # Share of the term's tokens found in the LOINC name
+    "component": 0.25,         # Token overlap (Jaccard) between the term and COMPONENT
+    "name_precision": 0.10,    # Share of the LOINC name's tokens that the term asked for (prefers concise names)
+    "system": 0.10,            # SYSTEM agrees with a specimen named in the term
+    "panel_fit": 0.10,         # Multi-parameter tests -> panels, single parameters -> observations
+    "parameter_overlap": 0.05, # Internal parameter names mentioned in the LOINC name
+    "api_rank": 0.05,          # Tie-breaker: the Search API's own order
+}
+
+# Specimen words in an input term -> LOINC SYSTEM values they agree with (lowercase)
+SPECIMEN_SYSTEMS = {
+    "serum": {"ser", "ser/plas", "ser/plas/bld"},
+    "plasma": {"plas", "ser/plas", "ser/plas/bld"},
+    "blood": {"bld", "bldc", "bldv", "blda", "ser/plas/bld", "rbc"},
+    "urine": {"urine", "urine sed"},
+    "csf": {"csf"},
+    "fluid": {"fld", "body fld"},
+    "semen": {"semen"},
+    "stool": {"stool"},
+}
+
+# Lab shorthand that shares no tokens with the LOINC name -> tokens it stands for
+ABBREVIATIONS = {
+    "sgpt": ["alanine", "aminotransferase"], "alt": ["alanine", "aminotransferase"],
+    "sgot": ["aspartate", "aminotransferase"], "ast": ["aspartate", "aminotransferase"],
+    "crp": ["c", "reactive", "protein"], "tsh": ["thyrotropin"], "tlc": ["leukocytes"],
+    "hba1c": ["hemoglobin", "a1c"], "ldl": ["ldl", "cholesterol"], "hdl": ["hdl", "cholesterol"],
+    "vldl": ["vldl", "cholesterol"], "esr": ["erythrocyte", "sedimentation", "rate"],
+    "pcv": ["hematocrit"], "hct": ["hematocrit"], "rbcs": ["erythrocytes"], "rbc": ["erythrocytes"],
+    "wbc": ["leukocytes"], "aso": ["streptolysin", "o", "antibody"], "psa": ["prostate", "specific", "ag"],
+    "afp": ["alpha", "1", "fetoprotein"], "cea": ["carcinoembryonic", "ag"], "bun": ["urea", "nitrogen"],
+    "uric": ["urate"], "sugar": ["glucose"],
+}
+
+# Words that say nothing about which analyte was meant
+STOP_TOKENS = {"test", "tests", "panel", "profile", "level", "total", "count", "in", "of", "by", "or", "and", "the"}
+
+
+def _tokens(text):
+    return {TOKEN_SYNONYMS.get(token, token) for token in TOKEN_PATTERN.findall(str(text or "").lower())}
+
+
+def _is_panel(hit):
+    return hit.get("PanelType") == "Panel" or str(hit.get("CLASS") or "").startswith("PANEL")
+
+
+class CandidateScorer:
+    """Scores Search API hits for how well they match one internal test/parameter name.
+
+    The term's features (tokens, abbreviations, specimen, parameter tokens) are
+    derived once; `score_all` then scores every candidate of the search with a
+    few set operations each. Features are combined with `weights` into a score
+    between 0 and 1. `parameter_names` (a test's internal parameters) let the
+    scorer prefer panels for multi-parameter tests and observations otherwise."""
+
+    def __init__(self, term, parameter_names=(), weights=DEFAULT_WEIGHTS):
+        self.term = term
+        self.weights = weights
+        raw_tokens = _tokens(term)
+        self.specimens = {token for token in raw_tokens if token in SPECIMEN_SYSTEMS}
+        self.expected_systems = set().union(*(SPECIMEN_SYSTEMS[s] for s in self.specimens)) if self.specimens else set()
+        tokens = set(normalize_term(term).split()) - STOP_TOKENS - self.specimens
+        for token in list(tokens):
+            tokens.update(ABBREVIATIONS.get(token, ()))
+        self.query_tokens = tokens or raw_tokens
+        parameter_names = [name for name in parameter_names if name and str(name).strip()]
+        self.parameter_count = len(parameter_names)
+        self.parameter_tokens = set().union(*(_tokens(normalize_term(str(name))) for name in parameter_names)) \
+            - STOP_TOKENS - set(SPECIMEN_SYSTEMS) if parameter_names else set()
+
+    def features(self, hit, api_rank=1):
+        name_tokens = _tokens(hit.get("LONG_COMMON_NAME")) | _tokens(hit.get("SHORTNAME"))
+        component_tokens = _tokens(hit.get("COMPONENT"))
+        query = self.query_tokens
+        matched = len(query & name_tokens)
+        system = str(hit.get("SYSTEM") or "").lower()
+        if self.expected_systems:
+            system_score = 1.0 if system in self.expected_systems else 0.0
+        else:
+            system_score = 0.5
+        if self.parameter_count:
+            panel_fit = 1.0 if _is_panel(hit) == (self.parameter_count > 1) else 0.0
+        else:
+            panel_fit = 0.5
+        return {
+            "name_coverage": matched / len(query) if query else 0.0,
+            "component": len(query & component_tokens) / len(query | component_tokens) if component_tokens else 0.0,
+            "name_precision": matched / len(name_tokens - STOP_TOKENS) if name_tokens - STOP_TOKENS else 0.0,
+            "system": system_score,
+            "panel_fit": panel_fit,
+            "parameter_overlap": (len(self.parameter_tokens & name_tokens) / len(self.parameter_tokens)
+                                  if self.parameter_tokens else 0.0),
+            "api_rank": 1.0 / api_rank,
+        }
+
+    def score(self, hit, api_rank=1):
+        features = self.features(hit, api_rank)
+        return round(sum(self.weights.get(name, 0.0) * value for name, value in features.items()), 3)
+
+    def score_all(self, hits):
+        """Scores a whole candidate list (API order) in one pass."""
+        return [self.score(hit, rank) for rank, hit in enumerate(hits, start=1)]
+
+    def rerank(self, ranked_hits):
+        """Takes [(api_rank, hit), ...] and returns [(api_rank, hit, score), ...],
+           best score first (ties keep the API order)."""
+        scored = [(rank, hit, self.score(hit, rank)) for rank, hit in ranked_hits]
+        scored.sort(key=lambda item: (-item[2], item[0]))
+        return scored
@@ -0,0 +1,119 @@
+import sys
+from itertools import repeat
+
+# --- Record Schema ---
+# Search API field -> (HitBatch column, value used when the field is missing). Only these are read.
+API_FIELDS = {
+    "LOINC_NUM": ("code", "Parse Error"),
+    "LONG_COMMON_NAME": ("long_common_name", "N/A"),
+    "SHORTNAME": ("short_name", "N/A"),
+    "STATUS": ("status", "N/A"),
+    "CLASSTYPE": ("class_type", None),
+    "CLASS": ("loinc_class", "N/A"),
+    "COMPONENT": ("component", "N/A"),
+    "PROPERTY": ("property", "N/A"),
+    "TIME_ASPCT": ("time_aspect", "N/A"),
+    "SYSTEM": ("system", "N/A"),
+    "SCALE_TYP": ("scale_type", "N/A"),
+    "METHOD_TYP": ("method_type", "N/A"),
+    "EXAMPLE_UNITS": ("example_units", "N/A"),
+    "PanelType": ("panel_type", None),
+}
+HIT_ATTRIBUTES = tuple(attribute for attribute, _ in API_FIELDS.values())
+
+# Low-cardinality fields repeated across hits: interned, so all hits share one string per value
+INTERNED_ATTRIBUTES = {"status", "loinc_class", "system", "scale_type", "property", "time_aspect",
+                       "method_type", "example_units", "panel_type"}
+
+# Output column -> HitBatch column, in the row order each script writes.
+# "search_term", "rank", "score" and "url" are per-batch/derived columns, the rest come from API_FIELDS.
+FETCH_LAYOUT = {
+    "search_term": "search_term", "match_rank": "rank", "match_score": "score", "loinc": "code",
+    "long_common_name": "long_common_name", "status": "status", "class_type": "class_type",
+    "component": "component", "property": "property", "time_aspect": "time_aspect", "system": "system",
+    "scale_type": "scale_type", "method_type": "method_type", "example_units": "example_units",
+    "class": "loinc_class", "short_name": "short_name", "loinc_url": "url",
+}
+AGGREG_LAYOUT = {
+    "search_term": "search_term", "match_rank": "rank", "match_score": "score", "loinc_test_code": "code",
+    "loinc_test_long_name": "long_common_name", "loinc_test_status": "status",
+    "loinc_test_class_type": "class_type", "loinc_test_component": "component",
+    "loinc_test_property": "property", "loinc_test_time": "time_aspect", "loinc_test_system": "system",
+    "loinc_test_scale": "scale_type", "loinc_test_method": "method_type", "loinc_test_class": "loinc_class",
+    "loinc_test_short_name": "short_name", "loinc_test_url": "url",
+    "_panel_type": "panel_type", # Not an output column; read by the panel pre-check
+}
+
+
+def hit_url(code):
+    """The loinc.org URL the scripts write for a hit's code."""
+    return f"https://loinc.org/{code}" if code != "Parse Error" else "N/A"
+
+
+def _hit_values(hit):
+    """Column values of a Search API hit (a dict or a loinc_json.SearchHit), in HIT_ATTRIBUTES order."""
+    values = []
+    for key, (attribute, default) in API_FIELDS.items():
+        value = hit.get(key, default)
+        if attribute in INTERNED_ATTRIBUTES and type(value) is str:
+            value = sys.intern(value)
+        values.append(value)
+    return tuple(values)
+
+
+class HitBatch:
+    """Columnar container for one term's kept hits: one tuple per field instead of one dict per hit.
+
+    Rows are produced on demand in a script's `layout` (output column -> batch column):
+    iterating yields row dicts (for the journal or code that mutates rows), `value_rows`
+    yields plain value tuples for CSV writers, and `column` hands whole columns to
+    the Parquet writer without building rows at all. `for_term` relabels the
+    batch for another search term while sharing the columns (term fan-out)."""
+
+    def __init__(self, search_term, ranks, scores, columns, layout=FETCH_LAYOUT):
+        self.search_term = search_term
+        self.ranks = ranks
+        self.scores = scores
+        self.columns = columns # {HIT_ATTRIBUTES name: tuple of values}
+        self.layout = layout
+
+    @classmethod
+    def from_scored(cls, search_term, scored_hits, layout=FETCH_LAYOUT):
+        """Builds a batch from [(api_rank, hit, score), ...]; hits are raw dicts or SearchHits."""
+        ranks, hits, scores = zip(*scored_hits) if scored_hits else ((), (), ())
+        values = list(zip(*(_hit_values(hit) for hit in hits))) if hits else [()] * len(HIT_ATTRIBUTES)
+        return cls(search_term, ranks, scores, dict(zip(HIT_ATTRIBUTES, values)), layout)
+
+    def __len__(self):
+        return len(self.ranks)
+
+    def for_term(self, search_term):
+        return HitBatch(search_term, self.ranks, self.scores, self.columns, self.layout)
+
+    def column(self, name):
+        """Values of one output column (a layout name), or Nones for columns outside the layout."""
+        source = self.layout.get(name)
+        if source == "search_term":
+            return repeat(self.search_term, len(self))
+        if source == "rank":
+            return self.ranks
+        if source == "score":
+            return self.scores
+        if source == "url":
+            return [hit_url(code) for code in self.columns["code"]]
+        if source is None:
+            return repeat(None, len(self))
+        return self.columns[source]
+
+    def value_rows(self, fieldnames, default=""):
+        """One value tuple per hit for `fieldnames`; columns outside the layout get `default`."""
+        return zip(*(self.column(name) if name in self.layout else repeat(default, len(self))
+                     for name in fieldnames))
+
+    def rows(self):
+        """One fresh row dict per hit, in layout order."""
+        names = list(self.layout)
+        return [dict(zip(names, values)) for values in zip(*(self.column(name) for name in names))]
+
+    def __iter__(self):
+        return iter(self.rows())
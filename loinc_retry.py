@@ -0,0 +1,175 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+# --- Retry / Backoff Defaults ---
+DEFAULT_MAX_ATTEMPTS = 4          # First try + 3 retries
+DEFAULT_BASE_DELAY = 0.5          # Seconds; backoff cap doubles per attempt
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)    # Responses that mean "slow down"
+
+# --- Circuit Breaker Defaults ---
+DEFAULT_FAILURE_THRESHOLD = 5     # Consecutive failures before a host's circuit opens
+DEFAULT_RESET_TIMEOUT = 30.0      # Seconds before a single trial request is let through
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request while the host's circuit is open."""
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """When to retry a request and how long to wait before the next attempt.
+
+    Retries connection/read errors and `retry_statuses` (429 and 5xx by default)
+    up to `max_attempts` in total. Delays use "full jitter" exponential backoff:
+    a random wait between 0 and min(max_delay, base_delay * 2**attempt), so
+    workers that failed together do not retry together. A Retry-After header
+    on the response sets a lower bound on the wait."""
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, retry_statuses=DEFAULT_RETRY_STATUSES):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def is_retryable_status(self, status_code):
+        return status_code in self.retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """Wait before retry number `attempt` (0-based)."""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            return min(self.max_delay, max(backoff, retry_after))
+        return backoff
+
+
+class CircuitBreaker:
+    """Per-host breaker: after `failure_threshold` consecutive failures the circuit
+    opens and requests fail fast with CircuitOpenError. After `reset_timeout`
+    one trial request is allowed (half-open). Success closes the circuit again;
+    failure re-opens it. Any other outcome (429/4xx, an unexpected error) ends
+    the trial without deciding, so the next request is the trial."""
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_request(self, host=""):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                raise CircuitOpenError(f"Circuit open for {host or 'host'} after {self.failures} consecutive failures")
+            self.trial_in_flight = True # Half-open: let exactly one request through
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_neutral(self):
+        """A request that says nothing about host health finished: ends a half-open trial only."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    self.times_opened += 1
+                self.opened_at = time.monotonic() # (Re-)open; a failed trial restarts the timeout
+            self.trial_in_flight = False
+
+
+class CircuitBreakers:
+    """One CircuitBreaker per host, created on first use."""
+
+    def __init__(self, **breaker_options):
+        self.breaker_options = breaker_options
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def for_url(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(**self.breaker_options)
+        return host, breaker
+
+    def times_opened(self):
+        with self._lock:
+            return sum(breaker.times_opened for breaker in self._breakers.values())
+
+
+class AimdRateController:
+    """Additive-increase / multiplicative-decrease control of a RateLimiter's rate.
+
+    Each successful request adds `additive_increase / rate` requests/second, which
+    works out to about +`additive_increase` rps for every second of healthy traffic,
+    up to `max_rate`. A throttling answer (429/503) multiplies the rate by
+    `decrease_factor`, at most once per `cooldown` seconds so one burst of 429s
+    counts as a single signal, down to `min_rate`."""
+
+    def __init__(self, limiter, min_rate=1.0, max_rate=None, additive_increase=0.5,
+                 decrease_factor=0.5, cooldown=2.0):
+        self.limiter = limiter
+        self.min_rate = min_rate
+        self.max_rate = max_rate if max_rate is not None else limiter.rate * 2
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.decreases = 0
+        self.peak_rate = limiter.rate
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def on_success(self):
+        with self._lock:
+            rate = self.limiter.rate
+            if rate < self.max_rate:
+                rate = min(self.max_rate, rate + self.additive_increase / rate)
+                self.limiter.set_rate(rate)
+                self.peak_rate = max(self.peak_rate, rate)
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self.limiter.set_rate(max(self.min_rate, self.limiter.rate * self.decrease_factor))
+            self.decreases += 1
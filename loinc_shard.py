@@ -0,0 +1,238 @@
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import time
+import zlib
+from itertools import zip_longest
+
+import fetch_loinc
+import loinc_aggreg
+from loinc_columnar import FLOAT_COLUMNS, INTEGER_COLUMNS, read_input_frame
+from loinc_export import open_mapping_exporter, open_row_writer, open_text_input
+
+# --- Shard Defaults ---
+DEFAULT_WORKERS = 4               # Worker processes, one shard each
+DEFAULT_WORK_DIR = "loinc_shards" # One sub-directory per shard: input, outputs, checkpoints, log
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARD_INPUT = "input.csv"
+SHARD_LOG = "output.log"
+SHARD_MAPPING = "mapping.csv"     # loinc_aggreg.py shard output (table format; summary in mapping_summary.csv)
+POLL_SECONDS = 0.5
+
+
+def shard_of(key, workers):
+    """Stable shard number for a key: the same on every run and machine, unlike hash()."""
+    return zlib.crc32(str(key).encode("utf-8")) % workers
+
+
+def restore_types(row):
+    """Turns the numeric columns of a row read back from CSV into numbers again, as the
+       scripts wrote them (blank -> None; sentinels such as "N/A" stay strings)."""
+    for column in row.keys() & (INTEGER_COLUMNS.keys() | FLOAT_COLUMNS.keys()):
+        value = row[column]
+        if value == "":
+            row[column] = None
+            continue
+        try:
+            row[column] = int(value) if column in INTEGER_COLUMNS else float(value)
+        except ValueError:
+            pass
+    return row
+
+
+def read_rows(path):
+    if not os.path.exists(path):
+        return []
+    with open_text_input(path) as f:
+        return [restore_types(row) for row in csv.DictReader(f)]
+
+
+def shard_dir(work_dir, shard, workers):
+    path = os.path.join(work_dir, f"shard-{shard + 1:03d}-of-{workers:03d}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# --- Splitting Inputs ---
+def split_aggreg_input(inputs, workers, work_dir):
+    """Splits the test-to-parameter rows by a hash of test_id, so every test (with all of its
+       parameter rows) lands in exactly one shard. Returns the directories of non-empty shards."""
+    import pandas as pd
+    input_df = pd.concat([read_input_frame(path, dtype=str) for path in inputs], ignore_index=True)
+    shards = input_df["test_id"].fillna("").map(lambda test_id: shard_of(test_id, workers))
+    shard_dirs = []
+    for shard in range(workers):
+        part = input_df[shards == shard]
+        if part.empty:
+            continue
+        path = shard_dir(work_dir, shard, workers)
+        part.to_csv(os.path.join(path, SHARD_INPUT), index=False)
+        shard_dirs.append(path)
+        print(f"  {path}: {part['test_id'].nunique()} tests, {len(part)} rows")
+    return shard_dirs
+
+
+def read_fetch_terms(inputs):
+    test_names, parameter_names = [], []
+    for path in inputs:
+        tests, parameters = fetch_loinc.read_terms_csv(path)
+        test_names += tests
+        parameter_names += parameters
+    return list(dict.fromkeys(test_names)), list(dict.fromkeys(parameter_names))
+
+
+def split_fetch_input(test_names, parameter_names, workers, work_dir):
+    """Splits the terms by a hash of their search group's query, so near-duplicate terms that
+       share one search stay together. Returns the directories of non-empty shards."""
+    shards = [([], []) for _ in range(workers)]
+    for position, terms in enumerate((test_names, parameter_names)):
+        for group in fetch_loinc.search_groups(terms):
+            shards[shard_of(group.query, workers)][position].extend(group.members)
+    shard_dirs = []
+    for shard, (tests, parameters) in enumerate(shards):
+        if not tests and not parameters:
+            continue
+        path = shard_dir(work_dir, shard, workers)
+        with open(os.path.join(path, SHARD_INPUT), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["test_name", "parameter_name"])
+            writer.writerows(zip_longest(tests, parameters, fillvalue=""))
+        shard_dirs.append(path)
+        print(f"  {path}: {len(tests)} test names, {len(parameters)} parameter names")
+    return shard_dirs
+
+
+# --- Running Shards ---
+def run_shards(script, shard_dirs, script_args, requests_per_second):
+    """Runs `script` once per shard directory, all at the same time, each with an equal share
+       of the request budget and the shared response cache. Returns the failed shard directories.
+       The share is also each worker's adaptive-rate ceiling, so together they never exceed the budget."""
+    share = str(requests_per_second / len(shard_dirs))
+    env = dict(os.environ,
+               LOINC_REQUESTS_PER_SECOND=share,
+               LOINC_MAX_REQUESTS_PER_SECOND=share,
+               LOINC_CACHE_PATH=os.path.abspath(fetch_loinc.CACHE_PATH),
+               LOINC_LOCAL_INDEX_PATH=os.path.abspath(fetch_loinc.LOCAL_INDEX_PATH))
+    if env.get("LOINC_PANELS_CSV"):
+        env["LOINC_PANELS_CSV"] = os.path.abspath(env["LOINC_PANELS_CSV"])
+    start_time = time.time()
+    running = {}
+    for path in shard_dirs:
+        log = open(os.path.join(path, SHARD_LOG), "w", encoding="utf-8")
+        process = subprocess.Popen([sys.executable, "-u", os.path.join(SCRIPT_DIR, script), *script_args],
+                                   cwd=path, env=env, stdout=log, stderr=subprocess.STDOUT)
+        running[path] = (process, log)
+    print(f"Started {len(running)} {script} workers at {requests_per_second / len(shard_dirs):.2f} requests/s each")
+    failed = []
+    while running:
+        time.sleep(POLL_SECONDS)
+        for path, (process, log) in list(running.items()):
+            if process.poll() is None:
+                continue
+            log.close()
+            del running[path]
+            status = "done" if process.returncode == 0 else f"FAILED (exit code {process.returncode})"
+            print(f"  {path}: {status} after {time.time() - start_time:.1f}s, log in {os.path.join(path, SHARD_LOG)}")
+            if process.returncode != 0:
+                failed.append(path)
+    return failed
+
+
+# --- Merging Shard Outputs ---
+def merge_aggreg(shard_dirs, output_path, output_format):
+    """Writes the shards' tables into one output, in the order a single loinc_aggreg.py run
+       uses (tests sorted by test_id), through the same exporter."""
+    summary_rows, test_rows = [], {}
+    for path in shard_dirs:
+        summary_rows += read_rows(os.path.join(path, os.path.splitext(SHARD_MAPPING)[0] + "_summary.csv"))
+        for row in read_rows(os.path.join(path, SHARD_MAPPING)):
+            test_rows.setdefault(row["test_id"], []).append(row)
+    summary_rows.sort(key=lambda row: row["test_id"])
+    exporter = open_mapping_exporter(output_path, output_format)
+    exporter.write_summary(loinc_aggreg.SUMMARY_COLUMNS, summary_rows)
+    for summary in summary_rows:
+        rows = test_rows.get(summary["test_id"])
+        if rows:
+            exporter.write_test_sheet(loinc_aggreg.clean_sheet_name(summary["test_name"]),
+                                      loinc_aggreg.SHEET_COLUMNS, rows,
+                                      test_id=summary["test_id"], test_name=summary["test_name"])
+    exporter.close()
+    print(f"Merged {len(summary_rows)} tests into {output_path}")
+
+
+def merge_fetch(shard_dirs, test_names, parameter_names, tests_output, parameters_output):
+    """Writes the shards' result rows into the two fetch_loinc.py outputs, in input-term order."""
+    for terms, shard_output, output in ((test_names, fetch_loinc.OUTPUT_CSV_TESTS, tests_output),
+                                        (parameter_names, fetch_loinc.OUTPUT_CSV_PARAMETERS, parameters_output)):
+        rows_by_term = {}
+        for path in shard_dirs:
+            for row in read_rows(os.path.join(path, shard_output)):
+                rows_by_term.setdefault(row["search_term"], []).append(row)
+        with open_row_writer(output, fetch_loinc.fieldnames) as writer:
+            for group in fetch_loinc.search_groups(terms):
+                for member in group.members:
+                    writer.write_rows(rows_by_term.get(member, []))
+        print(f"Merged {writer.rows_written} rows into {output}")
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run loinc_aggreg.py or fetch_loinc.py as several worker processes over a large input "
+                    "and merge their outputs. Arguments after '--' are passed to every worker.")
+    parser.add_argument("script", choices=["aggreg", "fetch"])
+    parser.add_argument("inputs", nargs="+",
+                        help="Input CSVs with test_id/test_name/parameter_name columns (aggreg also reads .parquet)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Worker processes (shards)")
+    parser.add_argument("--requests-per-second", type=float, default=fetch_loinc.REQUESTS_PER_SECOND,
+                        help="Total request budget, split evenly across the workers")
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR,
+                        help="Shard directories (inputs, outputs, checkpoints, logs) go here")
+    parser.add_argument("--output-format", choices=["xlsx", "csv", "parquet"], default=loinc_aggreg.OUTPUT_FORMAT,
+                        help="aggreg: merged output format")
+    parser.add_argument("--output", help="aggreg: merged output path (default: OUTPUT_EXCEL with the matching extension)")
+    parser.add_argument("--tests-output", default=fetch_loinc.OUTPUT_CSV_TESTS, help="fetch: merged test results")
+    parser.add_argument("--parameters-output", default=fetch_loinc.OUTPUT_CSV_PARAMETERS,
+                        help="fetch: merged parameter results")
+    argv = sys.argv[1:]
+    script_args = []
+    if "--" in argv:
+        argv, script_args = argv[:argv.index("--")], argv[argv.index("--") + 1:]
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    for path in args.inputs:
+        if not os.path.exists(path):
+            print(f"ERROR: Input file not found: {path}")
+            sys.exit(1)
+
+    start_time = time.time()
+    print(f"Splitting {len(args.inputs)} input file(s) into {args.workers} shards under {args.work_dir}...")
+    if args.script == "aggreg":
+        shard_dirs = split_aggreg_input(args.inputs, args.workers, args.work_dir)
+        worker_args = ["--input", SHARD_INPUT, "--output-format", "csv", "--output", SHARD_MAPPING]
+        script = "loinc_aggreg.py"
+    else:
+        test_names, parameter_names = read_fetch_terms(args.inputs)
+        shard_dirs = split_fetch_input(test_names, parameter_names, args.workers, args.work_dir)
+        worker_args = ["--terms-csv", SHARD_INPUT]
+        script = "fetch_loinc.py"
+    if not shard_dirs:
+        print("ERROR: The inputs contain no tests.")
+        sys.exit(1)
+
+    failed = run_shards(script, shard_dirs, worker_args + script_args, args.requests_per_second)
+    if failed:
+        print(f"ERROR: {len(failed)} of {len(shard_dirs)} shards failed; see their logs. "
+              f"Re-run with '-- --resume' to continue from the shard checkpoints.")
+        sys.exit(1)
+
+    print("Merging shard outputs...")
+    if args.script == "aggreg":
+        output_path = args.output or (os.path.splitext(loinc_aggreg.OUTPUT_EXCEL)[0] + "." + args.output_format)
+        merge_aggreg(shard_dirs, output_path, args.output_format)
+    else:
+        merge_fetch(shard_dirs, test_names, parameter_names, args.tests_output, args.parameters_output)
+    print(f"\nSharded run finished in {time.time() - start_time:.2f} seconds.")
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loinc_async import AsyncLoincClient, ClientConfig # noqa: E402
+
+
+class StubClient:
+    """Answers every request with the same decoded body."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_json(self, url, params, **kwargs):
+        return self.data
+
+    def close(self):
+        pass
+
+
+class NullResultsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = AsyncLoincClient(ClientConfig(concurrency=1))
+        self.client.client = StubClient({"ResponseSummary": {"RecordsFound": 0}, "Results": None})
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_search_returns_no_hits(self):
+        self.assertEqual(asyncio.run(self.client.search("Serum Iron")), [])
+
+    def test_lcn_search_fallback_reports_not_found(self):
+        self.assertEqual(self.client._lcn_by_search("2498-4"), "2498-4 (LCN Not Found)")
+
+
+class MapTestConcurrencyTest(unittest.TestCase):
+    def test_candidates_resolve_their_names_concurrently(self):
+        client = AsyncLoincClient(ClientConfig(concurrency=1))
+        client.client = StubClient({})
+        running = {"now": 0, "max": 0}
+
+        async def search(term, config=None, parameter_names=()):
+            return [{"LOINC_NUM": f"P{i}", "LONG_COMMON_NAME": f"Panel {i}", "match_rank": i, "match_score": None}
+                    for i in range(3)]
+
+        async def expand_panel(panel_code):
+            return [f"{panel_code}-a", f"{panel_code}-b"]
+
+        async def lookup_lcn(codes):
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            await asyncio.sleep(0.01)
+            running["now"] -= 1
+            return [f"name of {code}" for code in codes]
+
+        client.search, client.expand_panel, client.lookup_lcn = search, expand_panel, lookup_lcn
+        try:
+            result = asyncio.run(client.map_test("PANEL TEST", ["name of P1-a"]))
+        finally:
+            client.close()
+        self.assertEqual(running["max"], 3)
+        self.assertEqual([c["parameter_names"] for c in result["candidates"]],
+                         [[f"name of P{i}-a", f"name of P{i}-b"] for i in range(3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
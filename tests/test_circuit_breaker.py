@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loinc_client import LoincClient # noqa: E402
+from loinc_retry import CircuitBreakers, CircuitOpenError, RetryPolicy # noqa: E402
+
+URL = "http://loinc.test/searchapi/loincs"
+RESET_TIMEOUT = 0.05
+
+
+def make_response(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = URL
+    response._content = b'{"Results": []}'
+    return response
+
+
+class ScriptedSession:
+    """Stands in for requests.Session: answers each request with the next scripted status
+       (or raises it, if it is an exception)."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+
+    def request(self, method, url, **kwargs):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return make_response(outcome)
+
+
+class HalfOpenTrialTest(unittest.TestCase):
+    def open_breaker(self, *trial_outcomes):
+        session = ScriptedSession(503, 503, *trial_outcomes, 200)
+        client = LoincClient(session=session, retry_policy=RetryPolicy(1),
+                             breakers=CircuitBreakers(failure_threshold=2, reset_timeout=RESET_TIMEOUT))
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                client._request("GET", URL)
+        with self.assertRaises(CircuitOpenError):
+            client._request("GET", URL)
+        time.sleep(RESET_TIMEOUT * 2) # Half-open: the next request is the trial
+        return client
+
+    def test_throttled_trial_does_not_block_the_host(self):
+        client = self.open_breaker(429)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client._request("GET", URL)
+        self.assertEqual(client._request("GET", URL).status_code, 200)
+        _, breaker = client.breakers.for_url(URL)
+        self.assertEqual(breaker.state, "closed")
+
+    def test_client_error_trial_does_not_block_the_host(self):
+        client = self.open_breaker(404)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client._request("GET", URL)
+        self.assertEqual(client._request("GET", URL).status_code, 200)
+
+    def test_unexpected_error_on_trial_does_not_block_the_host(self):
+        client = self.open_breaker(ValueError("bad response"))
+        with self.assertRaises(ValueError):
+            client._request("GET", URL)
+        self.assertEqual(client._request("GET", URL).status_code, 200)
+
+    def test_failed_trial_reopens_the_circuit(self):
+        client = self.open_breaker(503)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client._request("GET", URL)
+        with self.assertRaises(CircuitOpenError):
+            client._request("GET", URL)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loinc_json import JsonDecoder, available_backends # noqa: E402
+
+
+class SearchResponseTest(unittest.TestCase):
+    def test_null_results_are_no_results_on_every_backend(self):
+        for backend in available_backends():
+            with self.subTest(backend=backend):
+                data = JsonDecoder(backend).search_response(b'{"ResponseSummary": {"RecordsFound": 0}, "Results": null}')
+                self.assertEqual(list(data["Results"]), [])
+
+    def test_hits_read_like_dicts_on_every_backend(self):
+        body = b'{"Results": [{"LOINC_NUM": "2160-0", "STATUS": "ACTIVE", "UNUSED": 1}]}'
+        for backend in available_backends():
+            with self.subTest(backend=backend):
+                (hit,) = JsonDecoder(backend).search_response(body)["Results"]
+                self.assertEqual(hit.get("LOINC_NUM"), "2160-0")
+                self.assertEqual(hit.get("CLASS", "N/A"), "N/A")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loinc_local_index import LOINC_COLUMNS, build_local_index # noqa: E402
+from loinc_panels import PanelGraph # noqa: E402
+
+# Panel P is listed under two parents whose ids differ in digit count: ParentId 99 comes first
+PANEL_ROWS = [
+    ["100", "101", "1", "P", "B", "Second occurrence"],
+    ["99", "98", "2", "P", "A2", "First occurrence, second member"],
+    ["99", "97", "1", "P", "A1", "First occurrence, first member"],
+    ["n/a", "5", "1", "Q", "C", "No numeric ParentId"],
+]
+FIRST_BLOCK = [("A1", "First occurrence, first member"), ("A2", "First occurrence, second member")]
+
+
+class FirstOccurrenceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.panels_csv = os.path.join(self.dir, "PanelsAndForms.csv")
+        with open(self.panels_csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["ParentId", "ID", "SEQUENCE", "ParentLoinc", "Loinc", "LoincName"])
+            writer.writerows(PANEL_ROWS)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_csv_loader_keeps_lowest_numeric_parent_id(self):
+        graph = PanelGraph.from_panels_csv(self.panels_csv)
+        self.assertEqual(graph.children, {"P": FIRST_BLOCK})
+
+    def test_local_index_agrees_with_csv_loader(self):
+        loinc_csv = os.path.join(self.dir, "Loinc.csv")
+        with open(loinc_csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(LOINC_COLUMNS)
+            writer.writerow(["1-8"] + [""] * (len(LOINC_COLUMNS) - 1))
+        db_path = os.path.join(self.dir, "index.sqlite")
+        build_local_index(loinc_csv, db_path, self.panels_csv)
+        graph = PanelGraph.from_local_index(db_path)
+        self.assertEqual({code: list(members) for code, members in graph.children.items()}, {"P": FIRST_BLOCK})
+
+
+if __name__ == "__main__":
+    unittest.main()
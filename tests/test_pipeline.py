@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loinc_pipeline import Pipeline, Stage, StageError # noqa: E402
+
+
+class PipelineTest(unittest.TestCase):
+    def test_slow_first_item_bounds_items_in_flight(self):
+        started = []
+        lock = threading.Lock()
+
+        def work(item):
+            with lock:
+                started.append(item)
+            if item == 0:
+                time.sleep(0.3)
+            return item
+
+        pipeline = Pipeline([Stage("slow", work, workers=3), Stage("next", lambda item: item)], window=5)
+        results = []
+        for result in pipeline.run(range(40)):
+            if result == 0:
+                self.assertLess(max(started), 5)
+            results.append(result)
+        self.assertEqual(results, list(range(40)))
+
+    def test_failing_item_reaches_error_handling_stage(self):
+        def work(item):
+            if item == 2:
+                raise ValueError("bad item")
+            return item
+
+        def finish(item):
+            return ("error", item.stage, item.item) if isinstance(item, StageError) else item
+
+        pipeline = Pipeline([Stage("work", work, workers=2), Stage("finish", finish, handle_errors=True)])
+        self.assertEqual(list(pipeline.run(range(4))), [0, 1, ("error", "work", 2), 3])
+
+    def test_failing_input_is_raised_after_the_items_read(self):
+        def items():
+            yield 1
+            yield 2
+            raise RuntimeError("input broke")
+
+        results = []
+        with self.assertRaises(RuntimeError):
+            for result in Pipeline([Stage("work", lambda item: item)]).run(items()):
+                results.append(result)
+        self.assertEqual(results, [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()